@@ -0,0 +1,149 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import AudioAlert, FallAlert, ProximityReading, bed_topic, parse_bed_topic  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def bed_messages(beds, count):
+    """count messages spread round-robin over beds; each bed cycles through
+    in bed, out of bed, fall and a call for help, so every bed's camera toggles."""
+    cycle = [
+        ('proximity/alert', lambda ts: ProximityReading(ts, False, [20.0, 21.5, 19.8])),
+        ('proximity/alert', lambda ts: ProximityReading(ts, True, [80.2, 95.1, 77.4])),
+        ('video/emergency', lambda ts: FallAlert(ts, mediapipe_state='Fallen out of bed', camera_state=True)),
+        ('audio/emergency', lambda ts: AudioAlert(ts, 'Urgent Assistance', 0.91, 'help')),
+    ]
+    messages = []
+    for n in range(count):
+        bed = n % beds
+        kind, build = cycle[(n // beds) % len(cycle)]
+        ts = f"2025-04-01T10:00:00.{n:06d}"
+        messages.append(FakeMessage(bed_topic('1', str(bed), kind), build(ts).encode()))
+    return messages
+
+
+def make_hub(wal_dir):
+    from optimised_hub_final import OptimizedCentralHub
+    # Fall de-duplication off, so every message pays the full handling cost
+    hub = OptimizedCentralHub(wal_dir=wal_dir, metrics_port=None, fall_window=0)
+    hub.logger.setLevel(logging.WARNING)  # Keep log file writes out of the per-message cost
+    hub.publish_qos2 = lambda topic, payload, priority=None: None
+    hub.publish_with_retry = lambda topic, payload, max_retries=3: None
+    return hub
+
+
+def feed(hub, messages):
+    for message in messages:
+        # Same path as a live message, run inline so only the hub's own work is timed
+        hub.on_message(None, None, message)
+        hub.message_processor(*hub.message_queue.get_nowait())
+
+
+def run(beds, count, wal_dir):
+    hub = make_hub(wal_dir)
+    messages = bed_messages(beds, count)
+    start = time.perf_counter()
+    feed(hub, messages)
+    return hub, time.perf_counter() - start
+
+
+def state_size(beds, wal_dir):
+    """Memory the hub keeps after every bed has reported once: state table, topic cache, metric series."""
+    hub = make_hub(wal_dir)
+    feed(hub, bed_messages(1, 8))  # Fixed costs (metric series, first bed) are not per bed
+    messages = bed_messages(beds, beds * 4)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    feed(hub, messages[4:])
+    grown = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return grown
+
+
+def check_routing(beds, wal_dir):
+    """Every output must land on the topics of the bed the input came from."""
+    from optimised_hub_final import OptimizedCentralHub
+    hub = OptimizedCentralHub(wal_dir=wal_dir, metrics_port=None, fall_window=0)
+    hub.logger.setLevel(logging.WARNING)
+    errors = []
+    current = {}
+
+    def publish(topic, payload, *args, **kwargs):
+        ward, bed, kind = parse_bed_topic(topic)
+        if (ward, bed) != current['bed'] or kind not in ('nurse/dashboard', 'video/monitor'):
+            errors.append(f"{current['topic']} -> {topic}")
+    hub.publish_qos2 = publish
+    hub.publish_with_retry = publish
+    for message in bed_messages(beds, beds * 8):
+        ward, bed, _ = parse_bed_topic(message.topic)
+        current.update(bed=(ward, bed), topic=message.topic)
+        hub.on_message(None, None, message)
+        hub.message_processor(*hub.message_queue.get_nowait())
+    camera_states = {state.bed_id: state.camera_state for state in hub.beds}
+    if len(camera_states) != beds:
+        errors.append(f"expected {beds} beds in the state table, found {len(camera_states)}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message hub cost and state size as the number of beds grows")
+    parser.add_argument('--beds', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="Fail if per-message cost at the most beds exceeds this multiple of the fewest")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-bench-'), 'wal')
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # Handlers print per message
+        run(max(args.beds), 2000, wal_dir)  # Warm-up
+        for beds in args.beds:
+            hub, elapsed = run(beds, args.messages, wal_dir)
+            state_bytes = state_size(beds, wal_dir)
+            results.append({
+                'beds': beds,
+                'messages': args.messages,
+                'us_per_message': round(elapsed / args.messages * 1e6, 2),
+                'messages_per_s': round(args.messages / elapsed),
+                'beds_tracked': len(hub.beds),
+                'state_bytes_per_bed': round(state_bytes / max(1, len(hub.beds))),
+            })
+        routing_errors = check_routing(max(args.beds), wal_dir)
+
+    ratio = results[-1]['us_per_message'] / results[0]['us_per_message']
+    if args.json:
+        print(json.dumps({'results': results, 'cost_ratio': round(ratio, 2), 'routing_errors': routing_errors},
+                         indent=2))
+    else:
+        print(f"{'beds':>6}{'us/msg':>10}{'msg/s':>10}{'tracked':>9}{'bytes/bed':>11}")
+        for r in results:
+            print(f"{r['beds']:>6}{r['us_per_message']:>10.2f}{r['messages_per_s']:>10}"
+                  f"{r['beds_tracked']:>9}{r['state_bytes_per_bed']:>11}")
+        print(f"cost at {results[-1]['beds']} beds vs {results[0]['beds']}: {ratio:.2f}x, "
+              f"routing errors: {len(routing_errors)}")
+        for error in routing_errors[:10]:
+            print(f"  {error}")
+    if routing_errors or ratio > args.tolerance:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
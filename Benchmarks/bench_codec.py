@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+
+from alert_schema import (FALLEN_OUT_OF_BED, AudioAlert, CameraActivation, CameraCommand,  # noqa: E402
+                          DashboardAlert, FallAlert, ProximityReading, decode_message, encode_payload, get_codec)
+
+SAMPLES = [
+    ('proximity/alert', ProximityReading('2025-04-01T10:00:00.000001', False, [20.0, 21.5, 19.8])),
+    ('proximity/alert', ProximityReading('2025-04-01T10:00:05.000001', True, [80.2, 95.1, 77.4])),
+    ('video/emergency', FallAlert('2025-04-01T10:00:06.000001', mediapipe_state='Fallen out of bed')),
+    ('video/emergency', FallAlert('2025-04-01T10:00:07.000001', camera_state=True)),
+    ('audio/emergency', AudioAlert('2025-04-01T10:00:08.000001', 'Urgent Assistance', 0.91, 'help me please')),
+]
+
+
+class LegacyHandlers:
+    """The dict-based decode/handle/encode path the hub used before the shared schemas."""
+    def __init__(self, publish_qos2, publish_with_retry):
+        self.publish_qos2 = publish_qos2
+        self.publish_with_retry = publish_with_retry
+        self._last_camera_state = None
+        self.handlers = {
+            'proximity/alert': self.handle_proximity_alert,
+            'audio/emergency': self.handle_audio_alert,
+            'video/emergency': self.handle_fall_alert,
+        }
+        self.priority_rules = {
+            'proximity/alert': self.proximity_priority,
+            'audio/emergency': self.audio_priority,
+            'video/emergency': self.fall_priority,
+        }
+
+    def process(self, topic, raw):
+        if not raw or raw.decode('utf-8').strip() == "":
+            return
+        payload = json.loads(raw.decode('utf-8'))
+        self.priority_rules[topic](payload)
+        self.handlers[topic](payload)
+
+    def audio_priority(self, payload):
+        return 'HIGH' if payload.get('alert_type') in ['Urgent Assistance', 'Pain/Discomfort'] else 'MEDIUM'
+
+    def fall_priority(self, payload):
+        mediapipe_state = payload.get('mediapipe_state', 'No fall detected (Standing, Sitting, Lying Down)')
+        return 'HIGH' if mediapipe_state == 'Fallen out of bed' else 'MEDIUM'
+
+    def proximity_priority(self, payload):
+        return 'HIGH' if payload.get('out_of_bed', False) else 'LOW'
+
+    def handle_audio_alert(self, payload):
+        timestamp = payload.get('timestamp', datetime.now().isoformat())
+        source = payload.get('source', 'audio')
+        priority = self.audio_priority(payload)
+        self.publish_qos2('video/monitor', {'activate': True, 'timestamp': timestamp, 'source': source}, priority)
+        self.publish_qos2('nurse/dashboard', {'activate': True, 'timestamp': timestamp,
+                                              'source': 'camera_activation'}, priority)
+        self.publish_qos2('nurse/dashboard', {
+            'timestamp': timestamp, 'alert_type': payload.get('alert_type'),
+            'confidence': payload.get('confidence'), 'source': source,
+            'details': f"Detected: {payload.get('phrase', '')}", 'priority': priority})
+
+    def handle_fall_alert(self, payload):
+        mediapipe_state = payload.get('mediapipe_state', 'No fall detected (Standing, Sitting, Lying Down)')
+        timestamp = payload.get('timestamp', datetime.now().isoformat())
+        camera_state = payload.get('cameraState', False)
+        priority = self.fall_priority(payload)
+        self.publish_qos2('nurse/dashboard', {
+            'timestamp': timestamp, 'alert_type': 'FALL_DETECTED', 'source': payload.get('source', 'video'),
+            'details': mediapipe_state, 'priority': priority})
+        if camera_state != self._last_camera_state:
+            self._last_camera_state = camera_state
+            self.publish_qos2('nurse/dashboard', {'timestamp': timestamp, 'source': 'camera_activation',
+                                                  'activate': camera_state}, priority)
+
+    def handle_proximity_alert(self, payload):
+        out_of_bed = payload.get('out_of_bed', False)
+        distances = payload.get('distances', [])
+        timestamp = payload.get('timestamp', datetime.now().isoformat())
+        source = payload.get('source', 'proximity')
+        priority = self.proximity_priority(payload)
+        self.publish_with_retry('nurse/dashboard', {
+            'timestamp': timestamp, 'alert_type': 'PROXIMITY_DATA', 'source': source,
+            'details': 'Out of bed' if out_of_bed else 'Still in bed', 'distances': distances, 'priority': 'LOW'})
+        if out_of_bed:
+            self.publish_qos2('nurse/dashboard', {'timestamp': timestamp, 'alert_type': 'PATIENT_OUT_OF_BED',
+                                                  'source': source, 'distances': distances, 'priority': 'HIGH'})
+        if out_of_bed != self._last_camera_state:
+            self._last_camera_state = out_of_bed
+            msg = {'timestamp': timestamp, 'source': source, 'activate': out_of_bed}
+            self.publish_qos2('video/monitor', msg, priority)
+            self.publish_qos2('nurse/dashboard', {'timestamp': timestamp, 'source': 'camera_activation',
+                                                  'activate': out_of_bed}, priority)
+
+
+class Sink:
+    """Counts outbound bytes the way the hub produces them: one encode for the WAL
+    (QoS 2 only) plus one per publish attempt."""
+    def __init__(self, encode, attempts):
+        self.encode = encode
+        self.attempts = attempts
+        self.messages = 0
+        self.bytes = 0
+
+    def publish_qos2(self, topic, payload, priority=None):
+        self.encode(payload)  # WAL append
+        self.publish_with_retry(topic, payload)
+
+    def publish_with_retry(self, topic, payload, max_retries=3):
+        for _ in range(self.attempts):
+            data = self.encode(payload)
+        self.messages += 1
+        self.bytes += len(data)
+
+
+class SchemaHandlers(LegacyHandlers):
+    """The same handlers on validated records, as the hub runs them now."""
+    def process(self, topic, raw):
+        if not raw or not raw.strip():
+            return
+        alert = decode_message(topic, raw)
+        self.priority_rules[topic](alert)
+        self.handlers[topic](alert)
+
+    def audio_priority(self, alert):
+        return 'HIGH' if alert.alert_type in ['Urgent Assistance', 'Pain/Discomfort'] else 'MEDIUM'
+
+    def fall_priority(self, alert):
+        return 'HIGH' if alert.mediapipe_state == FALLEN_OUT_OF_BED else 'MEDIUM'
+
+    def proximity_priority(self, reading):
+        return 'HIGH' if reading.out_of_bed else 'LOW'
+
+    def handle_audio_alert(self, alert):
+        priority = self.audio_priority(alert)
+        self.publish_qos2('video/monitor', CameraCommand(alert.timestamp, alert.source, True), priority)
+        self.publish_qos2('nurse/dashboard', CameraActivation(alert.timestamp, True), priority)
+        self.publish_qos2('nurse/dashboard', DashboardAlert(
+            alert.timestamp, alert.alert_type, alert.source, priority,
+            details=f"Detected: {alert.phrase}", confidence=alert.confidence))
+
+    def handle_fall_alert(self, alert):
+        priority = self.fall_priority(alert)
+        self.publish_qos2('nurse/dashboard', DashboardAlert(
+            alert.timestamp, 'FALL_DETECTED', alert.source, priority, details=alert.mediapipe_state))
+        if alert.camera_state != self._last_camera_state:
+            self._last_camera_state = alert.camera_state
+            self.publish_qos2('nurse/dashboard', CameraActivation(alert.timestamp, alert.camera_state), priority)
+
+    def handle_proximity_alert(self, reading):
+        out_of_bed = reading.out_of_bed
+        priority = self.proximity_priority(reading)
+        self.publish_with_retry('nurse/dashboard', DashboardAlert(
+            reading.timestamp, 'PROXIMITY_DATA', reading.source, 'LOW',
+            details='Out of bed' if out_of_bed else 'Still in bed', distances=reading.distances))
+        if out_of_bed:
+            self.publish_qos2('nurse/dashboard', DashboardAlert(
+                reading.timestamp, 'PATIENT_OUT_OF_BED', reading.source, 'HIGH', distances=reading.distances))
+        if out_of_bed != self._last_camera_state:
+            self._last_camera_state = out_of_bed
+            self.publish_qos2('video/monitor', CameraCommand(reading.timestamp, reading.source, out_of_bed),
+                              priority)
+            self.publish_qos2('nurse/dashboard', CameraActivation(reading.timestamp, out_of_bed), priority)
+
+
+def run(handlers_cls, encode, wire, iterations, attempts, repeat):
+    """Best of repeat runs, so a busy machine does not decide the comparison."""
+    best = None
+    for _ in range(repeat):
+        sink = Sink(encode, attempts)
+        handlers = handlers_cls(sink.publish_qos2, sink.publish_with_retry)
+        start = time.perf_counter()
+        for i in range(iterations):
+            topic, raw = wire[i % len(wire)]
+            handlers.process(topic, raw)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, sink)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message decode + handle + encode cost, old dicts vs schemas")
+    parser.add_argument('--iterations', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per configuration; the fastest is reported")
+    parser.add_argument('--attempts', type=int, nargs='+', default=[1, 3],
+                        help="Publish attempts per outbound message (1 = no retries)")
+    parser.add_argument('--codecs', nargs='+', default=['json', 'msgpack', 'cbor'])
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    codecs = []
+    for name in args.codecs:
+        try:
+            get_codec(name)
+            codecs.append(name)
+        except ValueError as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+
+    results = []
+    for attempts in args.attempts:
+        json_wire = [(topic, json.dumps(record.to_dict()).encode('utf-8')) for topic, record in SAMPLES]
+        legacy_encode = lambda payload: json.dumps(payload).encode('utf-8')  # noqa: E731
+        runs = [('legacy dicts', 'json',
+                 run(LegacyHandlers, legacy_encode, json_wire, args.iterations, attempts, args.repeat))]
+        for name in codecs:
+            codec = get_codec(name)
+            wire = [(topic, record.encode(codec)) for topic, record in SAMPLES]
+            runs.append(('schemas', name, run(SchemaHandlers, lambda payload, c=codec: encode_payload(payload, c),
+                                              wire, args.iterations, attempts, args.repeat)))
+        for path, codec, (elapsed, sink) in runs:
+            results.append({
+                'path': path,
+                'codec': codec,
+                'attempts': attempts,
+                'us_per_message': round(elapsed / args.iterations * 1e6, 2),
+                'messages_per_s': round(args.iterations / elapsed),
+                'outbound_bytes_per_message': round(sink.bytes / max(1, sink.messages), 1),
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'path':<14}{'codec':<9}{'attempts':>9}{'us/msg':>10}{'msg/s':>10}{'out bytes':>11}")
+    for r in results:
+        print(f"{r['path']:<14}{r['codec']:<9}{r['attempts']:>9}{r['us_per_message']:>10.2f}"
+              f"{r['messages_per_s']:>10}{r['outbound_bytes_per_message']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
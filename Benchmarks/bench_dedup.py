@@ -0,0 +1,128 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import FALLEN_OUT_OF_BED, FallAlert, ProximityReading, bed_topic, decode_payload  # noqa: E402
+from mqtt_transport import create_client, reset_default_broker  # noqa: E402
+
+
+def simulate_fall(args, fall_window, fall_summary_interval):
+    """Every bed falls at once and the camera Pi reports it on each frame for fall_seconds,
+    while the ultrasonic sensors keep reporting out of bed every 5 s."""
+    from optimised_hub_final import OptimizedCentralHub
+    broker = reset_default_broker()
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-dedup-'), 'wal')
+    hub = OptimizedCentralHub(wal_dir=wal_dir, metrics_port=None, transport='inprocess', fall_window=fall_window,
+                              fall_summary_interval=fall_summary_interval)
+    hub.logger.setLevel(logging.WARNING)
+    hub_thread = threading.Thread(target=hub.start, daemon=True)
+    hub_thread.start()
+    while not hub.connection_active:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    outputs = {'qos2_publishes': 0, 'fall_alerts': 0}
+    lock = threading.Lock()
+
+    def on_output(client, userdata, message):
+        alert = decode_payload(message.payload)
+        with lock:
+            outputs['qos2_publishes'] += message.qos == 2
+            outputs['fall_alerts'] += alert.get('alert_type') == 'FALL_DETECTED'
+    dashboard = create_client('dedup-dashboard', transport='inprocess')
+    dashboard.on_message = on_output
+    dashboard.connect('localhost')
+    dashboard.subscribe([(bed_topic('+', '+', 'nurse/dashboard'), 2), (bed_topic('+', '+', 'video/monitor'), 2)])
+    dashboard.loop_start()
+    camera = create_client('dedup-camera', transport='inprocess')
+    camera.connect('localhost')
+    camera.loop_start()
+
+    frames = 0
+    start = time.perf_counter()
+    next_proximity = 0.0
+    for frame in range(int(args.fall_seconds * args.fps)):
+        offset = frame / args.fps
+        delay = offset - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+        now = datetime.now().isoformat()
+        for bed in range(args.beds):
+            if offset >= next_proximity:
+                camera.publish(bed_topic('1', bed, 'proximity/alert'),
+                               ProximityReading(now, True, [95.0, 88.2, 101.4]).encode(), qos=2)
+            camera.publish(bed_topic('1', bed, 'video/emergency'),
+                           FallAlert(now, 'video', mediapipe_state=FALLEN_OUT_OF_BED).encode(), qos=2)
+            frames += 1
+        if offset >= next_proximity:
+            next_proximity += 5.0
+    time.sleep(args.settle)
+
+    message_lanes = hub.message_queue.lane_stats()
+    qos2_lanes = hub.qos2_publish_queue.lane_stats()
+    result = {
+        'fall_window': fall_window,
+        'fall_summary_interval': fall_summary_interval,
+        'fall_frames': frames,
+        'deduplicated': hub.metrics.counter('deduplicated', topic='video/emergency').value(),
+        'qos2_publishes': outputs['qos2_publishes'],
+        'fall_alerts': outputs['fall_alerts'],
+        'message_queue_enqueued': sum(lane['enqueued'] for lane in message_lanes.values()),
+        'message_queue_peak': max(lane['peak_depth'] for lane in message_lanes.values()),
+        'message_queue_evicted': sum(lane['evicted'] for lane in message_lanes.values()),
+        'message_wait_max_ms': max(lane['max_wait_ms'] for lane in message_lanes.values()),
+        'qos2_queue_enqueued': sum(lane['enqueued'] for lane in qos2_lanes.values()),
+        'qos2_queue_peak': max(lane['peak_depth'] for lane in qos2_lanes.values()),
+        'broker_messages': broker.stats['published'],
+    }
+    for client in (dashboard, camera):
+        client.disconnect()
+        client.loop_stop()
+    hub.stop()
+    hub_thread.join(timeout=5)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound publishes and queue pressure during a simulated fall, "
+                                                 "with and without hub-side fall de-duplication")
+    parser.add_argument('--beds', type=int, default=4, help="Beds falling at the same time")
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--fall-seconds', type=float, default=15.0)
+    parser.add_argument('--fall-window', type=float, default=10.0)
+    parser.add_argument('--fall-summary-interval', type=float, default=5.0)
+    parser.add_argument('--settle', type=float, default=2.0, help="Seconds to let queues drain after the fall")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # Handlers print per message
+        results = [simulate_fall(args, 0, 0), simulate_fall(args, args.fall_window, args.fall_summary_interval)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    off, on = results
+    print(f"{args.beds} beds falling for {args.fall_seconds:.0f}s at {args.fps:.0f} fps, "
+          f"window {args.fall_window}s, summary every {args.fall_summary_interval}s")
+    print(f"{'':<24}{'off':>10}{'on':>10}{'reduction':>11}")
+    for key in ('qos2_publishes', 'fall_alerts', 'message_queue_enqueued', 'message_queue_peak',
+                'message_queue_evicted', 'message_wait_max_ms', 'qos2_queue_enqueued', 'qos2_queue_peak',
+                'broker_messages'):
+        reduction = f"{1 - on[key] / off[key]:.1%}" if off[key] else '-'
+        print(f"{key:<24}{off[key]:>10}{on[key]:>10}{reduction:>11}")
+    print(f"fall frames {on['fall_frames']}, de-duplicated {on['deduplicated']}")
+
+
+if __name__ == "__main__":
+    main()
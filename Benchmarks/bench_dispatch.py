@@ -0,0 +1,173 @@
+import argparse
+import json
+import math
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub'))
+
+from optimised_hub_final import OptimizedCentralHub
+
+
+class FakeMessage:
+    def __init__(self, enqueued_at):
+        self.topic = 'bench/message'
+        self.payload = b'{}'
+        self.enqueued_at = enqueued_at
+
+
+def enqueue_time(args):
+    """Pull the enqueue timestamp back out of whatever was submitted."""
+    first = args[0]
+    if isinstance(first, FakeMessage):
+        return first.enqueued_at
+    return args[1]['enqueued_at']
+
+
+class RecordingExecutor:
+    """Stands in for the hub's thread pools and records enqueue-to-submit latency. release frees the
+    dispatcher's ack window slot (QoS 2), as if the publish had been acknowledged at once."""
+    def __init__(self, work_queue, release=None):
+        self.work_queue = work_queue
+        self.release = release
+        self.latencies = []
+        self.recording = False
+
+    def acquire(self, timeout=None):
+        return True  # Every item is "run" the moment it is submitted
+
+    def submit(self, fn, *args):
+        now = time.perf_counter()
+        if self.recording:
+            self.latencies.append((now - enqueue_time(args)) * 1000)
+        self.work_queue.task_done()
+        if self.release:
+            self.release()
+
+
+def make_item(name):
+    now = time.perf_counter()
+    if name == 'message':
+        return (FakeMessage(now),)
+    if name == 'proximity':
+        return ('nurse/dashboard', {'enqueued_at': now}, 3)
+    return ('nurse/dashboard', {'enqueued_at': now})
+
+
+def legacy_dispatcher(hub, executors):
+    """The original single submit_tasks loop, kept for comparison."""
+    while hub.running:
+        try:
+            message = hub.message_queue.get(block=True, timeout=1)
+            executors['message'].submit(None, *message)
+        except queue.Empty:
+            pass
+        try:
+            topic, payload, max_retries = hub.proximity_publish_queue.get(block=True, timeout=1)
+            executors['proximity'].submit(None, topic, payload, max_retries)
+        except queue.Empty:
+            pass
+        try:
+            topic, payload = hub.qos2_publish_queue.get(block=True, timeout=1)
+            executors['qos2'].submit(None, topic, payload)
+        except queue.Empty:
+            pass
+
+
+def saturate(hub, queues, stop_event):
+    while not stop_event.is_set():
+        for name in queues:
+            try:
+                hub_queues(hub)[name].put(make_item(name), block=True, timeout=0.1)
+            except queue.Full:
+                pass
+
+
+def hub_queues(hub):
+    return {
+        'message': hub.message_queue,
+        'proximity': hub.proximity_publish_queue,
+        'qos2': hub.qos2_publish_queue,
+    }
+
+
+def run_scenario(mode, target, saturated, samples, interval, drain_timeout):
+    hub = OptimizedCentralHub()
+    queues = hub_queues(hub)
+    executors = {name: RecordingExecutor(q, hub.qos2_window.release if name == 'qos2' else None)
+                 for name, q in queues.items()}
+    hub.executor_message = executors['message']
+    hub.executor_proximity = executors['proximity']
+    hub.executor_qos2 = executors['qos2']
+    hub.running = True
+
+    if mode == 'legacy':
+        threading.Thread(target=legacy_dispatcher, args=(hub, executors), daemon=True).start()
+    else:
+        hub.start_dispatchers()
+
+    stop_event = threading.Event()
+    if saturated:
+        others = [name for name in queues if name != target]
+        threading.Thread(target=saturate, args=(hub, others, stop_event), daemon=True).start()
+        time.sleep(0.2)
+
+    executors[target].recording = True
+    for _ in range(samples):
+        queues[target].put(make_item(target))
+        time.sleep(interval)
+    # Let the dispatcher drain what is left before reading the numbers
+    deadline = time.time() + drain_timeout
+    while len(executors[target].latencies) < samples and time.time() < deadline:
+        time.sleep(0.01)
+
+    stop_event.set()
+    hub.running = False
+    latencies = sorted(executors[target].latencies)
+    return {
+        'mode': mode,
+        'queue': target,
+        'others': 'saturated' if saturated else 'idle',
+        'samples': len(latencies),
+        'undispatched': samples - len(latencies),
+        'p50_ms': statistics.median(latencies) if latencies else None,
+        'p99_ms': latencies[max(0, math.ceil(0.99 * len(latencies)) - 1)] if latencies else None,
+        'max_ms': latencies[-1] if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enqueue-to-submit latency of the hub dispatchers")
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.005, help="Seconds between enqueues")
+    parser.add_argument('--drain-timeout', type=float, default=5.0, help="Seconds to wait for queued samples")
+    parser.add_argument('--legacy', action='store_true', help="Also measure the old single-loop dispatcher")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    modes = ['dispatchers'] + (['legacy'] if args.legacy else [])
+    results = []
+    for mode in modes:
+        for target in ('message', 'proximity', 'qos2'):
+            for saturated in (False, True):
+                results.append(run_scenario(mode, target, saturated, args.samples, args.interval,
+                                            args.drain_timeout))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<12}{'queue':<11}{'others':<11}{'n':>6}{'stuck':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for r in results:
+        if not r['samples']:
+            print(f"{r['mode']:<12}{r['queue']:<11}{r['others']:<11}{0:>6}{r['undispatched']:>7}")
+            continue
+        print(f"{r['mode']:<12}{r['queue']:<11}{r['others']:<11}{r['samples']:>6}{r['undispatched']:>7}"
+              f"{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['max_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
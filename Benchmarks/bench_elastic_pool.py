@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub'))
+
+from optimised_hub_final import OptimizedCentralHub
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = json.dumps(payload).encode('utf-8')
+
+
+def fall_message():
+    return FakeMessage('video/emergency', {
+        'timestamp': '2025-01-01T00:00:00.000000',
+        'mediapipe_state': 'Fallen out of bed',
+        'source': 'video',
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Push bursts through message_processor and watch the pool scale")
+    parser.add_argument('--bursts', type=int, default=3)
+    parser.add_argument('--burst-size', type=int, default=60)
+    parser.add_argument('--handler-ms', type=float, default=20.0, help="Simulated handler cost per message")
+    parser.add_argument('--idle-timeout', type=float, default=1.0)
+    parser.add_argument('--quiet-period', type=float, default=3.0, help="Seconds between bursts")
+    args = parser.parse_args()
+
+    # Fall de-duplication off, or a burst of identical falls would collapse into one message
+    hub = OptimizedCentralHub(pool_idle_timeout=args.idle_timeout, fall_window=0)
+    # Outbound publishing is not under test here; keep the handlers' publishes in memory
+    hub.publish_qos2 = lambda *a, **k: True
+    hub.publish_with_retry = lambda *a, **k: True
+    handle_fall_alert = hub.handle_fall_alert
+
+    def slow_handler(payload, bed):
+        time.sleep(args.handler_ms / 1000)
+        handle_fall_alert(payload, bed)
+    hub.handlers['video/emergency'] = slow_handler
+
+    hub.running = True
+    hub.executor_message = hub.create_pool('message')
+    hub.executor_proximity = hub.create_pool('proximity')
+    hub.executor_qos2 = hub.create_pool('qos2')
+    hub.start_dispatchers()
+
+    timeline = []
+    sampling = threading.Event()
+
+    def sample():
+        start = time.monotonic()
+        while not sampling.is_set():
+            pool = hub.executor_message.stats()
+            timeline.append((time.monotonic() - start, pool['workers'], pool['queued']))
+            time.sleep(0.1)
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    for burst in range(args.bursts):
+        for _ in range(args.burst_size):
+            hub.on_message(None, None, fall_message())
+        time.sleep(args.quiet_period)
+    time.sleep(args.idle_timeout * 2)
+    sampling.set()
+    sampler.join()
+
+    stats = hub.executor_message.stats()
+    hub.running = False
+    for pool in (hub.executor_message, hub.executor_proximity, hub.executor_qos2):
+        pool.shutdown(wait=False)
+
+    print(f"{'t (s)':>7}{'workers':>9}{'queued':>8}")
+    last = None
+    for t, workers, queued in timeline:
+        if (workers, queued) != last:
+            print(f"{t:>7.1f}{workers:>9}{queued:>8}")
+            last = (workers, queued)
+    print(json.dumps(stats, indent=2))
+
+    scaled_up = stats['peak_workers'] > hub.base_thread_count
+    scaled_down = stats['workers'] == hub.base_thread_count
+    print(f"scaled up: {scaled_up}, scaled back down: {scaled_down}")
+    sys.exit(0 if scaled_up and scaled_down else 1)
+
+
+if __name__ == "__main__":
+    main()
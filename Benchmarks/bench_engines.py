@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import bed_topic, parse_bed_topic  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = json.dumps(payload).encode('utf-8')
+
+
+class PublishInfo:
+    def __init__(self, mid):
+        self.rc = 0
+        self.mid = mid
+
+
+class FakeClient:
+    """Stands in for paho: every publish is acknowledged later through deliver_ack,
+    the way paho's network loop would call on_publish once the broker replies."""
+    def __init__(self, deliver_ack, on_delivered):
+        self.deliver_ack = deliver_ack
+        self.on_delivered = on_delivered
+        self.on_publish = None
+        self.on_connect = self.on_message = self.on_disconnect = None
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        with self._lock:
+            self._mid += 1
+            mid = self._mid
+        self.deliver_ack(lambda: self._acked(mid, topic, payload))
+        return PublishInfo(mid)
+
+    def _acked(self, mid, topic, payload):
+        self.on_delivered(topic, payload)
+        if self.on_publish:
+            self.on_publish(self, None, mid)
+
+    def loop_misc(self):
+        return 0
+
+    def disconnect(self):
+        pass
+
+
+def bench_messages(beds):
+    """Endless round-robin of sensor messages on each bed's topics; the timestamp doubles as a message id."""
+    n = 0
+    while True:
+        for bed in range(beds):
+            n += 1
+            tag = f"bench-{n}"
+            kind = n % 10
+            if kind < 6:
+                yield tag, FakeMessage(bed_topic('1', bed, 'proximity/alert'), {
+                    'out_of_bed': False, 'distances': [20.0, 21.5, 19.8], 'timestamp': tag, 'source': 'proximity'})
+            elif kind < 9:
+                yield tag, FakeMessage(bed_topic('1', bed, 'video/emergency'), {
+                    'mediapipe_state': 'Fallen out of bed', 'timestamp': tag, 'source': 'video'})
+            else:
+                yield tag, FakeMessage(bed_topic('1', bed, 'audio/emergency'), {
+                    'alert_type': 'Urgent Assistance', 'confidence': 0.91, 'phrase': 'help',
+                    'timestamp': tag, 'source': 'audio'})
+
+
+class Recorder:
+    def __init__(self):
+        self.injected = {}
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def on_delivered(self, topic, payload):
+        if parse_bed_topic(topic)[2] != 'nurse/dashboard':
+            return
+        alert = json.loads(payload)
+        tag = alert.get('timestamp', '')
+        if 'alert_type' not in alert or not tag.startswith('bench-'):
+            return
+        now = time.perf_counter()
+        with self.lock:
+            if tag not in self.latencies and tag in self.injected:
+                self.latencies[tag] = (now - self.injected[tag]) * 1000
+
+
+def inject(deliver, recorder, beds, rate, duration):
+    """Offer beds * rate messages per second for duration seconds from one 'network' thread."""
+    total_rate = beds * rate
+    messages = bench_messages(beds)
+    sent = 0
+    start = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        due = int(elapsed * total_rate) - sent
+        for _ in range(due):
+            tag, message = next(messages)
+            with recorder.lock:
+                recorder.injected[tag] = time.perf_counter()
+            deliver(message)
+            sent += 1
+        time.sleep(0.001)
+    return sent
+
+
+def wait_for_drain(recorder, sent, timeout):
+    deadline = time.time() + timeout
+    while len(recorder.latencies) < sent and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def run_threaded(args, recorder, wal_dir):
+    from optimised_hub_final import OptimizedCentralHub
+    hub = OptimizedCentralHub(wal_dir=wal_dir, fall_window=0)  # Every message must be answered
+    acks = queue.Queue()
+
+    def network_thread():
+        while True:
+            acks.get()()
+    threading.Thread(target=network_thread, daemon=True).start()
+
+    hub.client = FakeClient(acks.put, recorder.on_delivered)
+    hub.client.on_publish = hub.on_publish
+    hub.wal.open()
+    hub.running = True
+    hub.connection_active = True
+    hub.executor_message = hub.create_pool('message')
+    hub.executor_proximity = hub.create_pool('proximity')
+    hub.executor_qos2 = hub.create_pool('qos2')
+    hub.start_dispatchers()
+
+    sent = inject(lambda m: hub.on_message(None, None, m), recorder, args.beds, args.rate, args.duration)
+    wait_for_drain(recorder, sent, args.drain_timeout)
+    hub.running = False
+    return sent
+
+
+def run_async(args, recorder, wal_dir):
+    from async_hub import AsyncCentralHub
+    hub = AsyncCentralHub(wal_dir=wal_dir, fall_window=0)
+    result = {}
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        hub.client = FakeClient(lambda fn: loop.call_soon_threadsafe(fn), recorder.on_delivered)
+        hub.wal.open()
+        hub.connection_active = True
+        server = asyncio.ensure_future(hub.serve(connect=False))
+
+        def producer():
+            result['sent'] = inject(lambda m: loop.call_soon_threadsafe(hub.on_message, None, None, m),
+                                    recorder, args.beds, args.rate, args.duration)
+            wait_for_drain(recorder, result['sent'], args.drain_timeout)
+            hub.stop()
+        threading.Thread(target=producer, daemon=True).start()
+        await server
+
+    asyncio.run(main())
+    return result['sent']
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def worker(args):
+    """Runs one engine/bed-count combination in this process and prints a JSON result line."""
+    import psutil
+    sys.stdout = open(os.devnull, 'w')  # Keep the hub's console prints out of the measurement
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-bench-'), 'wal')
+    recorder = Recorder()
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    wall_start = time.perf_counter()
+    run = run_async if args.engine == 'async' else run_threaded
+    sent = run(args, recorder, wal_dir)
+    wall = time.perf_counter() - wall_start
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    latencies = sorted(recorder.latencies.values())
+    result = {
+        'engine': args.engine,
+        'beds': args.beds,
+        'offered_per_s': args.beds * args.rate,
+        'sent': sent,
+        'delivered': len(latencies),
+        'dropped': sent - len(latencies),
+        'throughput_per_s': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'cpu_s': round((cpu_end.ru_utime + cpu_end.ru_stime) - (cpu_start.ru_utime + cpu_start.ru_stime), 3),
+        'rss_mb': round(psutil.Process().memory_info().rss / (1024 * 1024), 1),
+        'peak_rss_mb': round(cpu_end.ru_maxrss / 1024, 1),
+        'threads': threading.active_count(),
+    }
+    sys.__stdout__.write(json.dumps(result) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OptimizedCentralHub and AsyncCentralHub")
+    parser.add_argument('--beds', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--rate', type=float, default=5.0, help="Messages per second per bed")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--drain-timeout', type=float, default=10.0)
+    parser.add_argument('--engines', nargs='+', default=['threaded', 'async'], choices=['threaded', 'async'])
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    parser.add_argument('--engine', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        args.beds = args.beds[0]
+        worker(args)
+        return
+
+    results = []
+    for beds in args.beds:
+        for engine in args.engines:
+            # Fresh process per run so RSS and thread counts are not shared between engines
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--engine', engine, '--beds', str(beds),
+                 '--rate', str(args.rate), '--duration', str(args.duration),
+                 '--drain-timeout', str(args.drain_timeout)],
+                capture_output=True, text=True, cwd=tempfile.mkdtemp(prefix='hub-bench-'))
+            if out.returncode != 0:
+                print(out.stderr, file=sys.stderr)
+                continue
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'engine':<10}{'beds':>6}{'offered/s':>11}{'msg/s':>9}{'dropped':>9}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'cpu s':>8}{'rss MB':>9}{'threads':>9}")
+    for r in results:
+        print(f"{r['engine']:<10}{r['beds']:>6}{r['offered_per_s']:>11.0f}{r['throughput_per_s']:>9.1f}"
+              f"{r['dropped']:>9}{r['p50_ms'] or 0:>10.3f}{r['p99_ms'] or 0:>10.3f}"
+              f"{r['cpu_s']:>8.2f}{r['rss_mb']:>9.1f}{r['threads']:>9}")
+
+
+if __name__ == "__main__":
+    main()
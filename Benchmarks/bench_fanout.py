@@ -0,0 +1,157 @@
+import argparse
+import heapq
+import json
+import os
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Edge_Flask'))
+
+from frame_fanout import FrameFanout  # noqa: E402
+
+# The dashboard server sending the live video to a ward's tablets, simulated event by event so it runs
+# without Flask or a browser and gives the same numbers every time. The server's Wi-Fi uplink sends
+# one frame at a time, taking turns between viewers with something queued; a frame to a tablet with
+# a weak signal takes longer on air, and that is air time the other tablets wait out. A tablet
+# decodes and draws frames one after another and acks each once drawn.
+
+
+class Viewer:
+    def __init__(self, name, mbps, draw_ms):
+        self.name = name
+        self.bytes_per_s = mbps * 1e6 / 8
+        self.draw_s = draw_ms / 1000
+        self.queue = deque()  # (captured at, ack) waiting in the server's socket buffer
+        self.queued_peak = 0
+        self.drawing_until = 0.0
+        self.latencies = []   # (shown at, capture to screen seconds)
+
+
+def simulate(args, fps, mode):
+    viewers = [Viewer(f'fast-{n}', args.fast_mbps, args.draw_ms) for n in range(args.fast)]
+    viewers += [Viewer(f'slow-{n}', args.slow_mbps, args.draw_ms) for n in range(args.slow)]
+    by_name = {v.name: v for v in viewers}
+    frame_bytes = int(args.frame_kb * 1024)
+    now = [0.0]
+    events = []
+    order = [0]
+
+    def at(when, kind, *payload):
+        order[0] += 1
+        heapq.heappush(events, (when, order[0], kind, payload))
+
+    def send(name, captured, ack):
+        viewer = by_name[name]
+        viewer.queue.append((captured, ack))
+        viewer.queued_peak = max(viewer.queued_peak, len(viewer.queue))
+
+    fanout = FrameFanout(send, ack_timeout=args.ack_timeout, clock=lambda: now[0])
+    for viewer in viewers:
+        fanout.watch(viewer.name)
+
+    for n in range(int(fps * args.seconds)):
+        at(n / fps, 'frame')
+    for n in range(1, int(args.seconds / args.ack_timeout) + 1):
+        at(n * args.ack_timeout, 'expire')  # The server's lost-ack timer
+    airtime = {'busy': False, 'next': 0}
+
+    def transmit():
+        # Round robin over viewers with a frame queued, one frame per turn
+        if airtime['busy']:
+            return
+        for i in range(len(viewers)):
+            viewer = viewers[(airtime['next'] + i) % len(viewers)]
+            if viewer.queue:
+                airtime['next'] = (airtime['next'] + i + 1) % len(viewers)
+                airtime['busy'] = True
+                at(now[0] + frame_bytes / viewer.bytes_per_s + args.per_frame_ms / 1000, 'sent', viewer,
+                   *viewer.queue.popleft())
+                return
+
+    while events:
+        now[0], _, kind, payload = heapq.heappop(events)
+        if kind == 'frame':
+            if mode == 'broadcast':
+                for viewer in viewers:
+                    send(viewer.name, now[0], None)
+            else:
+                fanout.publish(now[0])
+        elif kind == 'sent':
+            viewer, captured, ack = payload
+            airtime['busy'] = False
+            viewer.drawing_until = max(viewer.drawing_until, now[0]) + viewer.draw_s
+            viewer.latencies.append((viewer.drawing_until, viewer.drawing_until - captured))
+            if ack:
+                at(viewer.drawing_until + args.ack_ms / 1000, 'ack', ack)
+        elif kind == 'ack':
+            payload[0]()
+        elif kind == 'expire' and mode == 'mailbox':
+            fanout.expire()
+        transmit()
+
+    stats = fanout.stats()
+    results = []
+    for group in ('fast', 'slow'):
+        members = [v for v in viewers if v.name.startswith(group)]
+        if not members:
+            continue
+        latencies = sorted(ms for v in members for _, ms in v.latencies)
+        tail = sorted(ms for v in members for shown, ms in v.latencies if shown >= args.seconds - 1)
+        results.append({
+            'mode': mode,
+            'viewers': f"{len(members)} {group}",
+            'shown_fps': round(sum(len(v.latencies) for v in members) / len(members) / args.seconds, 1),
+            'dropped': sum(stats[v.name]['dropped'] for v in members) if mode == 'mailbox' else 0,
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+            'last_second_p50_ms': percentile(tail, 50),
+            'peak_queued_frames': max(v.queued_peak for v in members),
+            'peak_queued_kb': round(max(v.queued_peak for v in members) * frame_bytes / 1024),
+            'left_queued': sum(len(v.queue) for v in members),
+        })
+    return results
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(pct / 100 * len(values)))] * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live video from the dashboard server to fast tablets and one on a "
+                                                 "weak Wi-Fi signal, broadcasting every frame to every viewer against "
+                                                 "per-viewer latest-frame mailboxes (Edge_Flask/frame_fanout.py)")
+    parser.add_argument('--fps', type=float, nargs='+', default=[15, 30])
+    parser.add_argument('--frame-kb', type=float, default=20)
+    parser.add_argument('--fast', type=int, default=4, help="Tablets with a good signal")
+    parser.add_argument('--slow', type=int, default=1, help="Tablets with a weak signal")
+    parser.add_argument('--fast-mbps', type=float, default=40.0, help="Throughput to a tablet with a good signal")
+    parser.add_argument('--slow-mbps', type=float, default=3.0, help="Throughput to a tablet with a weak signal")
+    parser.add_argument('--per-frame-ms', type=float, default=1.0, help="Air time overhead per frame")
+    parser.add_argument('--draw-ms', type=float, default=15.0, help="Tablet's time to decode and draw a frame")
+    parser.add_argument('--ack-ms', type=float, default=5.0, help="Ack from tablet back to the server")
+    parser.add_argument('--ack-timeout', type=float, default=2.0)
+    parser.add_argument('--seconds', type=float, default=30.0, help="Simulated run length")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for fps in args.fps:
+        for mode in ('broadcast', 'mailbox'):
+            results += [dict(r, fps=fps) for r in simulate(args, fps, mode)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.frame_kb:g}KB frames for {args.seconds:g}s (simulated) to {args.fast} tablets at "
+          f"{args.fast_mbps:g}Mbit/s and {args.slow} at {args.slow_mbps:g}Mbit/s sharing the server's uplink")
+    keys = ('shown_fps', 'dropped', 'p50_ms', 'p99_ms', 'last_second_p50_ms', 'peak_queued_frames',
+            'peak_queued_kb', 'left_queued')
+    columns = [f"{r['mode']} @{r['fps']:g} {r['viewers'].split()[1]}" for r in results]
+    print(f"{'':<20}" + "".join(f"{c:>22}" for c in columns))
+    for key in keys:
+        print(f"{key:<20}" + "".join(f"{str(r[key]):>22}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
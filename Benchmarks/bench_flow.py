@@ -0,0 +1,180 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import FALLEN_OUT_OF_BED, AudioAlert, FallAlert, bed_topic, decode_payload  # noqa: E402
+from flow_control import NORMAL, FlowGovernor  # noqa: E402
+from mqtt_transport import create_client, reset_default_broker  # noqa: E402
+
+EPOCH = datetime(2024, 1, 1)
+FALL_REPEAT_SECONDS = 1.0  # As in falldetection4.py
+
+
+def slow(handler, seconds):
+    """Stand-in for a Pi-class hub: each handler call takes at least this long."""
+    @functools.wraps(handler)
+    def wrapper(*args):
+        time.sleep(seconds)
+        return handler(*args)
+    return wrapper
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 1)
+
+
+def storm(args, flow_control):
+    """Every camera streams fall frames for storm_seconds while urgent audio alerts keep arriving;
+    then the cameras stop and the hub is left to recover."""
+    from optimised_hub_final import OptimizedCentralHub
+    reset_default_broker()
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-flow-'), 'wal')
+    hub = OptimizedCentralHub(wal_dir=wal_dir, metrics_port=None, transport='inprocess', fall_window=0,
+                              fusion_window=0, flow_control=flow_control, flow_hold=args.flow_hold)
+    hub.logger.setLevel(logging.WARNING)
+    hub.base_thread_count = hub.max_thread_count = args.workers
+    hub.handlers = {kind: slow(handler, args.handler_ms / 1000) for kind, handler in hub.handlers.items()}
+    hub_thread = threading.Thread(target=hub.start, daemon=True)
+    hub_thread.start()
+    while not hub.connection_active:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    sent, latencies, lock = {}, [], threading.Lock()
+
+    def on_output(client, userdata, message):
+        alert = decode_payload(message.payload)
+        if alert.get('source') == 'audio':
+            with lock:
+                start = sent.pop(alert.get('timestamp'), None)
+            if start is not None:
+                latencies.append((time.perf_counter() - start) * 1000)
+    dashboard = create_client('flow-dashboard', transport='inprocess')
+    dashboard.on_message = on_output
+    dashboard.connect('localhost')
+    dashboard.subscribe(bed_topic('+', '+', 'nurse/dashboard'), 2)
+    dashboard.loop_start()
+
+    # Cameras and microphones, each with the governor the drivers use
+    camera, microphone = (create_client(name, transport='inprocess') for name in ('flow-cameras', 'flow-audio'))
+    governor = FlowGovernor()
+    camera.connect('localhost')
+    governor.subscribe(camera)
+    for client in (camera, microphone):
+        client.loop_start()
+    microphone.connect('localhost')
+
+    frames = held = probes = 0
+    recovered = None
+    start = time.perf_counter()
+    storm_end = start + args.storm_seconds
+    end = storm_end + args.calm_seconds
+    next_probe = start
+    tick = 0
+    while True:
+        now = time.perf_counter()
+        if now >= end:
+            break
+        if now < storm_end:
+            stamp = datetime.now().isoformat()
+            for bed in range(args.beds):
+                topic = bed_topic('1', bed, 'video/emergency')
+                if governor.should_send(topic, FALLEN_OUT_OF_BED, FALL_REPEAT_SECONDS):
+                    camera.publish(topic, FallAlert(stamp, 'video', mediapipe_state=FALLEN_OUT_OF_BED).encode(), qos=2)
+                    frames += 1
+                else:
+                    held += 1
+        elif recovered is None and governor.level == NORMAL:
+            recovered = now - storm_end
+        if now >= next_probe:
+            stamp = (EPOCH + timedelta(microseconds=probes)).isoformat()
+            with lock:
+                sent[stamp] = time.perf_counter()
+            microphone.publish(bed_topic('1', probes % args.beds, 'audio/emergency'),
+                               AudioAlert(stamp, 'Urgent Assistance', 0.95, 'help').encode(), qos=2)
+            probes += 1
+            next_probe += args.probe_interval
+        tick += 1
+        delay = start + tick / args.fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(args.settle)
+
+    lanes = hub.message_queue.lane_stats()
+    qos2_lanes = hub.qos2_publish_queue.lane_stats()
+    result = {
+        'flow_control': flow_control,
+        'fall_frames_sent': frames,
+        'fall_frames_held': held,
+        'probes_sent': probes,
+        'probes_delivered': len(latencies),
+        'probe_p50_ms': percentile(latencies, 50),
+        'probe_p99_ms': percentile(latencies, 99),
+        'probe_max_ms': round(max(latencies), 1) if latencies else None,
+        'probe_mean_ms': round(statistics.mean(latencies), 1) if latencies else None,
+        'message_evicted': sum(lane['evicted'] for lane in lanes.values()),
+        'message_rejected': sum(lane['rejected'] for lane in lanes.values()),
+        'message_peak': max(lane['peak_depth'] for lane in lanes.values()),
+        'qos2_evicted': sum(lane['evicted'] for lane in qos2_lanes.values()),
+        'qos2_peak': max(lane['peak_depth'] for lane in qos2_lanes.values()),
+        'flow': hub.flow.stats() if hub.flow else None,
+        'recovery_s': round(recovered, 2) if flow_control and recovered is not None else None,
+    }
+    for client in (dashboard, camera, microphone):
+        client.disconnect()
+        client.loop_stop()
+    hub.stop()
+    hub_thread.join(timeout=5)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HIGH-priority latency and queue losses while every camera "
+                                                 "streams fall frames, with and without hub/flow back-pressure")
+    parser.add_argument('--beds', type=int, default=20)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--storm-seconds', type=float, default=10.0)
+    parser.add_argument('--calm-seconds', type=float, default=10.0)
+    parser.add_argument('--probe-interval', type=float, default=0.5, help="Seconds between urgent audio alerts")
+    parser.add_argument('--handler-ms', type=float, default=10.0, help="Added to every handler call")
+    parser.add_argument('--workers', type=int, default=4, help="Message workers, as on a 4-core Pi")
+    parser.add_argument('--flow-hold', type=float, default=5.0)
+    parser.add_argument('--settle', type=float, default=3.0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # Handlers print per message
+        results = [storm(args, False), storm(args, True)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    off, on = results
+    print(f"{args.beds} cameras at {args.fps:.0f} fps for {args.storm_seconds:.0f}s, {args.handler_ms} ms per handler, "
+          f"{args.workers} workers, urgent audio every {args.probe_interval}s")
+    print(f"{'':<20}{'off':>10}{'on':>10}")
+    for key in ('fall_frames_sent', 'fall_frames_held', 'probes_sent', 'probes_delivered', 'probe_p50_ms',
+                'probe_p99_ms', 'probe_max_ms', 'message_evicted', 'message_rejected', 'message_peak',
+                'qos2_evicted', 'qos2_peak'):
+        print(f"{key:<20}{str(off[key]):>10}{str(on[key]):>10}")
+    print(f"load levels {on['flow']}, drivers back to NORMAL {on['recovery_s']}s after the storm")
+
+
+if __name__ == "__main__":
+    main()
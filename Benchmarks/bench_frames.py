@@ -0,0 +1,121 @@
+import argparse
+import base64
+import json
+import os
+import time
+
+# The camera -> Flask -> browser video path, modelled on the Socket.IO (v5) and WebSocket wire formats
+# so it runs without the camera, Flask or a browser. A text event is one WebSocket text message,
+# 42["event", ...]; an event with bytes in it is a 451-["event", {"_placeholder": true, "num": 0}]
+# header followed by the bytes as a binary message. Client-to-server messages are masked.
+
+PLACEHOLDER = {'_placeholder': True, 'num': 0}
+
+
+def ws_size(payload, masked):
+    """Bytes on the wire for one WebSocket message of this payload."""
+    n = len(payload)
+    return n + (2 if n < 126 else 4 if n < 65536 else 10) + (4 if masked else 0)
+
+
+def mask(payload, key=b'\x5a\x17\xc3\x9e'):
+    """XOR with the masking key, as the camera's WebSocket client does and the server undoes."""
+    n = len(payload)
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes((key * (n // 4 + 1))[:n], 'big')).to_bytes(n, 'big')
+
+
+def base64_frame(jpeg):
+    """The old path. Returns (driver, relay, viewer) seconds and bytes (camera -> relay, relay -> viewer)."""
+    t0 = time.thread_time()
+    text = base64.b64encode(jpeg).decode('utf-8')
+    sent = mask(('42' + json.dumps(['video_frame', text])).encode('utf-8'))
+    t1 = time.thread_time()
+    event = json.loads(mask(sent)[2:])
+    relayed = ('42' + json.dumps(['update_frame', event[1]])).encode('utf-8')
+    t2 = time.thread_time()
+    # Stands in for the browser parsing the event and decoding the data: URI
+    base64.b64decode(json.loads(relayed[2:])[1])
+    t3 = time.thread_time()
+    return (t1 - t0, t2 - t1, t3 - t2), (ws_size(sent, True), ws_size(relayed, False))
+
+
+def binary_frame(jpeg):
+    t0 = time.thread_time()
+    data = bytes(jpeg)  # jpeg.tobytes() in the driver
+    header = mask(('451-' + json.dumps(['video_frame', PLACEHOLDER])).encode('utf-8'))
+    body = mask(data)
+    t1 = time.thread_time()
+    event = json.loads(mask(header)[4:])
+    event[1] = mask(body)
+    relayed = ('451-' + json.dumps(['update_frame', PLACEHOLDER])).encode('utf-8')
+    t2 = time.thread_time()
+    # The browser gets an ArrayBuffer and wraps it in a Blob; only the header is parsed
+    json.loads(relayed[4:])
+    t3 = time.thread_time()
+    return ((t1 - t0, t2 - t1, t3 - t2),
+            (ws_size(header, True) + ws_size(body, True), ws_size(relayed, False) + ws_size(event[1], False)))
+
+
+def run(name, send, fps, seconds, frame_bytes):
+    """Send frames at fps for seconds, each a fresh buffer as the camera would hand over."""
+    frames = int(fps * seconds)
+    cpu = [0.0, 0.0, 0.0]
+    wire = [0, 0]
+    started = time.perf_counter()
+    for n in range(frames):
+        jpeg = bytearray(os.urandom(frame_bytes))
+        stages, sizes = send(jpeg)
+        for i, spent in enumerate(stages):
+            cpu[i] += spent
+        wire[0] += sizes[0]
+        wire[1] += sizes[1]
+        delay = started + (n + 1) / fps - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    wall = time.perf_counter() - started
+    result = {'encoding': name, 'fps': fps, 'frames': frames}
+    for i, stage in enumerate(('driver', 'relay', 'viewer')):
+        result[f'{stage}_us_per_frame'] = round(cpu[i] / frames * 1e6, 1)
+        result[f'{stage}_cpu_pct'] = round(cpu[i] / wall * 100, 3)
+    result['camera_to_relay_kbps'] = round(wire[0] / wall / 1024 * 8, 1)
+    result['relay_to_viewer_kbps'] = round(wire[1] / wall / 1024 * 8, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU and bandwidth of the camera -> Flask -> dashboard video path "
+                                                 "with base64 text frames against binary Socket.IO attachments")
+    parser.add_argument('--fps', type=float, nargs='+', default=[15, 30])
+    parser.add_argument('--frame-kb', type=float, default=20,
+                        help="JPEG size; a 320x240 frame at OpenCV's default quality is 15-25KB. JPEG data barely "
+                             "compresses, so random bytes of the same size cost the same to encode")
+    parser.add_argument('--seconds', type=float, default=3.0, help="Run length at each frame rate")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    frame_bytes = int(args.frame_kb * 1024)
+    results = []
+    for fps in args.fps:
+        for name, send in (('base64', base64_frame), ('binary', binary_frame)):
+            results.append(run(name, send, fps, args.seconds, frame_bytes))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.frame_kb:g}KB JPEG frames, {args.seconds:g}s at each frame rate. Viewer CPU is a Python stand-in "
+          f"for the browser's decode")
+    keys = ('frames', 'driver_us_per_frame', 'relay_us_per_frame', 'viewer_us_per_frame', 'driver_cpu_pct',
+            'relay_cpu_pct', 'viewer_cpu_pct', 'camera_to_relay_kbps', 'relay_to_viewer_kbps')
+    print(f"{'':<24}" + "".join(f"{r['encoding'] + ' @' + format(r['fps'], 'g'):>16}" for r in results))
+    for key in keys:
+        print(f"{key:<24}" + "".join(f"{r[key]:>16}" for r in results))
+    print()
+    for fps in args.fps:
+        old, new = [r for r in results if r['fps'] == fps]
+        saved = lambda key: f"{1 - new[key] / old[key]:.0%}" if old[key] else 'n/a'  # noqa: E731
+        print(f"{fps:g} fps: binary saves {saved('camera_to_relay_kbps')} of the bandwidth to the relay and "
+              f"{saved('relay_to_viewer_kbps')} to each viewer, {saved('driver_us_per_frame')} of the driver's "
+              f"CPU, {saved('relay_us_per_frame')} of the relay's and {saved('viewer_us_per_frame')} of the viewer's")
+
+
+if __name__ == "__main__":
+    main()
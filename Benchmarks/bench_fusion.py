@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from incident_fusion import DEFAULT_CONFIDENCE, PRIORITY, SEVERITY, IncidentFusion  # noqa: E402
+
+SOURCES = [('proximity', 'HIGH', None), ('video', 'HIGH', None), ('audio', 'HIGH', 0.91), ('audio', 'MEDIUM', 0.74)]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def events(beds, count, rate, seed):
+    """count events spread at random over beds, arriving at rate per second in total."""
+    rng = random.Random(seed)
+    t = 0.0
+    for _ in range(count):
+        t += rng.expovariate(rate)
+        source, priority, confidence = rng.choice(SOURCES)
+        yield t, f"1/{rng.randrange(beds)}", source, priority, confidence
+
+
+def rescan(history, now, window):
+    """Fused figures recomputed from every event still in the window: what observe() must match."""
+    live = [event for event in history if event[0] >= now - window]
+    sources = sorted({source for _, source, _, _ in live})
+    level = max(SEVERITY[priority] for _, _, priority, _ in live)
+    if len(sources) > 1:
+        level = min(level + 1, SEVERITY['HIGH'])
+    miss = 1.0
+    for name in sources:
+        miss *= 1.0 - max(c for _, source, _, c in live if source == name)
+    return live, PRIORITY[level], round(1.0 - miss, 3), sources
+
+
+def check(beds, count, rate, window, seed):
+    """Every record observe() emits must equal a full rescan of the window at that moment."""
+    clock = Clock()
+    fusion = IncidentFusion(window=window, clock=clock)
+    history, emitted, errors, records = {}, {}, [], 0
+    for t, bed, source, priority, confidence in events(beds, count, rate, seed):
+        clock.now = t
+        record = fusion.observe(bed, source, priority, confidence)
+        bed_history = history.setdefault(bed, [])
+        if bed_history and bed_history[-1][0] < t - window:
+            bed_history.clear()
+            emitted.pop(bed, None)
+        bed_history.append((t, source, priority, confidence or DEFAULT_CONFIDENCE.get(source, 0.5)))
+        live, fused_priority, fused_confidence, sources = rescan(bed_history, t, window)
+        bed_history[:] = live
+        due = len(sources) > 1 and emitted.get(bed) != (fused_priority, tuple(sources))
+        if due:
+            emitted[bed] = (fused_priority, tuple(sources))
+        if due != (record is not None):
+            errors.append(f"{bed} at {t:.3f}: record {'missing' if due else 'unexpected'}")
+        elif record:
+            records += 1
+            expected = {'priority': fused_priority, 'confidence': fused_confidence, 'sources': sources,
+                        'events': len(live)}
+            actual = {key: record[key] for key in expected}
+            if actual != expected:
+                errors.append(f"{bed} at {t:.3f}: {actual} != {expected}")
+    return records, errors
+
+
+def throughput(beds, count, rate, window, seed):
+    clock = Clock()
+    fusion = IncidentFusion(window=window, clock=clock)
+    stream = list(events(beds, count, rate, seed))
+    observe = fusion.observe
+    start = time.perf_counter()
+    for t, bed, source, priority, confidence in stream:
+        clock.now = t
+        observe(bed, source, priority, confidence)
+    elapsed = time.perf_counter() - start
+    return elapsed / count * 1e6, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incident fusion: correctness against a full rescan and "
+                                                 "per-event cost as beds and window depth grow")
+    parser.add_argument('--beds', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--rate', type=float, default=500.0, help="Events per second across all beds")
+    parser.add_argument('--windows', type=float, nargs='+', default=[10, 30, 120])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    # From saturated windows down to sparse ones where incidents open, escalate and lapse
+    records, errors = 0, []
+    for rate in (50.0, 5.0, 1.0, 0.3):
+        checked, mismatches = check(10, 20000, rate, 30, args.seed)
+        records += checked
+        errors += mismatches
+    results = []
+    for beds in args.beds:
+        for window in args.windows:
+            us, per_s = throughput(beds, args.events, args.rate, window, args.seed)
+            results.append({'beds': beds, 'window_s': window,
+                            'events_in_window_per_bed': round(args.rate / beds * window, 1),
+                            'us_per_event': round(us, 3), 'events_per_s': round(per_s)})
+
+    if args.json:
+        print(json.dumps({'results': results, 'records_checked': records, 'errors': errors}, indent=2))
+    else:
+        print(f"{'beds':>6}{'window s':>10}{'in window':>11}{'us/event':>10}{'events/s':>11}")
+        for r in results:
+            print(f"{r['beds']:>6}{r['window_s']:>10.0f}{r['events_in_window_per_bed']:>11}"
+                  f"{r['us_per_event']:>10.3f}{r['events_per_s']:>11}")
+        print(f"{records} incident records checked against a full rescan, {len(errors)} mismatches")
+        for error in errors[:10]:
+            print(f"  {error}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
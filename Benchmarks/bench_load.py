@@ -0,0 +1,441 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import psutil
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import (FALLEN_OUT_OF_BED, AudioAlert, FallAlert, ProximityReading, bed_topic,  # noqa: E402
+                          decode_payload, get_codec, parse_bed_topic)
+from mqtt_transport import create_client, reset_default_broker  # noqa: E402
+
+OUTPUT_KINDS = ('nurse/dashboard', 'video/monitor')
+AUDIO_TYPES = [('Urgent Assistance', 'help'), ('Pain/Discomfort', 'it hurts'), ('Assistance', 'nurse')]
+EPOCH = datetime(2025, 1, 1)
+LOAD_THREADS = ('mqtt-inprocess-broker', 'mqtt-loop-loadgen-')
+
+# Compared against --baseline; True if a higher value is better
+COMPARED = {'p50_ms': False, 'p99_ms': False, 'throughput_per_s': True, 'drop_rate': False,
+            'hub_cpu_percent': False, 'hub_rss_mb': False}
+
+
+def scenario(args):
+    """Every sensor message of the run as (offset_s, topic, record), sorted by offset.
+
+    Per bed: an ultrasonic reading every --proximity-interval seconds that now and then
+    flips to out of bed, falls that send one frame per camera frame at --fps for
+    --fall-seconds, and audio alerts that come in bursts of repeated wake words.
+    The timestamp of each record is unique and is what the hub copies into its outputs.
+    """
+    rng = random.Random(args.seed)
+    events = []
+    for bed in range(args.beds):
+        topics = {kind: bed_topic(args.ward, bed, kind)
+                  for kind in ('proximity/alert', 'video/emergency', 'audio/emergency')}
+        t = rng.uniform(0, args.proximity_interval)  # Sensors do not start in lockstep
+        out_of_bed = False
+        while t < args.duration:
+            if rng.random() < args.exit_probability:
+                out_of_bed = not out_of_bed
+            distances = [round(rng.uniform(60, 120) if out_of_bed else rng.uniform(15, 30), 1) for _ in range(3)]
+            events.append((t, topics['proximity/alert'], lambda ts, o=out_of_bed, d=distances:
+                           ProximityReading(ts, o, d)))
+            t += args.proximity_interval
+        t = rng.expovariate(args.falls_per_min / 60) if args.falls_per_min else args.duration
+        while t < args.duration:
+            for frame in range(int(args.fps * args.fall_seconds)):
+                events.append((t + frame / args.fps, topics['video/emergency'], lambda ts:
+                               FallAlert(ts, 'video', mediapipe_state=FALLEN_OUT_OF_BED)))
+            t += args.fall_seconds + rng.expovariate(args.falls_per_min / 60)
+        t = rng.expovariate(args.audio_bursts_per_min / 60) if args.audio_bursts_per_min else args.duration
+        while t < args.duration:
+            alert_type, phrase = rng.choice(AUDIO_TYPES)
+            for _ in range(rng.randint(1, args.max_burst)):
+                confidence = round(rng.uniform(0.7, 0.99), 2)
+                events.append((t, topics['audio/emergency'], lambda ts, a=alert_type, c=confidence, p=phrase:
+                               AudioAlert(ts, a, c, p)))
+                t += rng.uniform(0.2, 1.0)
+            t += rng.expovariate(args.audio_bursts_per_min / 60)
+    events = [event for event in events if event[0] < args.duration]
+    events.sort(key=lambda event: event[0])
+    codec = get_codec(args.codec)
+    messages = []
+    for n, (offset, topic, build) in enumerate(events):
+        timestamp = (EPOCH + timedelta(microseconds=n)).isoformat(timespec='microseconds')
+        messages.append((offset / args.speed, timestamp, topic, build(timestamp).encode(codec)))
+    return messages
+
+
+class Recorder:
+    """Matches hub outputs to the sensor message they answer by timestamp; the first one wins."""
+    def __init__(self):
+        self.sent = {}  # timestamp -> (send time, message kind)
+        self.latencies = {}  # timestamp -> ms
+        self.outputs = 0
+        self.lock = threading.Lock()
+
+    def on_sent(self, timestamp, kind):
+        with self.lock:
+            self.sent[timestamp] = (time.perf_counter(), kind)
+
+    def on_output(self, topic, payload):
+        now = time.perf_counter()
+        if parse_bed_topic(topic)[2] not in OUTPUT_KINDS or not payload:
+            return
+        try:
+            timestamp = decode_payload(payload).get('timestamp')
+        except ValueError:
+            return
+        with self.lock:
+            self.outputs += 1
+            sent = self.sent.get(timestamp)
+            if sent and timestamp not in self.latencies:
+                self.latencies[timestamp] = (now - sent[0]) * 1000
+
+
+def inject(messages, publish, recorder):
+    """Send every message at its offset from one thread, as the sensor Pis would over time."""
+    start = time.perf_counter()
+    for offset, timestamp, topic, data in messages:
+        delay = offset - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+        recorder.on_sent(timestamp, parse_bed_topic(topic)[2])
+        publish(topic, data)
+    return time.perf_counter() - start
+
+
+def wait_for_drain(recorder, timeout, silenced=lambda: 0):
+    """Wait until every message has been answered, or silenced (de-duplicated) by the hub."""
+    deadline = time.time() + timeout
+    while len(recorder.latencies) + silenced() < len(recorder.sent) and time.time() < deadline:
+        time.sleep(0.05)
+
+
+class LoadThread(threading.Thread):
+    """Daemon thread that keeps its own CPU time so it can be left out of the hub's share."""
+    def __init__(self, target, *args):
+        super().__init__(name='loadgen-inject', daemon=True)
+        self.work = target
+        self.work_args = args
+        self.cpu_s = 0.0
+        self.result = None
+
+    def run(self):
+        try:
+            self.result = self.work(*self.work_args)
+        finally:
+            self.cpu_s = time.thread_time()
+
+
+def connect_clients(args, recorder, transport):
+    """A dashboard subscriber and one publisher per sensor role, like the Flask app and the Pis."""
+    dashboard = create_client(f"loadgen-dashboard-{os.getpid()}", transport=transport)
+    dashboard.on_message = lambda client, userdata, message: recorder.on_output(message.topic, message.payload)
+    dashboard.connect(args.broker, args.port, 60)
+    dashboard.subscribe([(bed_topic('+', '+', kind), 2) for kind in OUTPUT_KINDS])
+    dashboard.loop_start()
+    sensors = {}
+    for kind in ('proximity/alert', 'video/emergency', 'audio/emergency'):
+        client = create_client(f"loadgen-{kind.split('/')[0]}-{os.getpid()}", transport=transport)
+        client.connect(args.broker, args.port, 60)
+        client.loop_start()
+        sensors[kind] = client
+    return dashboard, sensors
+
+
+def disconnect_clients(dashboard, sensors):
+    for client in (dashboard, *sensors.values()):
+        client.disconnect()
+        client.loop_stop()
+
+
+def drive(args, messages, recorder, sensors, silenced=lambda: 0):
+    """Publish the scenario at QoS 2 like the drivers, then wait for the hub's answers."""
+    wall_start = time.perf_counter()
+    producer = LoadThread(inject, messages, lambda topic, data: sensors[parse_bed_topic(topic)[2]].publish(
+        topic, data, qos=2), recorder)
+    producer.start()
+    producer.join()
+    wait_for_drain(recorder, args.drain_timeout, silenced)
+    return producer, time.perf_counter() - wall_start
+
+
+def load_thread_cpu(process):
+    """CPU seconds of the broker stand-in and load generator client threads alive in this process."""
+    names = {thread.native_id: thread.name for thread in threading.enumerate()}
+    return sum(thread.user_time + thread.system_time for thread in process.threads()
+               if names.get(thread.id, '').startswith(LOAD_THREADS))
+
+
+def run_inprocess(args, messages, recorder, wal_dir):
+    """Hub, sensors and dashboard in this process on the in-process broker: the full MQTT path, no network."""
+    broker = reset_default_broker(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, loss=args.loss,
+                                  seed=args.seed)
+    if args.engine == 'async':
+        from async_hub import AsyncCentralHub as Hub
+    else:
+        from optimised_hub_final import OptimizedCentralHub as Hub
+    hub = Hub(wal_dir=wal_dir, metrics_port=None, codec=args.codec, transport='inprocess',
+              fall_window=args.fall_window, fall_summary_interval=args.fall_summary_interval)
+    silenced = hub.metrics.counter('deduplicated', topic='video/emergency').value
+    hub_thread = threading.Thread(target=hub.start, name='hub', daemon=True)
+    hub_thread.start()
+    deadline = time.time() + args.hub_warmup
+    while not hub.connection_active and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)  # on_connect subscribes right after marking the connection active
+    dashboard, sensors = connect_clients(args, recorder, 'inprocess')
+
+    process = psutil.Process()
+    cpu_start, load_start, main_start = process.cpu_times(), load_thread_cpu(process), time.thread_time()
+    producer, wall = drive(args, messages, recorder, sensors, silenced)
+    # Generator, broker and client threads share the process, so their time is taken back out
+    load_cpu = producer.cpu_s + load_thread_cpu(process) - load_start + time.thread_time() - main_start
+    cpu_end = process.cpu_times()
+    result = {'elapsed_s': producer.result, 'wall_s': wall, 'rss_bytes': process.memory_info().rss,
+              'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+              'hub_cpu_s': max(0.0, (cpu_end.user + cpu_end.system) - (cpu_start.user + cpu_start.system) - load_cpu),
+              'hub_counters': hub.metrics.summary()['counters'], 'broker_stats': dict(broker.stats),
+              'deduplicated': silenced()}
+    disconnect_clients(dashboard, sensors)
+    hub.stop()
+    hub_thread.join(timeout=5)
+    return result
+
+
+def hub_processes(hub):
+    """The hub process and, with --shards, its worker processes."""
+    try:
+        return [hub] + hub.children(recursive=True)
+    except psutil.Error:
+        return [hub]
+
+
+def tree_cpu(hub):
+    total = 0.0
+    for process in hub_processes(hub):
+        try:
+            times = process.cpu_times()
+            total += times.user + times.system
+        except psutil.Error:
+            pass
+    return total
+
+
+def tree_rss(hub):
+    total = 0
+    for process in hub_processes(hub):
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def run_broker(args, messages, recorder, wal_dir):
+    """Drive a hub process through a real broker; publishers and the dashboard are paho clients here."""
+    hub_process = None
+    if args.hub_pid:
+        hub = psutil.Process(args.hub_pid)
+    else:
+        # Fresh hub process so its CPU and RSS are its own
+        hub_process = subprocess.Popen(
+            [sys.executable, os.path.join(HUB_DIR, 'optimised_hub_final.py'), '--engine', args.engine,
+             '--codec', args.codec, '--broker', args.broker, '--port', str(args.port), '--wal-dir', wal_dir,
+             '--metrics-port', '0', '--fall-window', str(args.fall_window),
+             '--fall-summary-interval', str(args.fall_summary_interval), '--shards', str(args.shards)],
+            stdout=subprocess.DEVNULL, cwd=os.path.dirname(wal_dir))
+        hub = psutil.Process(hub_process.pid)
+    dashboard, sensors = connect_clients(args, recorder, 'paho')
+    time.sleep(args.hub_warmup)  # Hub connects and subscribes
+
+    cpu_start = tree_cpu(hub)
+    producer, wall = drive(args, messages, recorder, sensors)
+    result = {'elapsed_s': producer.result, 'wall_s': wall, 'rss_bytes': tree_rss(hub),
+              'hub_cpu_s': tree_cpu(hub) - cpu_start}
+    disconnect_clients(dashboard, sensors)
+    if hub_process:
+        hub_process.terminate()
+        hub_process.wait(timeout=30)  # A sharded hub stops its workers cleanly first
+        result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return result
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    return round(values[max(0, math.ceil(pct / 100 * len(values)) - 1)], 3)
+
+
+def latency_stats(latencies):
+    latencies = sorted(latencies)
+    return {'count': len(latencies), 'p50_ms': percentile(latencies, 50), 'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99), 'max_ms': round(latencies[-1], 3) if latencies else None}
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=HUB_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    messages = scenario(args)
+    recorder = Recorder()
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-load-'), 'wal')
+    run_transport = run_broker if args.transport == 'broker' else run_inprocess
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')  # An in-process hub prints per message
+    try:
+        raw = run_transport(args, messages, recorder, wal_dir)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    with recorder.lock:
+        sent = dict(recorder.sent)
+        latencies = dict(recorder.latencies)
+        outputs = recorder.outputs
+    by_kind = {}
+    for timestamp, (_, kind) in sent.items():
+        by_kind.setdefault(kind, []).append(timestamp)
+    delivered = len(latencies)
+    dropped = len(sent) - delivered - raw.get('deduplicated', 0)
+    wall = raw['wall_s']
+    result = {
+        'version': git_version(),
+        'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'config': {key: value for key, value in vars(args).items() if key not in ('baseline', 'output', 'json')},
+        'sent': len(sent),
+        'delivered': delivered,
+        'outputs': outputs,
+        'deduplicated': raw.get('deduplicated', 0),
+        'dropped': dropped,
+        'drop_rate': round(dropped / len(sent), 5) if sent else 0.0,
+        'offered_per_s': round(len(sent) / raw['elapsed_s'], 1) if raw['elapsed_s'] else 0.0,
+        'throughput_per_s': round(delivered / wall, 1) if wall else 0.0,
+        **latency_stats(latencies.values()),
+        'by_kind': {kind: {'sent': len(stamps), **latency_stats([latencies[t] for t in stamps if t in latencies])}
+                    for kind, stamps in sorted(by_kind.items())},
+        'hub_cpu_s': round(raw['hub_cpu_s'], 3),
+        'hub_cpu_percent': round(raw['hub_cpu_s'] / wall * 100, 1) if wall else 0.0,
+        'hub_rss_mb': round(raw['rss_bytes'] / (1024 * 1024), 1),
+        'hub_peak_rss_mb': round(raw['peak_rss_bytes'] / (1024 * 1024), 1) if raw.get('peak_rss_bytes') else None,
+    }
+    for key in ('hub_counters', 'broker_stats'):
+        if key in raw:
+            result[key] = raw[key]
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """Relative change of each compared figure against a previous result; lists the ones that got worse."""
+    rows, regressions = [], []
+    for key, higher_is_better in COMPARED.items():
+        old, new = baseline.get(key), result.get(key)
+        if old is None or new is None:
+            continue
+        ratio = new / old if old else (1.0 if new == old else math.inf)
+        worse = ratio < 1 / tolerance if higher_is_better else ratio > tolerance
+        # A drop rate going from 0 to a handful of messages is noise, not a regression
+        if worse and key == 'drop_rate' and new - old < 0.001:
+            worse = False
+        rows.append({'metric': key, 'baseline': old, 'current': new,
+                     'ratio': round(ratio, 3) if ratio != math.inf else None, 'regressed': worse})
+        if worse:
+            regressions.append(key)
+    return rows, regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Simulated multi-bed sensor load against the Central Hub, "
+                                                 "measured end to end at the dashboard and camera topics")
+    parser.add_argument('--beds', type=int, default=10)
+    parser.add_argument('--ward', default='1')
+    parser.add_argument('--duration', type=float, default=60.0, help="Simulated seconds of sensor traffic")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay the scenario this many times faster")
+    parser.add_argument('--seed', type=int, default=1, help="Same seed, same messages at the same offsets")
+    parser.add_argument('--proximity-interval', type=float, default=5.0, help="Seconds between ultrasonic readings")
+    parser.add_argument('--exit-probability', type=float, default=0.05,
+                        help="Chance a reading flips the patient in/out of bed")
+    parser.add_argument('--fps', type=float, default=30.0, help="Camera frame rate while a fall is in view")
+    parser.add_argument('--fall-seconds', type=float, default=2.0, help="Seconds of fall frames per fall")
+    parser.add_argument('--falls-per-min', type=float, default=0.5, help="Falls per bed per minute")
+    parser.add_argument('--audio-bursts-per-min', type=float, default=1.0, help="Audio bursts per bed per minute")
+    parser.add_argument('--max-burst', type=int, default=5, help="Most audio alerts in one burst")
+    parser.add_argument('--codec', choices=['json', 'msgpack', 'cbor'], default='json')
+    parser.add_argument('--fall-window', type=float, default=0,
+                        help="Hub fall de-duplication window; 0 (default) answers every frame so all are timed")
+    parser.add_argument('--fall-summary-interval', type=float, default=30)
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--transport', choices=['inprocess', 'broker'], default='inprocess',
+                        help="inprocess: hub, sensors and dashboard on the in-process broker, "
+                             "broker: hub process and paho clients via a real broker")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="In-process broker delay per hop")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Extra random delay per hop, up to this")
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help="In-process broker chance of losing each hop (QoS 1/2 hops are resent)")
+    parser.add_argument('--broker', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Hub worker processes (--transport broker only; the in-process hub is one process)")
+    parser.add_argument('--hub-pid', type=int, help="Measure an already running hub instead of starting one")
+    parser.add_argument('--hub-warmup', type=float, default=3.0, help="Seconds for a started hub to subscribe")
+    parser.add_argument('--drain-timeout', type=float, default=10.0)
+    parser.add_argument('--output', help="Write the JSON result to this file")
+    parser.add_argument('--baseline', help="JSON result of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help="Fail if a compared figure is worse than the baseline by more than this factor")
+    parser.add_argument('--json', action='store_true', help="Print the result as JSON")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    result = run(args)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows, regressions = compare(result, json.load(f), args.tolerance)
+        result['comparison'] = {'baseline': args.baseline, 'tolerance': args.tolerance, 'metrics': rows}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{args.beds} beds, {args.transport}/{args.engine}/{args.codec}, version {result['version']}")
+        print(f"sent {result['sent']} ({result['offered_per_s']}/s), delivered {result['delivered']}, "
+              f"drop rate {result['drop_rate']:.3%}, throughput {result['throughput_per_s']}/s")
+        print(f"{'kind':<18}{'sent':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for kind, stats in [('all', result), *result['by_kind'].items()]:
+            print(f"{kind:<18}{stats['sent']:>8}{stats['p50_ms'] or 0:>10.3f}{stats['p90_ms'] or 0:>10.3f}"
+                  f"{stats['p99_ms'] or 0:>10.3f}{stats['max_ms'] or 0:>10.3f}")
+        print(f"hub cpu {result['hub_cpu_s']}s ({result['hub_cpu_percent']}%), rss {result['hub_rss_mb']} MB, "
+              f"peak {result['hub_peak_rss_mb']} MB")
+        for row in result.get('comparison', {}).get('metrics', []):
+            print(f"  {row['metric']:<18}{row['baseline']:>12}{row['current']:>12}  x{row['ratio']}"
+                  f"{'  REGRESSED' if row['regressed'] else ''}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+
+from hub_logging import AsyncLogHandler, ConsoleHandler, JsonLinesFormatter, event  # noqa: E402
+
+# What a busy hub logs: mostly in-bed proximity readings, some alerts, a little debug and a few warnings
+MIX = (('camera', logging.INFO, 'LOW', 0.70), ('alert', logging.INFO, 'MEDIUM', 0.20),
+       ('publish', logging.DEBUG, None, 0.08), ('queue', logging.WARNING, 'HIGH', 0.02))
+
+
+class SlowStream:
+    """A file on a slow SD card: every line written costs delay seconds."""
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, data):
+        if self.delay and '\n' in data:
+            time.sleep(self.delay)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)  # seek/tell for the rotation check
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))], 1)
+
+
+def events(n, seed):
+    rng = random.Random(seed)
+    kinds = [kind[:3] for kind in MIX]
+    weights = [kind[3] for kind in MIX]
+    return [(*rng.choices(kinds, weights)[0], f"1/{rng.randrange(50)}") for _ in range(n)]
+
+
+def run(mode, args, log_dir, disk_ms, capacity=None, debug=False):
+    """Log the same event mix from args.threads handler threads and time each call on the caller's side."""
+    name = f"{mode}-{disk_ms}-{capacity}"
+    path = os.path.join(log_dir, f"{name}.log")
+    console = SlowStream(open(os.path.join(log_dir, f"{name}.out"), 'w'), disk_ms / 1000)
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=100 * 1024 * 1024, backupCount=3)
+    file_handler.stream = SlowStream(file_handler.stream, disk_ms / 1000)
+    if mode == 'sync':
+        # The hub before: print() to the console and a synchronous rotating file handler
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s: %(message)s'))
+        handler = file_handler
+    else:
+        file_handler.setFormatter(JsonLinesFormatter())
+        console_handler = ConsoleHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        handler = AsyncLogHandler([file_handler, console_handler], capacity=capacity or args.capacity,
+                                  low_sample=args.sample)
+    logger.addHandler(handler)
+
+    latencies, lock = [], threading.Lock()
+
+    def worker(seed):
+        mine = []
+        for category, level, priority, bed in events(args.events, seed):
+            start = time.perf_counter()
+            if mode == 'sync':
+                print(f"{category} event for {bed}")
+                logger.log(level, f"{category} event for {bed} ({priority})")
+            else:
+                logger.log(level, "%s event for %s", category, bed, extra=event(category, priority, bed=bed))
+            mine.append((time.perf_counter() - start) * 1e6)
+        with lock:
+            latencies.extend(mine)
+
+    with contextlib.redirect_stdout(console):
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logged = time.perf_counter() - started
+        if mode == 'async':
+            handler.flush(timeout=120)
+        drained = time.perf_counter() - started
+        stats = handler.stats() if mode == 'async' else None
+        logger.removeHandler(handler)
+        handler.close()
+    console.close()
+    lines = sum(1 for _ in open(path))
+    return {
+        'mode': mode,
+        'disk_ms': disk_ms,
+        'capacity': capacity or args.capacity if mode == 'async' else None,
+        'calls': len(latencies),
+        'call_p50_us': percentile(latencies, 50),
+        'call_p99_us': percentile(latencies, 99),
+        'call_max_ms': round(max(latencies) / 1000, 2),
+        'calls_per_s': round(len(latencies) / logged),
+        'drain_s': round(drained, 2),
+        'file_lines': lines,
+        'sampled_out': stats['sampled_out'] if stats else 0,
+        'rate_limited': stats['rate_limited'] if stats else 0,
+        'dropped': '/'.join(str(stats['dropped'][lane]) for lane in stats['dropped']) if stats else '-',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of logging on the alert path: print() plus a synchronous "
+                                                 "rotating file against the queued JSON-lines writer")
+    parser.add_argument('--threads', type=int, default=4, help="Handler threads logging at once")
+    parser.add_argument('--events', type=int, default=2000, help="Log calls per thread")
+    parser.add_argument('--disk-ms', type=float, default=2.0, help="Added per line written, as on a slow SD card")
+    parser.add_argument('--capacity', type=int, default=10000, help="Async buffer size in records")
+    parser.add_argument('--sample', type=int, default=10, help="Keep 1 in N LOW records")
+    parser.add_argument('--stall-ms', type=float, default=20.0,
+                        help="Per-line delay for the last run, at DEBUG with a small buffer, to show what is shed")
+    parser.add_argument('--stall-capacity', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='hub-logging-')
+    results = [run(mode, args, log_dir, disk_ms) for disk_ms in (0, args.disk_ms) for mode in ('sync', 'async')]
+    results.append(run('async', args, log_dir, args.stall_ms, capacity=args.stall_capacity, debug=True))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.threads} threads x {args.events} log calls, {args.disk_ms} ms per line on the slow disk "
+          f"(dropped = DEBUG/INFO/WARNING records shed by a full buffer)")
+    keys = ('capacity', 'call_p50_us', 'call_p99_us', 'call_max_ms', 'calls_per_s', 'drain_s', 'file_lines', 'sampled_out',
+            'rate_limited', 'dropped')
+    print(f"{'':<14}" + "".join(f"{r['mode'] + ' ' + str(r['disk_ms']) + 'ms':>16}" for r in results[:-1])
+          + f"{'stalled':>16}")
+    for key in keys:
+        print(f"{key:<14}" + "".join(f"{str(r[key]):>16}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
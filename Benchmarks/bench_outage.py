@@ -0,0 +1,181 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import FALLEN_OUT_OF_BED, AudioAlert, FallAlert, ProximityReading, bed_topic, decode_payload  # noqa: E402
+from mqtt_transport import create_client, reset_default_broker  # noqa: E402
+
+PRIORITY_ORDER = ('HIGH', 'MEDIUM', 'LOW', 'camera')
+
+
+def slow(handler, seconds):
+    """Stand-in for a Pi-class hub, so a burst is still being handled when the broker goes down."""
+    @functools.wraps(handler)
+    def wrapper(*args):
+        time.sleep(seconds)
+        return handler(*args)
+    return wrapper
+
+
+def burst(count, beds, rng):
+    """(topic, payload) for a ward's mix of alerts: in-bed readings, bed exits, falls and calls for help."""
+    out = []
+    for n in range(count):
+        bed = n % beds
+        roll = rng.random()
+        if roll < 0.4:
+            record, kind = ProximityReading('2025-01-01T00:00:00', False, [95.0, 88.2, 101.4]), 'proximity/alert'
+        elif roll < 0.55:
+            record, kind = ProximityReading('2025-01-01T00:00:00', True, [12.0, 210.5, 8.3]), 'proximity/alert'
+        elif roll < 0.7:
+            record, kind = FallAlert('2025-01-01T00:00:00', 'video', mediapipe_state=FALLEN_OUT_OF_BED), 'video/emergency'
+        elif roll < 0.85:
+            record, kind = AudioAlert('2025-01-01T00:00:00', 'Urgent Assistance', 0.93, 'help'), 'audio/emergency'
+        else:
+            record, kind = AudioAlert('2025-01-01T00:00:00', 'General Help', 0.81, 'nurse'), 'audio/emergency'
+        out.append((bed_topic('1', bed, kind), record.encode()))
+    return out
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(pct / 100 * len(values)))], 1)
+
+
+def run(args, name, outage, offline_max_bytes):
+    broker = reset_default_broker(latency=args.latency_ms / 1000, seed=1)
+    work_dir = tempfile.mkdtemp(prefix='hub-outage-')
+    if args.engine == 'async':
+        from async_hub import AsyncCentralHub as Hub
+    else:
+        from optimised_hub_final import OptimizedCentralHub as Hub
+    hub = Hub(wal_dir=os.path.join(work_dir, 'wal'), metrics_port=None, transport='inprocess', snapshot_interval=0,
+              flow_control=False, fall_window=0, fusion_window=0, log_file=os.path.join(work_dir, 'hub.log'),
+              offline_max_bytes=offline_max_bytes, offline_memory_bytes=args.memory_kb * 1024,
+              offline_flush_rate=args.flush_rate)
+    hub.logger.setLevel(logging.ERROR)
+    hub.handlers = {kind: slow(handler, args.handler_ms / 1000) for kind, handler in hub.handlers.items()}
+
+    delivered = []  # (priority, arrival time)
+    lock = threading.Lock()
+
+    def on_output(client, userdata, message):
+        alert = decode_payload(message.payload)
+        with lock:
+            delivered.append((alert.get('priority') or 'camera', time.time()))
+    dashboard = create_client('outage-dashboard', clean_session=False, transport='inprocess')
+    dashboard.on_message = on_output
+    dashboard.connect('localhost')
+    dashboard.subscribe([(bed_topic('+', '+', 'nurse/dashboard'), 2), (bed_topic('+', '+', 'video/monitor'), 2)])
+    dashboard.loop_start()
+
+    thread = threading.Thread(target=hub.start, daemon=True)
+    thread.start()
+    while not hub.connection_active:
+        time.sleep(0.01)
+    sensors = create_client('outage-sensors', transport='inprocess')
+    sensors.connect('localhost')
+    sensors.loop_start()
+    for topic, data in burst(args.alerts, args.beds, random.Random(1)):
+        sensors.publish(topic, data, qos=2)
+
+    reconnected = None
+    if outage:
+        time.sleep(args.outage_after_ms / 1000)
+        broker.set_available(False)
+        time.sleep(args.outage_s)
+        broker.set_available(True)
+        dashboard.reconnect()
+        while not hub.connection_active:
+            time.sleep(0.001)
+        reconnected = time.time()
+    # Everything has arrived once nothing new shows up for a while and nothing is left to send
+    quiet, last = 0, -1
+    deadline = time.time() + args.timeout
+    while time.time() < deadline and quiet < 20:
+        with lock:
+            count = len(delivered)
+        busy = len(hub.offline) or hub.message_queue.qsize() or hub.qos2_publish_queue.qsize()
+        quiet = quiet + 1 if count == last and not busy else 0
+        last = count
+        time.sleep(0.05)
+
+    with lock:
+        arrivals = list(delivered)
+    counts = {p: sum(1 for priority, _ in arrivals if priority == p) for p in PRIORITY_ORDER}
+    after = {p: [(at - reconnected) * 1000 for priority, at in arrivals if priority == p and at >= reconnected]
+             for p in PRIORITY_ORDER} if reconnected else {}
+    flush = hub.metrics.summary()['latency_ms']
+    flush_ms = [entry['max'] for entry in flush if entry['name'] == 'offline_flush_ms']
+    wal = dict(hub.wal.stats)
+    result = {
+        'run': name,
+        'delivered': counts,
+        'after_reconnect_p50_ms': {p: percentile(values, 50) for p, values in after.items()},
+        'flush_ms': max(flush_ms) if flush_ms else None,
+        'offline': hub.offline.summary(),
+        'wal_unacked': wal['appended'] - wal['acked'],
+    }
+    sensors.disconnect()
+    dashboard.disconnect()
+    hub.stop()
+    thread.join(timeout=5)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Takes the broker down while the hub is working through a burst of "
+                                                 "alerts and brings it back. Compares what reaches the dashboard "
+                                                 "with no outage, without the offline buffer, and with it")
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--alerts', type=int, default=90, help="Alerts in the burst (the hub's queue holds 100)")
+    parser.add_argument('--beds', type=int, default=20)
+    parser.add_argument('--handler-ms', type=float, default=50.0, help="Time the hub spends on each alert")
+    parser.add_argument('--outage-after-ms', type=float, default=100.0, help="From the burst to the outage")
+    parser.add_argument('--outage-s', type=float, default=3.0)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="Per broker hop")
+    parser.add_argument('--memory-kb', type=float, default=4, help="Offline buffer kept in memory before spilling")
+    parser.add_argument('--tight-kb', type=float, default=6, help="Offline buffer budget for the last run")
+    parser.add_argument('--flush-rate', type=float, default=200, help="Buffered publishes a second after reconnecting")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    runs = [('no outage', False, 16 * 1024 * 1024), ('no buffer', True, 0), ('buffer', True, 16 * 1024 * 1024),
+            (f'{args.tight_kb:g}KB buffer', True, int(args.tight_kb * 1024))]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = [run(args, name, outage, budget) for name, outage, budget in runs]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.alerts} alerts, {args.engine} hub at {args.handler_ms:g}ms per alert, broker down for "
+          f"{args.outage_s:g}s after {args.outage_after_ms:g}ms, flushed at {args.flush_rate:g}/s")
+    print(f"{'':<30}" + "".join(f"{r['run']:>14}" for r in results))
+    for p in PRIORITY_ORDER:
+        print(f"{'delivered ' + p:<30}" + "".join(f"{r['delivered'][p]:>14}" for r in results))
+    for p in PRIORITY_ORDER:
+        print(f"{'p50 after reconnect ms ' + p:<30}" +
+              "".join(f"{str(r['after_reconnect_p50_ms'].get(p)):>14}" for r in results))
+    rows = [('flush ms', lambda r: r['flush_ms']), ('peak buffered bytes', lambda r: r['offline']['peak_bytes']),
+            ('spilled to disk', lambda r: r['offline']['spilled']), ('evicted', lambda r: r['offline']['evicted']),
+            ('refused', lambda r: r['offline']['rejected']), ('WAL unacknowledged', lambda r: r['wal_unacked'])]
+    for label, value in rows:
+        print(f"{label:<30}" + "".join(f"{str(value(r)):>14}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
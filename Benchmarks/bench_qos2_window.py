@@ -0,0 +1,118 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import bed_topic  # noqa: E402
+from mqtt_transport import reset_default_broker  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(pct / 100 * len(values)))], 3)
+
+
+def run(window, args):
+    """Push args.alerts QoS 2 alerts through a hub with the given in-flight window and wait for every PUBCOMP."""
+    from optimised_hub_final import OptimizedCentralHub
+    broker = reset_default_broker(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, loss=args.loss,
+                                  seed=1)
+    work_dir = tempfile.mkdtemp(prefix='hub-qos2-window-')
+    hub = OptimizedCentralHub(wal_dir=os.path.join(work_dir, 'wal'), metrics_port=None, transport='inprocess',
+                              snapshot_interval=0, flow_control=False, max_inflight_qos2=window,
+                              ack_timeout=args.ack_timeout, log_file=os.path.join(work_dir, 'hub.log'))
+    hub.logger.setLevel(logging.WARNING)
+
+    # What the hub used to report as QoS 2 latency: the time client.publish() takes to hand the message to paho
+    enqueue_ms = []
+    publish = hub.client.publish
+
+    def timed_publish(topic, payload=None, qos=0, retain=False):
+        started = time.perf_counter()
+        result = publish(topic, payload, qos, retain)
+        if qos == 2:
+            enqueue_ms.append((time.perf_counter() - started) * 1000)
+        return result
+    hub.client.publish = timed_publish
+
+    thread = threading.Thread(target=hub.start, daemon=True)
+    thread.start()
+    while not hub.connection_active:
+        time.sleep(0.01)
+
+    started = time.perf_counter()
+    for n in range(args.alerts):
+        while hub.qos2_publish_queue.qsize() >= hub.qos2_publish_queue.maxsize - 1:
+            time.sleep(0.0005)  # Keep every alert in the queue rather than deferring it to the WAL
+        hub.publish_qos2(bed_topic('1', n % args.beds, 'nurse/dashboard'), {'priority': 'HIGH', 'n': n})
+    deadline = time.perf_counter() + args.timeout
+    while hub.qos2_publish_queue.unfinished_tasks and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - started
+    window_stats = hub.qos2_window.stats()
+    acks = [entry for entry in hub.metrics.summary()['latency_ms']
+            if entry['name'] == 'publish_latency_ms' and entry['qos'] == 2]
+    counters = {entry['name']: entry['value'] for entry in hub.metrics.summary()['counters'] if entry.get('qos') == 2}
+    hub.stop()
+    thread.join(timeout=5)
+    return {
+        'window': window,
+        'alerts': args.alerts,
+        'acked': window_stats['acked'],
+        'wall_s': round(elapsed, 3),
+        'acked_per_s': round(window_stats['acked'] / elapsed, 1),
+        'ack_p50_ms': max((entry['p50'] for entry in acks), default=None),
+        'ack_p99_ms': max((entry['p99'] for entry in acks), default=None),
+        'enqueue_p50_ms': percentile(enqueue_ms, 50),
+        'enqueue_p99_ms': percentile(enqueue_ms, 99),
+        'peak_inflight': window_stats['peak_inflight'],
+        'ack_timeouts': counters.get('ack_timeouts', 0),
+        'retries': counters.get('retries', 0),
+        'wal_unacked': hub.wal.stats['appended'] - hub.wal.stats['acked'],
+        'broker_retransmits': broker.stats['retransmitted'],
+        'timed_out': hub.qos2_publish_queue.unfinished_tasks > 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QoS 2 alert throughput and PUBCOMP latency of the threaded hub "
+                                                 "at several in-flight window sizes (--max-inflight-qos2), "
+                                                 "against an in-process broker with injected latency")
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 5, 20, 100])
+    parser.add_argument('--alerts', type=int, default=1000)
+    parser.add_argument('--beds', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="Per hop; a QoS 2 round trip is two hops")
+    parser.add_argument('--jitter-ms', type=float, default=2.0)
+    parser.add_argument('--loss', type=float, default=0.0, help="Chance each hop is lost and resent")
+    parser.add_argument('--ack-timeout', type=float, default=10.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help="Give up waiting for the last PUBCOMP")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = [run(window, args) for window in args.windows]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.alerts} QoS 2 alerts, {args.latency_ms:g}ms +{args.jitter_ms:g}ms jitter per hop, "
+          f"loss {args.loss:g}; enqueue_* is what the hub reported as latency before")
+    keys = ('acked', 'wall_s', 'acked_per_s', 'ack_p50_ms', 'ack_p99_ms', 'enqueue_p50_ms', 'enqueue_p99_ms',
+            'peak_inflight', 'ack_timeouts', 'retries', 'wal_unacked', 'broker_retransmits', 'timed_out')
+    print(f"{'window':<20}" + "".join(f"{r['window']:>12}" for r in results))
+    for key in keys:
+        print(f"{key:<20}" + "".join(f"{str(r[key]):>12}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
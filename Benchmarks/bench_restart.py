@@ -0,0 +1,190 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import (FALLEN_OUT_OF_BED, AudioAlert, FallAlert, ProximityReading, bed_topic,  # noqa: E402
+                          decode_payload)
+from mqtt_transport import create_client, reset_default_broker  # noqa: E402
+
+EPOCH = datetime(2024, 1, 1)
+
+
+def slow(handler, seconds):
+    """Stand-in for a Pi-class hub: each handler call takes at least this long."""
+    @functools.wraps(handler)
+    def wrapper(*args):
+        time.sleep(seconds)
+        return handler(*args)
+    return wrapper
+
+
+class Ward:
+    """Sensors holding a steady state: some patients out of bed (camera on), some on the floor
+    (the camera reporting a fall every frame), the rest asleep."""
+    def __init__(self, args):
+        self.args = args
+        self.client = create_client('restart-sensors', transport='inprocess')
+        self.client.connect('localhost')
+        self.client.loop_start()
+        self.out_of_bed = range(0, int(args.beds * args.out_of_bed))
+        self.fallen = range(args.beds - int(args.beds * args.fallen), args.beds)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        tick = 0
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            now = datetime.now().isoformat()
+            if tick % int(self.args.fps * self.args.proximity_interval) == 0:
+                for bed in range(self.args.beds):
+                    self.client.publish(bed_topic('1', bed, 'proximity/alert'),
+                                        ProximityReading(now, bed in self.out_of_bed, [95.0, 88.2, 101.4]).encode(),
+                                        qos=2)
+            for bed in self.fallen:
+                self.client.publish(bed_topic('1', bed, 'video/emergency'),
+                                    FallAlert(now, 'video', mediapipe_state=FALLEN_OUT_OF_BED).encode(), qos=2)
+            tick += 1
+            delay = start + tick / self.args.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def start_hub(args, wal_dir, warm):
+    from optimised_hub_final import OptimizedCentralHub
+    hub = OptimizedCentralHub(wal_dir=wal_dir, metrics_port=None, transport='inprocess', fusion_window=0,
+                              snapshot_interval=30 if warm else 0)
+    hub.logger.setLevel(logging.WARNING)
+    hub.handlers = {kind: slow(handler, args.handler_ms / 1000) for kind, handler in hub.handlers.items()}
+    thread = threading.Thread(target=hub.start, daemon=True)
+    started = time.perf_counter()
+    thread.start()
+    while not hub.connection_active:
+        time.sleep(0.001)
+    return hub, thread, (time.perf_counter() - started) * 1000
+
+
+def restart(args, warm):
+    """Run a hub, stop it in the middle of an audio burst, start a new one on the same WAL directory."""
+    reset_default_broker()
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-restart-'), 'wal')
+    phase = ['before']
+    counts = {p: {'proximity_camera_commands': 0, 'audio_camera_commands': 0, 'fall_alerts': 0, 'outbound': 0}
+              for p in ('before', 'after')}
+    audio_seen, lock = set(), threading.Lock()
+
+    def on_output(client, userdata, message):
+        alert = decode_payload(message.payload)
+        with lock:
+            count = counts[phase[0]]
+            count['outbound'] += 1
+            if message.topic.endswith('video/monitor'):
+                # Proximity commands after a restart are the spurious toggles; audio ones answer the burst
+                source = 'audio' if alert.get('source') == 'audio' else 'proximity'
+                count[f'{source}_camera_commands'] += 1
+            elif alert.get('alert_type') == 'FALL_DETECTED':
+                count['fall_alerts'] += 1
+            elif alert.get('source') == 'audio':
+                audio_seen.add(alert.get('timestamp'))
+    dashboard = create_client('restart-dashboard', transport='inprocess')
+    dashboard.on_message = on_output
+    dashboard.connect('localhost')
+    dashboard.subscribe([(bed_topic('+', '+', 'nurse/dashboard'), 2), (bed_topic('+', '+', 'video/monitor'), 2)])
+    dashboard.loop_start()
+
+    hub, thread, _ = start_hub(args, wal_dir, warm)
+    ward = Ward(args)
+    ward.start()
+    time.sleep(args.seconds)
+
+    # A burst of calls for help that is still being worked through when the hub is restarted
+    for n in range(args.burst):
+        stamp = (EPOCH + timedelta(microseconds=n)).isoformat()
+        ward.client.publish(bed_topic('1', n % args.beds, 'audio/emergency'),
+                            AudioAlert(stamp, 'General Help', 0.8, 'help').encode(), qos=2)
+    time.sleep(args.burst_lead)
+    stop_started = time.perf_counter()
+    hub.stop()
+    thread.join(timeout=5)
+    stop_ms = (time.perf_counter() - stop_started) * 1000
+    time.sleep(0.5)
+    with lock:
+        phase[0] = 'after'
+    hub, thread, connect_ms = start_hub(args, wal_dir, warm)
+    snapshot = dict(hub.snapshot.stats) if hub.snapshot else None
+    time.sleep(args.seconds)
+    ward.stop()
+    time.sleep(args.settle)
+    hub.stop()
+    thread.join(timeout=5)
+    dashboard.disconnect()
+    dashboard.loop_stop()
+    return {
+        'warm': warm,
+        'before': counts['before'],
+        'after_restart': counts['after'],
+        'audio_sent': args.burst,
+        'audio_delivered': len(audio_seen),
+        'stop_ms': round(stop_ms, 1),
+        'start_to_connected_ms': round(connect_ms, 1),
+        'snapshot_load_ms': snapshot['load_ms'] if snapshot else None,
+        'snapshot_bytes': snapshot['bytes'] if snapshot else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="What a hub restart costs: spurious camera toggles, re-sent "
+                                                 "fall alerts and lost alerts, cold start against snapshot warm start")
+    parser.add_argument('--beds', type=int, default=50)
+    parser.add_argument('--out-of-bed', type=float, default=0.3, help="Share of beds whose patient is out of bed")
+    parser.add_argument('--fallen', type=float, default=0.1, help="Share of beds with an ongoing fall")
+    parser.add_argument('--fps', type=float, default=10.0, help="Camera frames per second")
+    parser.add_argument('--proximity-interval', type=float, default=1.0)
+    parser.add_argument('--seconds', type=float, default=4.0, help="Steady state before and after the restart")
+    parser.add_argument('--burst', type=int, default=300, help="Audio alerts sent just before the restart")
+    parser.add_argument('--burst-lead', type=float, default=0.05, help="Seconds between the burst and stop()")
+    parser.add_argument('--handler-ms', type=float, default=2.0, help="Added to every handler call")
+    parser.add_argument('--settle', type=float, default=2.0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # Handlers print per message
+        results = [restart(args, False), restart(args, True)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    cold, warm = results
+    print(f"{args.beds} beds ({args.out_of_bed:.0%} out of bed, {args.fallen:.0%} fallen), restart during a burst "
+          f"of {args.burst} audio alerts")
+    print(f"{'after restart':<24}{'cold':>10}{'warm':>10}")
+    for key in ('proximity_camera_commands', 'audio_camera_commands', 'fall_alerts', 'outbound'):
+        print(f"{key:<24}{cold['after_restart'][key]:>10}{warm['after_restart'][key]:>10}")
+    for key in ('audio_delivered', 'stop_ms', 'start_to_connected_ms', 'snapshot_load_ms', 'snapshot_bytes'):
+        print(f"{key:<24}{str(cold[key]):>10}{str(warm[key]):>10}")
+    print(f"audio alerts sent {args.burst}")
+
+
+if __name__ == "__main__":
+    main()
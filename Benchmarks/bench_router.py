@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common')
+sys.path.insert(0, COMMON_DIR)
+
+from alert_schema import bed_topic, parse_bed_topic  # noqa: E402
+from mqtt_transport import topic_matches  # noqa: E402
+from topic_router import TopicRouter  # noqa: E402
+
+KINDS = ('audio/emergency', 'video/emergency', 'proximity/alert', 'nurse/dashboard', 'video/monitor')
+
+
+def routes(beds, wards):
+    """The hub's wildcard routes plus one literal route per bed and kind, as a deployment
+    with per-bed handlers (a bed on a different camera model, a ward under observation) would have."""
+    patterns = [f'ward/{{ward}}/bed/{{bed}}/{kind}' for kind in KINDS] + list(KINDS)
+    patterns += [bed_topic(str(bed % wards), str(bed), kind) for bed in range(beds) for kind in KINDS]
+    patterns += ['hub/#', 'ward/+/#']
+    return patterns
+
+
+def linear_match(table, topic):
+    """A list of (subscription, target) scanned in order, as message_callback_add() and the broker do."""
+    return [target for subscription, target in table if topic_matches(subscription, topic)]
+
+
+def per_call_us(fn, topics, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for topic in topics:
+            fn(topic)
+    return round((time.perf_counter() - started) / (repeat * len(topics)) * 1e6, 2)
+
+
+def run(beds, args):
+    rng = random.Random(beds)
+    patterns = routes(beds, args.wards)
+    router = TopicRouter()
+    uncached = TopicRouter(cache_size=0)
+    table = []
+    for pattern in patterns:
+        subscription = router.add(pattern, pattern)
+        uncached.add(pattern, pattern)
+        table.append((subscription, pattern))
+    topics = [bed_topic(str(bed % args.wards), str(bed), rng.choice(KINDS))
+              for bed in (rng.randrange(beds) for _ in range(args.topics))]
+    topics += ['hub/heartbeat', 'audio/emergency', 'hub/flow']
+
+    # The trie must find the same routes, in the order they were added, as a scan of every subscription.
+    # The scan is slow with thousands of routes, so it is checked and timed on a sample of the topics
+    sample = topics[-args.sample:]
+    mismatches = sum(1 for topic in sample
+                     if [route.target for route in router.match(topic)] != linear_match(table, topic))
+    for topic in topics:
+        captured = [(route.params['ward'], route.params['bed']) for route in router.match(topic)
+                    if route.pattern.startswith('ward/{')]
+        if topic.startswith('ward/') and captured != [parse_bed_topic(topic)[:2]]:
+            mismatches += 1
+    repeat = max(1, args.lookups // len(topics))
+    return {
+        'beds': beds,
+        'routes': len(router),
+        'linear_us': per_call_us(lambda topic: linear_match(table, topic), sample, 1),
+        'trie_us': per_call_us(uncached.match, topics, repeat),
+        'trie_cached_us': per_call_us(router.match, topics, repeat),
+        'parse_bed_topic_us': per_call_us(parse_bed_topic, topics, repeat),
+        'mismatches': mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of routing one incoming topic as per-bed routes are added: "
+                                                 "a linear scan of subscriptions against the compiled topic trie")
+    parser.add_argument('--beds', type=int, nargs='+', default=[1, 10, 100, 1000, 5000])
+    parser.add_argument('--wards', type=int, default=10)
+    parser.add_argument('--topics', type=int, default=2000, help="Distinct incoming topics per run")
+    parser.add_argument('--sample', type=int, default=200, help="Topics checked against and timed with the linear scan")
+    parser.add_argument('--lookups', type=int, default=50000, help="Topics routed per measurement")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = [run(beds, args) for beds in args.beds]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("µs per incoming topic; parse_bed_topic is the fixed-shape split the hub used before (no per-bed routes)")
+    keys = ('routes', 'linear_us', 'trie_us', 'trie_cached_us', 'parse_bed_topic_us', 'mismatches')
+    print(f"{'beds':<20}" + "".join(f"{r['beds']:>12}" for r in results))
+    for key in keys:
+        print(f"{key:<20}" + "".join(f"{str(r[key]):>12}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
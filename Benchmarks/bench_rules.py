@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_rules import DEFAULT_RULES, AlertRules, compile_rules  # noqa: E402
+from alert_schema import (FALLEN_OUT_OF_BED, NO_FALL_STATE, AudioAlert, FallAlert, ProximityReading,  # noqa: E402
+                          bed_topic, decode_message, parse_bed_topic)
+
+AUDIO_TYPES = ('General Help', 'Call for Medical Staff', 'Pain/Discomfort', 'Urgent Assistance')
+FALL_STATES = (FALLEN_OUT_OF_BED, NO_FALL_STATE, 'Standing', 'Sitting', 'Laying Down')
+
+
+def messages(count, rng):
+    """(topic, encoded payload) in the mix a ward sends: mostly ultrasonic readings and camera frames."""
+    out = []
+    for n in range(count):
+        bed = str(rng.randrange(50))
+        roll = rng.random()
+        if roll < 0.5:
+            record = ProximityReading('2025-01-01T00:00:00', rng.random() < 0.1,
+                                      [round(rng.uniform(5, 200), 2) for _ in range(3)])
+            kind = 'proximity/alert'
+        elif roll < 0.9:
+            record = FallAlert('2025-01-01T00:00:00', 'video', mediapipe_state=rng.choice(FALL_STATES),
+                               camera_state=rng.choice((None, True, False)))
+            kind = 'video/emergency'
+        else:
+            record = AudioAlert('2025-01-01T00:00:00', rng.choice(AUDIO_TYPES), round(rng.random(), 3), 'help')
+            kind = 'audio/emergency'
+        out.append((bed_topic('1', bed, kind), record.encode()))
+    return out
+
+
+def threshold_rules(count):
+    """count rules per topic on thresholds and two-field conditions, which compile to a chain of closures
+    rather than a table, each matching an even share of the alerts so a lookup walks half the chain."""
+    rules = []
+    for i in range(count):
+        rules.append({'name': f'audio-{i}', 'topic': 'audio/emergency',
+                      'when': {'confidence': {'gte': i / count, 'lt': (i + 1) / count}},
+                      'priority': ('HIGH', 'MEDIUM', 'LOW')[i % 3]})
+        rules.append({'name': f'fall-{i}', 'topic': 'video/emergency',
+                      'when': {'mediapipe_state': FALL_STATES[i % len(FALL_STATES)],
+                               'camera_state': bool(i // len(FALL_STATES) % 2)},
+                      'priority': ('HIGH', 'MEDIUM', 'LOW')[i % 3]})
+        rules.append({'name': f'proximity-{i}', 'topic': 'proximity/alert',
+                      'when': {'distances.min': {'gte': i * 200 / count, 'lt': (i + 1) * 200 / count}},
+                      'priority': ('HIGH', 'MEDIUM', 'LOW')[i % 3], 'publish': ['reading', 'alert']})
+    for kind in ('audio/emergency', 'video/emergency', 'proximity/alert'):
+        rules.append({'name': f'{kind}-other', 'topic': kind, 'priority': 'LOW'})
+    return rules
+
+
+def holds(actual, op, want):
+    if op == 'eq':
+        return actual == want
+    if op == 'ne':
+        return actual != want
+    if op == 'in':
+        return actual in want
+    if op == 'not_in':
+        return actual not in want
+    if actual is None:
+        return False
+    return {'gt': actual > want, 'gte': actual >= want, 'lt': actual < want, 'lte': actual <= want}[op]
+
+
+def interpret(specs, kind, record):
+    """The same rules evaluated from their dicts on every message, with no compile step."""
+    for spec in specs:
+        if spec['topic'] != kind:
+            continue
+        matched = True
+        for field, condition in spec.get('when', {}).items():
+            name, _, aggregate = field.partition('.')
+            actual = getattr(record, name)
+            if aggregate:
+                actual = {'min': min, 'max': max, 'len': len}[aggregate](actual) if actual else None
+            if not isinstance(condition, dict):
+                condition = {'in': condition} if isinstance(condition, list) else {'eq': condition}
+            if not all(holds(actual, op, want) for op, want in condition.items()):
+                matched = False
+                break
+        if matched:
+            return spec['name']
+
+
+def hardcoded(kind, record):
+    """The priority methods the hub had before rules, for comparison."""
+    if kind == 'audio/emergency':
+        return 'HIGH' if record.alert_type in ['Urgent Assistance', 'Pain/Discomfort'] else 'MEDIUM'
+    if kind == 'video/emergency':
+        return 'HIGH' if record.mediapipe_state == FALLEN_OUT_OF_BED else 'MEDIUM'
+    return 'HIGH' if record.out_of_bed else 'LOW'
+
+
+def per_call_us(fn, items, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(*item)
+    return round((time.perf_counter() - started) / (repeat * len(items)) * 1e6, 3)
+
+
+def run(name, specs, inbound, repeat):
+    rules = AlertRules()
+    rules.use(specs)
+    started = time.perf_counter()
+    for _ in range(100):
+        compile_rules(specs)
+    compile_ms = (time.perf_counter() - started) * 10
+    kinds = [parse_bed_topic(topic)[2] for topic, _ in inbound]
+    decoded = [(kind, decode_message(topic, data)) for kind, (topic, data) in zip(kinds, inbound)]
+    mismatches = sum(1 for kind, record in decoded if rules.classify(kind, record).name != interpret(specs, kind, record))
+    decode_us = per_call_us(decode_message, inbound, repeat)
+    compiled_us = per_call_us(rules.classify, decoded, repeat)
+    return {
+        'rules': name,
+        'rule_count': len(specs),
+        'compile_ms': round(compile_ms, 3),
+        'decode_us': decode_us,
+        'json_loads_us': per_call_us(lambda topic, data: json.loads(data), inbound, repeat),
+        'compiled_us': compiled_us,
+        'interpreted_us': per_call_us(lambda kind, record: interpret(specs, kind, record), decoded, repeat),
+        'hardcoded_us': per_call_us(hardcoded, decoded, repeat),
+        'share_of_decode': f"{compiled_us / decode_us:.1%}",
+        'cheaper_than_decode': compiled_us < decode_us,
+        'mismatches': mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of classifying one alert with the hub's compiled rules "
+                                                 "(alert_rules.py) against decoding it, the same rules interpreted "
+                                                 "from their dicts, and the hardcoded priority methods")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--chains', type=int, nargs='+', default=[10, 50],
+                        help="Threshold rules per topic in the larger rule sets")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    inbound = messages(args.messages, random.Random(1))
+    sets = [('default', DEFAULT_RULES)] + [(f'{count} per topic', threshold_rules(count)) for count in args.chains]
+    results = [run(name, specs, inbound, args.repeat) for name, specs in sets]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.messages} alerts (50% ultrasonic, 40% camera, 10% audio), per-alert cost in us")
+        keys = ('rule_count', 'compile_ms', 'decode_us', 'json_loads_us', 'compiled_us', 'interpreted_us',
+                'hardcoded_us', 'share_of_decode', 'cheaper_than_decode', 'mismatches')
+        print(f"{'rules':<20}" + "".join(f"{r['rules']:>16}" for r in results))
+        for key in keys:
+            print(f"{key:<20}" + "".join(f"{str(r[key]):>16}" for r in results))
+    if any(r['mismatches'] or not r['cheaper_than_decode'] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
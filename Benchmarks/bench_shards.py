@@ -0,0 +1,115 @@
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HUB_DIR = os.path.join(BENCH_DIR, '..', 'CentralHub')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+import bench_load  # noqa: E402
+from mqtt_transport import MQTTMessage  # noqa: E402
+
+
+def feed_shard(shard, shards, messages, fall_window, log_dir, start, results):
+    """Worker process: a hub shard handles the whole scenario inline, keeping only its own beds,
+    as it would with every bed topic delivered to it by the broker."""
+    from optimised_hub_final import OptimizedCentralHub
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        hub = OptimizedCentralHub(wal_dir=os.path.join(log_dir, f"wal-{shards}-{shard}"), metrics_port=None,
+                                  fall_window=fall_window, snapshot_interval=0, shard=shard, shards=shards,
+                                  log_file=os.path.join(log_dir, f"hub-{shards}-{shard}.log"))
+        hub.logger.setLevel(logging.WARNING)
+        hub.publish_qos2 = lambda topic, payload, priority=None: None
+        hub.publish_with_retry = lambda topic, payload, max_retries=3: None
+        inbound = [MQTTMessage(topic, data, 2) for _, _, topic, data in messages]
+        handled = 0
+        start.wait()  # Every shard starts at once, so the slowest one sets the wall time
+        began, cpu = time.perf_counter(), time.process_time()
+        for message in inbound:
+            hub.on_message(None, None, message)
+            if hub.message_queue.qsize():
+                hub.message_processor(*hub.message_queue.get_nowait())
+                handled += 1
+        results.put((shard, handled, time.perf_counter() - began, time.process_time() - cpu))
+
+
+def run_direct(shards, messages, args, log_dir):
+    """Hub work only, no broker: each shard is a process fed every message of the load generator's scenario."""
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=feed_shard, args=(shard, shards, messages, args.fall_window, log_dir, start,
+                                                         results)) for shard in range(shards)]
+    for worker in workers:
+        worker.start()
+    time.sleep(args.startup)  # Spawned processes import the hub and build their message lists
+    start.set()
+    reports = sorted(results.get(timeout=600) for _ in workers)
+    for worker in workers:
+        worker.join()
+    wall = max(elapsed for _, _, elapsed, _ in reports)
+    return {
+        'shards': shards,
+        'messages': len(messages),
+        'handled': sum(handled for _, handled, _, _ in reports),
+        'wall_s': round(wall, 3),
+        'throughput_per_s': round(len(messages) / wall, 1),
+        'per_shard': '/'.join(str(handled) for _, handled, _, _ in reports),
+        'cpu_s': round(sum(cpu for _, _, _, cpu in reports), 3),
+    }
+
+
+def run_broker(shards, args):
+    """The load generator against a hub started with --shards, end to end through a real broker."""
+    args.shards = shards
+    result = bench_load.run(args)
+    return {'shards': shards, 'messages': result['sent'], 'handled': result['delivered'],
+            'throughput_per_s': result['throughput_per_s'], 'offered_per_s': result['offered_per_s'],
+            'p50_ms': result['p50_ms'], 'p99_ms': result['p99_ms'], 'drop_rate': result['drop_rate'],
+            'cpu_s': result['hub_cpu_s'], 'hub_rss_mb': result['hub_rss_mb']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the sharded hub at 1 to 4 worker processes "
+                                                 "under the bench_load.py scenario (its options apply)",
+                                     parents=[bench_load.build_parser()], conflict_handler='resolve')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 3, 4])
+    parser.add_argument('--mode', choices=['direct', 'broker'], default='direct',
+                        help="direct: hub work only, each shard process fed the scenario inline; "
+                             "broker: bench_load.py --transport broker against optimised_hub_final.py --shards N")
+    parser.add_argument('--startup', type=float, default=3.0, help="Seconds for direct-mode shard processes to load")
+    parser.set_defaults(beds=200, duration=300.0, speed=1000.0)
+    args = parser.parse_args()
+
+    if args.mode == 'broker':
+        args.transport = 'broker'
+        results = [run_broker(shards, args) for shards in args.shards]
+    else:
+        messages = bench_load.scenario(args)
+        log_dir = tempfile.mkdtemp(prefix='hub-shards-')
+        results = [run_direct(shards, messages, args, log_dir) for shards in args.shards]
+    base = results[0]['throughput_per_s'] or 1
+    for result in results:
+        result['speedup'] = round(result['throughput_per_s'] / base, 2)
+
+    if args.json:
+        print(json.dumps({'cpus': os.cpu_count(), 'mode': args.mode, 'results': results}, indent=2))
+        return
+    print(f"{args.beds} beds, {results[0]['messages']} messages, {args.mode} mode, {os.cpu_count()} CPUs")
+    keys = ('throughput_per_s', 'speedup', 'handled', 'cpu_s') + (
+        ('p50_ms', 'p99_ms', 'drop_rate') if args.mode == 'broker' else ('per_shard',))
+    print(f"{'shards':<18}" + "".join(f"{r['shards']:>18}" for r in results))
+    for key in keys:
+        print(f"{key:<18}" + "".join(f"{str(r[key]):>18}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import (FALLEN_OUT_OF_BED, AudioAlert, FallAlert, ProximityReading, bed_topic,  # noqa: E402
+                          decode_message)
+from latency_trace import AUDIO_CHUNK, FRAME, READING, ClockSync, TraceRecorder, start_trace, stamp  # noqa: E402
+from mqtt_transport import create_client, reset_default_broker  # noqa: E402
+
+# Each simulated driver: its topic, how long its capture takes to become an alert, and how to build the alert
+DRIVERS = {
+    FRAME: ('video/emergency', 0.030,
+            lambda trace: FallAlert('2025-01-01T00:00:00', 'video', mediapipe_state=FALLEN_OUT_OF_BED, trace=trace)),
+    AUDIO_CHUNK: ('audio/emergency', 0.150,
+                  lambda trace: AudioAlert('2025-01-01T00:00:00', 'General Help', 0.9, 'help', trace=trace)),
+    READING: ('proximity/alert', 0.005,
+              lambda trace: ProximityReading('2025-01-01T00:00:00', False, [40.0, 41.0, 39.5], trace=trace)),
+}
+
+
+def skewed(skew_ms):
+    return lambda: time.time() + skew_ms / 1000
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(pct / 100 * len(values)))], 3)
+
+
+class Dashboard:
+    """Stands in for the Flask app: stamps dashboard_in and emitted on its own (skewed) clock and
+    records each trace the first time it reaches the screen, next to the latency measured on one true clock."""
+    def __init__(self, skew_ms, origins, skews):
+        self.clock = ClockSync('dashboard', clock=skewed(skew_ms))
+        self.skew_ms = skew_ms
+        self.traces = TraceRecorder()
+        self.origins = origins   # trace id -> (origin, true capture time)
+        self.skews = skews       # origin -> driver clock skew in ms
+        self.true_ms = {}        # origin -> true sensor-to-screen ms
+        self.raw_ms = {}         # origin -> the same from unsynchronised clocks
+        self.seen = set()
+        self.client = create_client('trace-dashboard', transport='inprocess')
+        self.client.on_message = self.on_message
+
+    def connect(self):
+        self.client.connect('localhost', 1883, 60)
+        self.client.subscribe(bed_topic('+', '+', 'nurse/dashboard'), 2)
+        self.clock.subscribe(self.client)
+        self.client.loop_start()
+
+    def on_message(self, client, userdata, message):
+        received_at = self.clock.now()
+        alert = decode_message(message.topic, message.payload)
+        trace = alert.trace
+        if not trace or trace['id'] in self.seen or trace['id'] not in self.origins:
+            return
+        self.seen.add(trace['id'])
+        self.traces.record(stamp(stamp(trace, 'dashboard_in', received_at), 'emitted', self.clock.now()))
+        origin, captured = self.origins[trace['id']]
+        true_ms = (time.time() - captured) * 1000
+        self.true_ms.setdefault(origin, []).append(true_ms)
+        self.raw_ms.setdefault(origin, []).append(true_ms + self.skew_ms - self.skews[origin])
+
+
+def run(args):
+    broker = reset_default_broker(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, seed=1)
+    work_dir = tempfile.mkdtemp(prefix='hub-trace-')
+    if args.engine == 'async':
+        from async_hub import AsyncCentralHub as Hub
+    else:
+        from optimised_hub_final import OptimizedCentralHub as Hub
+    hub = Hub(wal_dir=os.path.join(work_dir, 'wal'), metrics_port=None, transport='inprocess', snapshot_interval=0,
+              flow_control=False, fall_window=0, fusion_window=0, log_file=os.path.join(work_dir, 'hub.log'))
+    hub.logger.setLevel(logging.WARNING)
+    thread = threading.Thread(target=hub.start, daemon=True)
+    thread.start()
+    while not hub.connection_active:
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    skews = dict(zip(DRIVERS, args.skew_ms))
+    origins = {}
+    dashboard = Dashboard(args.dashboard_skew_ms, origins, skews)
+    dashboard.connect()
+    drivers = {}
+    for origin in DRIVERS:
+        client = create_client(f"trace-{origin}", transport='inprocess')
+        client.connect('localhost', 1883, 60)
+        clock = ClockSync(origin, clock=skewed(skews[origin]))
+        clock.subscribe(client)
+        client.loop_start()
+        drivers[origin] = (client, clock)
+    time.sleep(args.sync_s)  # ClockSync pings once a second to start with
+
+    for n in range(args.events):
+        for origin, (topic, processing, build) in DRIVERS.items():
+            client, clock = drivers[origin]
+            # The capture happened processing seconds ago, on the driver's clock and on the true one
+            captured = time.time() - processing
+            trace = stamp(start_trace(origin, clock.now() - processing), 'sent', clock.now())
+            origins[trace['id']] = (origin, captured)
+            client.publish(bed_topic('1', n % args.beds, topic), build(trace).encode(), qos=2)
+        time.sleep(args.interval_ms / 1000)
+    deadline = time.time() + args.timeout
+    while len(dashboard.seen) < len(origins) and time.time() < deadline:
+        time.sleep(0.01)
+
+    report = dashboard.traces.report()
+    results = {}
+    for origin in DRIVERS:
+        hops = report.get(origin, {})
+        results[origin] = {
+            'hops': hops,
+            'true_p50_ms': percentile(dashboard.true_ms.get(origin, []), 50),
+            'true_p99_ms': percentile(dashboard.true_ms.get(origin, []), 99),
+            'unsynced_p50_ms': percentile(dashboard.raw_ms.get(origin, []), 50),
+        }
+    clocks = {origin: dict(clock.stats(), skew_ms=skews[origin]) for origin, (_, clock) in drivers.items()}
+    clocks['dashboard'] = dict(dashboard.clock.stats(), skew_ms=args.dashboard_skew_ms)
+    for client, _ in drivers.values():
+        client.disconnect()
+    dashboard.client.disconnect()
+    hub.stop()
+    thread.join(timeout=5)
+    return {'engine': args.engine, 'events': len(origins), 'delivered': len(dashboard.seen),
+            'broker': dict(broker.stats), 'clocks': clocks, 'origins': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sensor-to-screen latency traces through the hub on the in-process "
+                                                 "broker, with the drivers' and dashboard's clocks set off from the "
+                                                 "hub's. Compares the traced latency with the true one")
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--events', type=int, default=200, help="Alerts sent by each driver")
+    parser.add_argument('--beds', type=int, default=20)
+    parser.add_argument('--interval-ms', type=float, default=10.0, help="Between rounds of one alert per driver")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="Per broker hop")
+    parser.add_argument('--jitter-ms', type=float, default=2.0)
+    parser.add_argument('--skew-ms', type=float, nargs=3, default=[250.0, -400.0, 1200.0],
+                        help="Clock offsets of the camera, audio and ultrasonic drivers from the hub")
+    parser.add_argument('--dashboard-skew-ms', type=float, default=-80.0)
+    parser.add_argument('--sync-s', type=float, default=4.0, help="Time given to clock sync before sending")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['delivered']}/{result['events']} traced alerts on screen, {args.engine} hub, "
+          f"{args.latency_ms:g}ms +{args.jitter_ms:g}ms jitter per broker hop")
+    print(f"\n{'clock':<14}{'skew_ms':>10}{'offset_ms':>12}{'rtt_ms':>10}{'pongs':>8}")
+    for node, stats in result['clocks'].items():
+        print(f"{node:<14}{stats['skew_ms']:>10g}{stats['offset_ms']:>12}{str(stats['rtt_ms']):>10}"
+              f"{stats['pongs']:>8}")
+    for origin, entry in result['origins'].items():
+        print(f"\n{origin:<26}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+        for hop, stats in entry['hops'].items():
+            print(f"{hop:<26}" + "".join(f"{stats[key]:>10}" for key in ('p50', 'p95', 'p99', 'max')))
+        print(f"{'true total':<26}{str(entry['true_p50_ms']):>10}{'':>10}{str(entry['true_p99_ms']):>10}")
+        print(f"{'unsynced total':<26}{str(entry['unsynced_p50_ms']):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+HUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CentralHub')
+sys.path.insert(0, HUB_DIR)
+sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Common'))
+
+from alert_schema import FALLEN_OUT_OF_BED, FallAlert, ProximityReading, bed_topic  # noqa: E402
+from mqtt_capture import CaptureReader, CaptureWriter  # noqa: E402
+from mqtt_transport import MQTTMessage, create_client, reset_default_broker  # noqa: E402
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)  # noqa: E731
+    return {'count': len(values), 'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'max': round(values[-1], 3),
+            'mean': round(statistics.mean(values), 3)}
+
+
+def paced(reader, speed, start=0.0):
+    """Yield the capture's messages at speed x the recorded pace (0: as fast as possible)."""
+    began = time.perf_counter()
+    for message in reader.messages(start):
+        if speed:
+            delay = began + (message.time - start) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield message
+
+
+def timed(handler, latencies, kind):
+    """Wrap a handler so each call's duration is recorded under kind."""
+    def wrapper(*args):
+        started = time.perf_counter()
+        try:
+            return handler(*args)
+        finally:
+            latencies.setdefault(kind, []).append((time.perf_counter() - started) * 1000)
+    return wrapper
+
+
+def replay_hub(reader, args):
+    """Publish the capture through the in-process broker to a fresh OptimizedCentralHub (or the asyncio
+    engine) and time every handler call, then wait for its queues to drain."""
+    reset_default_broker()
+    wal_dir = os.path.join(tempfile.mkdtemp(prefix='hub-replay-'), 'wal')
+    options = dict(wal_dir=wal_dir, metrics_port=None, transport='inprocess', snapshot_interval=0)
+    if args.engine == 'async':
+        from async_hub import AsyncCentralHub
+        hub = AsyncCentralHub(**options)
+    else:
+        from optimised_hub_final import OptimizedCentralHub
+        hub = OptimizedCentralHub(**options)
+    hub.logger.setLevel(logging.WARNING)
+    latencies = {}
+    hub.handlers = {kind: timed(handler, latencies, kind) for kind, handler in hub.handlers.items()}
+    received = [0]
+    on_message = hub.on_message
+
+    def counting(client, userdata, message):
+        received[0] += 1
+        on_message(client, userdata, message)
+    hub.on_message = counting
+    thread = threading.Thread(target=hub.start, daemon=True)
+    thread.start()
+    while not hub.connection_active:
+        time.sleep(0.01)
+
+    player = create_client('replay', transport='inprocess')
+    player.connect('localhost')
+    player.loop_start()
+    expected = 0
+    started = time.perf_counter()
+    for message in paced(reader, args.speed, args.start):
+        if hub.router.match(message.topic):
+            expected += 1
+        player.publish(message.topic, message.payload, qos=message.qos, retain=message.retain)
+    sent = time.perf_counter()
+    deadline = sent + args.timeout
+    while received[0] < expected and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    for work_queue in (hub.message_queue, hub.proximity_publish_queue, hub.qos2_publish_queue):
+        while work_queue.unfinished_tasks and time.perf_counter() < deadline:
+            time.sleep(0.001)
+    drained = time.perf_counter()
+    player.disconnect()
+    player.loop_stop()
+    hub.stop()
+    thread.join(timeout=5)
+    lanes = hub.message_queue.lane_stats()
+    return {
+        'target': f"hub ({args.engine})",
+        'messages': expected,
+        'received': received[0],
+        'replay_s': round(sent - started, 3),
+        'drain_s': round(drained - sent, 3),
+        'total_s': round(drained - started, 3),
+        'timed_out': drained >= deadline,
+        'dropped': sum(lane['evicted'] + lane['rejected'] for lane in lanes.values()),
+        'deduplicated': hub.fall_dedup.stats().get('suppressed'),
+        'handler_ms': {kind: percentiles(values) for kind, values in sorted(latencies.items())},
+    }
+
+
+def replay_flask(reader, args):
+    """Call Edge_Flask/app.py's on_message for every dashboard message in the capture, timing each call.
+    on_message is synchronous, so the capture is drained as soon as the last call returns."""
+    os.environ.setdefault('MQTT_TRANSPORT', 'inprocess')  # app.py creates its client at import
+    sys.path.insert(0, os.path.join(HUB_DIR, '..', 'Edge_Flask'))
+    import app as dashboard
+    latencies = []
+    messages = 0
+    started = time.perf_counter()
+    for message in paced(reader, args.speed, args.start):
+        if not dashboard.router.match(message.topic):
+            continue
+        call = time.perf_counter()
+        dashboard.on_message(dashboard.mqtt_client, None, MQTTMessage(message.topic, message.payload, message.qos,
+                                                                      message.retain))
+        latencies.append((time.perf_counter() - call) * 1000)
+        messages += 1
+    finished = time.perf_counter()
+    return {
+        'target': 'flask',
+        'messages': messages,
+        'received': messages,
+        'replay_s': round(finished - started, 3),
+        'drain_s': 0.0,
+        'total_s': round(finished - started, 3),
+        'timed_out': False,
+        'handler_ms': {'on_message': percentiles(latencies)},
+    }
+
+
+def write_storm(path, beds, fps, seconds, proximity_interval=5.0):
+    """A pathological capture: every bed's camera reports a fall on every frame while the ultrasonic
+    sensors keep reporting the patients out of bed."""
+    epoch = datetime(2024, 1, 1)
+    with CaptureWriter(path) as writer:
+        frames = int(seconds * fps)
+        for frame in range(frames):
+            at = frame / fps
+            stamp = (epoch + timedelta(seconds=at)).isoformat(timespec='microseconds')
+            if frame % max(1, int(proximity_interval * fps)) == 0:
+                for bed in range(beds):
+                    writer.write(bed_topic('1', bed, 'proximity/alert'),
+                                 ProximityReading(stamp, True, [30.0, 28.5, 31.2]).encode(), qos=2, at=at)
+            for bed in range(beds):
+                writer.write(bed_topic('1', bed, 'video/emergency'),
+                             FallAlert(stamp, 'video', mediapipe_state=FALLEN_OUT_OF_BED).encode(), qos=2, at=at)
+        return writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an MQTT capture into the Central Hub or the Flask "
+                                                 "dashboard and report per-message handler latency and drain time")
+    parser.add_argument('capture', help="Capture file from Common/mqtt_capture.py record (or --storm)")
+    parser.add_argument('--target', choices=['hub', 'flask'], default='hub')
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--speed', type=float, default=1.0, help="Multiple of the recorded pace, 0 for as fast as possible")
+    parser.add_argument('--start', type=float, default=0.0, help="Skip to this many seconds into the capture")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Give up waiting for the hub to drain")
+    parser.add_argument('--storm', action='store_true',
+                        help="First write a fall-alert storm to the capture path (see --beds/--fps/--seconds)")
+    parser.add_argument('--beds', type=int, default=20)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--output', help="Also save the result as JSON, e.g. to compare two hub versions")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.storm:
+        count = write_storm(args.capture, args.beds, args.fps, args.seconds)
+        print(f"Wrote a {args.seconds:.0f}s fall storm for {args.beds} beds ({count} messages) to {args.capture}")
+    reader = CaptureReader(args.capture)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # Handlers print per message
+        result = (replay_hub if args.target == 'hub' else replay_flask)(reader, args)
+    result.update(capture=args.capture, speed=args.speed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    pace = 'max speed' if not args.speed else f"{args.speed:g}x"
+    print(f"{result['target']}: {result['messages']} messages at {pace}, replayed in {result['replay_s']}s, "
+          f"drained {result['drain_s']}s later ({result['total_s']}s total)"
+          f"{', TIMED OUT' if result['timed_out'] else ''}")
+    if 'dropped' in result:
+        print(f"dropped {result['dropped']}, fall repeats de-duplicated {result['deduplicated']}")
+    print(f"{'handler':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for kind, stats in result['handler_ms'].items():
+        print(f"{kind:<20}{stats['count']:>8}" + "".join(f"{stats.get(k, '-'):>10}" for k in ('p50', 'p95', 'p99', 'max')))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+import time
+
+from hub_logging import event
+
+
+class AckWindow:
+    """In-flight window for publishes that wait for a broker acknowledgement.
+
+    A sender takes a slot with acquire() before it publishes, and track()s
+    the message id paho returns. ack(mid), called from on_publish (PUBACK,
+    or PUBCOMP for QoS 2), frees the slot and returns the tracked item with
+    the time from track() to the acknowledgement. A message id that is not
+    acknowledged within ack_timeout seconds frees its slot too and is handed
+    to on_timeout(mid, item).
+
+    One timer thread runs the ack deadlines and any call_later() callbacks,
+    such as publish retries, so no sender sleeps while it waits.
+    """
+    def __init__(self, size=20, ack_timeout=10.0, on_timeout=None, logger=None):
+        self.size = max(1, size)
+        self.ack_timeout = ack_timeout
+        self.on_timeout = on_timeout
+        self.logger = logger
+
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}   # mid -> (item, monotonic time sent)
+        self._timers = []    # heap of (due, tiebreak, callback, args)
+        self._order = itertools.count()
+        self._running = False
+        self._thread = None
+        self._stats = {'sent': 0, 'acked': 0, 'timeouts': 0, 'peak_inflight': 0, 'delayed_calls': 0}
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='ack-window', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2):
+        """Stop the timer thread; publishes still in flight are left to the WAL."""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    # Slots
+
+    def acquire(self, timeout=None):
+        """Wait up to timeout seconds for a free slot; False if none came free."""
+        return self._slots.acquire(timeout=timeout)
+
+    def release(self):
+        """Give back a slot taken with acquire() whose publish is finished without an acknowledgement."""
+        self._slots.release()
+
+    # Message ids
+
+    def track(self, mid, item):
+        """Start the ack clock for mid. Call it before on_publish can run for mid."""
+        entry = (item, time.monotonic())
+        with self._lock:
+            self._pending[mid] = entry
+            self._stats['sent'] += 1
+            self._stats['peak_inflight'] = max(self._stats['peak_inflight'], len(self._pending))
+            if self.ack_timeout:
+                self._schedule(self.ack_timeout, self._expire, (mid, entry))
+
+    def ack(self, mid):
+        """(item, latency_ms) for a tracked mid and free its slot; None if mid is not tracked (or timed out)."""
+        with self._lock:
+            entry = self._pending.pop(mid, None)
+            if entry is None:
+                return None
+            self._stats['acked'] += 1
+        self._slots.release()
+        item, sent_at = entry
+        return item, (time.monotonic() - sent_at) * 1000
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) on the timer thread after delay seconds."""
+        with self._lock:
+            self._stats['delayed_calls'] += 1
+            self._schedule(delay, callback, args)
+
+    @property
+    def inflight(self):
+        return len(self._pending)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=self.size, inflight=len(self._pending), timers=len(self._timers))
+
+    # Timer thread
+
+    def _schedule(self, delay, callback, args):
+        # Caller holds the lock
+        order = next(self._order)
+        heapq.heappush(self._timers, (time.monotonic() + delay, order, callback, args))
+        if self._timers[0][1] == order:
+            self._wakeup.notify()  # New earliest deadline
+
+    def _expire(self, mid, entry):
+        with self._lock:
+            if self._pending.get(mid) is not entry:
+                return  # Acknowledged in time (paho may have reused the mid since)
+            del self._pending[mid]
+            self._stats['timeouts'] += 1
+        self._slots.release()
+        if self.on_timeout:
+            self.on_timeout(mid, entry[0])
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._running and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._wakeup.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if not self._running:
+                    return
+                _, _, callback, args = heapq.heappop(self._timers)
+            try:
+                callback(*args)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error("Ack window timer error: %s", e, extra=event('publish', qos=2))
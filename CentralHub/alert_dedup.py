@@ -0,0 +1,69 @@
+import threading
+import time
+
+FORWARD = 'forward'
+SUMMARY = 'summary'
+SUPPRESS = 'suppress'
+
+
+class AlertDeduplicator:
+    """Collapses a stream of identical alerts into one event per key.
+
+    The first alert for a key (e.g. bed and source), or one whose state differs
+    from the ongoing event's (an escalation), is forwarded straight away. Repeats
+    of the same state are suppressed, except that one is let through as a
+    "still ongoing" summary every summary_interval seconds. An event ends when
+    no repeat has arrived for window seconds, so the next alert starts a new
+    one. window=0 forwards everything.
+    """
+    def __init__(self, window=10.0, summary_interval=30.0, clock=time.monotonic):
+        self.window = window
+        self.summary_interval = summary_interval
+        self.clock = clock
+        # key -> [state, last seen, last forwarded, repeats since last forwarded]; one entry per
+        # bed and source, so the table stays as small as the ward
+        self._events = {}
+        self._lock = threading.Lock()
+        self._counts = {FORWARD: 0, SUMMARY: 0, SUPPRESS: 0}
+
+    def check(self, key, state):
+        """Return (decision, repeats): FORWARD, SUMMARY or SUPPRESS, and how many
+        repeats were suppressed since the last alert forwarded for this key."""
+        now = self.clock()
+        with self._lock:
+            event = self._events.get(key)
+            if not self.window or event is None or event[0] != state or now - event[1] > self.window:
+                self._events[key] = [state, now, now, 0]
+                decision, repeats = FORWARD, 0
+            else:
+                event[1] = now
+                if self.summary_interval and now - event[2] >= self.summary_interval:
+                    repeats, event[2], event[3] = event[3], now, 0
+                    decision = SUMMARY
+                else:
+                    event[3] += 1
+                    repeats = event[3]
+                    decision = SUPPRESS
+            self._counts[decision] += 1
+        return decision, repeats
+
+    def dump(self):
+        """Ongoing events as [key, state, seen secs ago, forwarded secs ago, repeats], for a snapshot."""
+        now = self.clock()
+        with self._lock:
+            return [[list(key) if isinstance(key, tuple) else key, state, now - seen, now - forwarded, repeats]
+                    for key, (state, seen, forwarded, repeats) in self._events.items()]
+
+    def load(self, events, offline=0.0):
+        """Restore dump() output; offline is how long ago it was taken, so events still age across a restart."""
+        now = self.clock()
+        with self._lock:
+            for key, state, seen, forwarded, repeats in events:
+                if seen + offline <= self.window:
+                    key = tuple(key) if isinstance(key, list) else key
+                    self._events[key] = [state, now - seen - offline, now - forwarded - offline, repeats]
+
+    def stats(self):
+        with self._lock:
+            return {'events': len(self._events), 'forwarded': self._counts[FORWARD],
+                    'summaries': self._counts[SUMMARY], 'suppressed': self._counts[SUPPRESS]}
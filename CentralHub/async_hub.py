@@ -0,0 +1,305 @@
+import asyncio
+import queue
+import time
+
+from hub_logging import event
+from optimised_hub_final import (MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, OptimizedCentralHub, encode_payload,
+                                 parse_bed_topic)
+
+
+class AsyncCentralHub(OptimizedCentralHub):
+    """Central hub running on a single asyncio event loop.
+
+    Uses the same queues, WAL and handle_* methods as OptimizedCentralHub,
+    but paho's socket is driven by the event loop (add_reader/add_writer)
+    instead of loop_forever(), and dispatchers, publishes, acknowledgements,
+    retries, reconnects and the heartbeat are all coroutines, so the hub runs
+    on one thread.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self._stop_event = None
+        self._wakeups = {}
+        self._ack_futures = {}  # paho mid -> future resolved by on_publish
+        self._tasks = set()
+
+    # Event loop integration for paho
+
+    def _attach_socket_callbacks(self):
+        def on_socket_open(client, userdata, sock):
+            self.loop.add_reader(sock, client.loop_read)
+
+        def on_socket_close(client, userdata, sock):
+            self.loop.remove_reader(sock)
+
+        def on_socket_register_write(client, userdata, sock):
+            self.loop.add_writer(sock, client.loop_write)
+
+        def on_socket_unregister_write(client, userdata, sock):
+            self.loop.remove_writer(sock)
+
+        self.client.on_socket_open = on_socket_open
+        self.client.on_socket_close = on_socket_close
+        self.client.on_socket_register_write = on_socket_register_write
+        self.client.on_socket_unregister_write = on_socket_unregister_write
+
+    async def _misc_loop(self):
+        # Keepalive pings and QoS retransmission timers
+        while self.running:
+            if self.client.loop_misc() != MQTT_ERR_SUCCESS and self.connection_active:
+                self.logger.warning("MQTT loop_misc reported an error", extra=event('connection'))
+            await asyncio.sleep(1)
+
+    def _spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _wake(self, name):
+        event = self._wakeups.get(name)
+        if event:
+            event.set()
+
+    # MQTT callbacks; paho calls these from loop_read/loop_write on the event loop
+
+    def on_message(self, client, userdata, message):
+        super().on_message(client, userdata, message)
+        self._wake('message')
+
+    def on_publish(self, client, userdata, mid):
+        super().on_publish(client, userdata, mid)
+        ack = self._ack_futures.pop(mid, None)
+        if ack and not ack.done():
+            ack.set_result(time.time())
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connection_active = False
+        if rc != 0:
+            self.logger.warning("Unexpected disconnection. Reconnecting...", extra=event('connection', rc=rc))
+            self._spawn(self._reconnect())
+
+    async def _reconnect(self):
+        attempt = 1
+        max_attempts = 10
+        max_delay = 60
+        aggressive_attempts = 4
+        aggressive_delay = 1
+        while not self.connection_active and self.running and attempt <= max_attempts:
+            try:
+                self.logger.info("Reconnection attempt %d", attempt, extra=event('connection'))
+                self.client.reconnect()
+                return
+            except Exception as e:
+                self.logger.error("Reconnection attempt %d failed: %s", attempt, e, extra=event('connection'))
+                if attempt < aggressive_attempts:
+                    delay = aggressive_delay
+                else:
+                    delay = min(self.reconnect_delay * (2 ** (attempt - aggressive_attempts)), max_delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+        if attempt > max_attempts:
+            self.logger.critical("Max reconnection attempts reached", extra=event('connection'))
+
+    # Publishing
+
+    def publish_with_retry(self, topic, payload, max_retries=3, priority=None):
+        queued = super().publish_with_retry(topic, payload, max_retries, priority)
+        self._wake('proximity')
+        return queued
+
+    def publish_qos2(self, topic, payload, priority=None):
+        queued = super().publish_qos2(topic, payload, priority)
+        self._wake('qos2')
+        return queued
+
+    def replay_qos2_wal(self):
+        super().replay_qos2_wal()
+        self._wake('qos2')
+
+    def replay_snapshot(self):
+        super().replay_snapshot()
+        self._wake('message')
+
+    def start_flush(self):
+        if self._flush_lock.acquire(blocking=False):
+            self._spawn(self._flush_offline())
+
+    async def _flush_offline(self):
+        try:
+            while True:
+                pause = self.flush_offline_step()
+                if pause is None:
+                    break
+                self._wake('proximity')
+                self._wake('qos2')
+                await asyncio.sleep(pause)
+        finally:
+            self._flush_lock.release()
+
+    async def _publish(self, work_queue, topic, payload, qos, max_retries=3, seq=None):
+        """Publish and wait for the broker acknowledgement without blocking the loop."""
+        try:
+            data = encode_payload(payload, self.codec)
+            kind = parse_bed_topic(topic)[2]  # Metric label, so series do not multiply with beds
+            for attempt in range(1, max_retries + 1):
+                if not self.connection_active:
+                    # Waits for the reconnect in the offline buffer; flushed once on_connect fires
+                    self.defer(topic, data, qos, payload.get('priority') or ('MEDIUM' if qos == 2 else 'LOW'), seq)
+                    return False
+                if attempt > 1:
+                    self.metrics.inc('retries', topic=kind, qos=qos)
+                start_time = time.time()
+                ack = self.loop.create_future()
+                # NO_CONN: it raced a disconnect, and the client sends it on reconnect
+                with self._inflight_lock:
+                    result = self.client.publish(topic, data, qos=qos)
+                    if result.rc in (MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN):
+                        self._ack_futures[result.mid] = ack
+                        if seq is not None:
+                            self._inflight_mids[result.mid] = seq
+                if result.rc not in (MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN):
+                    self.logger.error("✗ QoS %d attempt %d to %s: %s", qos, attempt, topic, result.rc,
+                                      extra=event('publish', qos=qos))
+                    await asyncio.sleep(self.publish_retry_delay)
+                    continue
+                try:
+                    acked_at = await asyncio.wait_for(ack, self.ack_timeout)
+                except asyncio.TimeoutError:
+                    # paho keeps retransmitting on its own; the WAL still holds QoS 2 alerts
+                    self._ack_futures.pop(result.mid, None)
+                    self.logger.warning("QoS %d to %s not acknowledged within %ss", qos, topic, self.ack_timeout,
+                                        extra=event('publish', qos=qos))
+                    self.metrics.inc('ack_timeouts', topic=kind, qos=qos)
+                    return False
+                latency = (acked_at - start_time) * 1000  # ms, until PUBACK/PUBCOMP
+                self.metrics.observe('publish_latency_ms', latency, topic=kind, qos=qos)
+                self.logger.debug("✓ QoS %d to %s on attempt %d", qos, topic, attempt,
+                                  extra=event('publish', payload.get('priority'), qos=qos, latency_ms=round(latency, 2)))
+                return True
+            self.logger.error("QoS %d failed to %s after %d", qos, topic, max_retries, extra=event('publish', qos=qos))
+            self.metrics.inc('drops', queue='qos2' if qos == 2 else 'proximity', reason='publish_failed')
+            return False
+        finally:
+            work_queue.task_done()
+            self.resume_replay()
+
+    # Dispatchers
+
+    async def _drain(self, name, work_queue, handle):
+        event = self._wakeups[name]
+        while self.running:
+            await event.wait()
+            event.clear()
+            while True:
+                try:
+                    item = work_queue.get_nowait()
+                except queue.Empty:
+                    break
+                await handle(item)
+
+    async def _process_message(self, item):
+        self.message_processor(*item)
+        await asyncio.sleep(0)  # Let socket reads and acks interleave with a backlog
+
+    async def _dispatch_proximity(self, item):
+        topic, payload, max_retries = item
+        self._spawn(self._publish(self.proximity_publish_queue, topic, payload, 1, max_retries))
+
+    async def _dispatch_qos2(self, item):
+        topic, payload, seq = item
+        await self._qos2_window.acquire()
+        task = self._spawn(self._publish(self.qos2_publish_queue, topic, payload, 2, seq=seq))
+        task.add_done_callback(lambda _: self._qos2_window.release())
+
+    # Timers
+
+    async def _heartbeat(self):
+        while self.running:
+            try:
+                if self.connection_active:
+                    self.send_heartbeat()
+            except Exception as e:
+                self.logger.error("Heartbeat error: %s", e, extra=event('heartbeat'))
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _sample_resources(self):
+        # Same sampler as the threaded engine, driven by a timer instead of its own thread
+        while self.running:
+            try:
+                self.resources.sample()
+            except Exception as e:
+                self.logger.error("Resource sampler error: %s", e, extra=event('hub'))
+            await asyncio.sleep(self.resources.interval)
+
+    async def _monitor(self):
+        while self.running:
+            try:
+                self.log_queue_stats()
+                self.update_flow()
+                self.maybe_checkpoint()
+                self.rules.maybe_reload()
+            except Exception as e:
+                self.logger.error("Queue monitor error: %s", e, extra=event('pool'))
+            await asyncio.sleep(self.thread_scaling_interval)
+
+    # Lifecycle
+
+    async def serve(self, connect=True):
+        """Run the hub until stop() is called. connect=False uses whatever client is already attached."""
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._wakeups = {name: asyncio.Event() for name in ('message', 'proximity', 'qos2')}
+        self._qos2_window = asyncio.Semaphore(self.max_inflight_qos2)
+        self.running = True
+
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+        if connect:
+            self._attach_socket_callbacks()
+            self._wal_replay = self.wal.open()
+            self.offline.open()
+            self.warm_start = self.restore()
+            self.checkpoint()
+            self.start_metrics_server()
+            self.logger.info("Starting Central Hub (asyncio engine)...", extra=event('hub'))
+            self.client.connect(self.broker_address, self.broker_port, 120)
+
+        workers = [
+            self._spawn(self._drain('message', self.message_queue, self._process_message)),
+            self._spawn(self._drain('proximity', self.proximity_publish_queue, self._dispatch_proximity)),
+            self._spawn(self._drain('qos2', self.qos2_publish_queue, self._dispatch_qos2)),
+            self._spawn(self._heartbeat()),
+            self._spawn(self._monitor()),
+            self._spawn(self._sample_resources()),
+        ]
+        if connect:
+            workers.append(self._spawn(self._misc_loop()))
+        self.logger.info("Waiting for messages...", extra=event('hub'))
+        try:
+            await self._stop_event.wait()
+        finally:
+            self.running = False
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if connect:
+                self.checkpoint(pending=True)
+                self.client.disconnect()
+            self.offline.close()
+            self.wal.close()
+            if self.metrics_server:
+                self.metrics_server.shutdown()
+            self.logger.info("Central Hub (asyncio engine) stopped cleanly", extra=event('hub', log=self.log_writer.stats()))
+            self.log_writer.flush()
+
+    def start(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        self.running = False
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._stop_event.set)
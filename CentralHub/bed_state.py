@@ -0,0 +1,100 @@
+import threading
+
+from alert_schema import AudioAlert, FallAlert, ProximityReading, bed_topic
+
+# Last readings kept per bed and the record type each is restored as
+_READINGS = (('proximity', ProximityReading), ('last_audio', AudioAlert), ('last_fall', FallAlert))
+
+
+class BedState:
+    """Everything the hub remembers about one bed.
+
+    Output topics are built once when the bed is first seen, so handlers do
+    not format strings per message.
+    """
+    __slots__ = ('ward', 'bed', 'monitor_topic', 'dashboard_topic', 'camera_state', 'proximity',
+                 'last_audio', 'last_fall', 'last_seen', 'fall_repeats', 'lock')
+
+    def __init__(self, ward, bed):
+        self.ward = ward
+        self.bed = bed
+        self.monitor_topic = bed_topic(ward, bed, 'video/monitor')
+        self.dashboard_topic = bed_topic(ward, bed, 'nurse/dashboard')
+        self.camera_state = None    # Last camera on/off state sent for this bed
+        self.proximity = None       # Last ProximityReading
+        self.last_audio = None      # Last AudioAlert
+        self.last_fall = None       # Last FallAlert
+        self.last_seen = None       # Timestamp of the last message from any source
+        self.fall_repeats = 0       # Fall frames suppressed since the last fall alert sent
+        self.lock = threading.Lock()  # Handlers for one bed can run on different pool workers
+
+    def topic(self, kind):
+        """This bed's topic for an output kind such as 'nurse/dashboard'."""
+        if kind == 'nurse/dashboard':
+            return self.dashboard_topic
+        if kind == 'video/monitor':
+            return self.monitor_topic
+        return bed_topic(self.ward, self.bed, kind)
+
+    @property
+    def bed_id(self):
+        return 'default' if self.ward is None else f"{self.ward}/{self.bed}"
+
+    def snapshot(self):
+        return {
+            'bed_id': self.bed_id,
+            'camera_state': self.camera_state,
+            'out_of_bed': self.proximity.out_of_bed if self.proximity else None,
+            'distances': self.proximity.distances if self.proximity else None,
+            'last_audio': self.last_audio.alert_type if self.last_audio else None,
+            'last_fall': self.last_fall.mediapipe_state if self.last_fall else None,
+            'last_seen': self.last_seen,
+        }
+
+    def dump(self):
+        """Everything needed to rebuild this bed after a restart, as plain JSON types."""
+        state = {'ward': self.ward, 'bed': self.bed, 'camera_state': self.camera_state,
+                 'last_seen': self.last_seen, 'fall_repeats': self.fall_repeats}
+        for attr, _ in _READINGS:
+            reading = getattr(self, attr)
+            state[attr] = reading.to_dict() if reading else None
+        return state
+
+    def load(self, state):
+        self.camera_state = state.get('camera_state')
+        self.last_seen = state.get('last_seen')
+        self.fall_repeats = state.get('fall_repeats', 0)
+        for attr, record in _READINGS:
+            data = state.get(attr)
+            setattr(self, attr, record.from_dict(data) if data else None)
+
+
+class BedRegistry:
+    """Per-bed state table keyed by (ward, bed); single-bed topics map to (None, None)."""
+    def __init__(self):
+        self._beds = {}
+        self._lock = threading.Lock()
+
+    def get(self, ward, bed):
+        key = (ward, bed)
+        state = self._beds.get(key)
+        if state is None:
+            with self._lock:
+                state = self._beds.setdefault(key, BedState(ward, bed))
+        return state
+
+    def __len__(self):
+        return len(self._beds)
+
+    def __iter__(self):
+        return iter(list(self._beds.values()))
+
+    def snapshot(self):
+        return [state.snapshot() for state in self]
+
+    def dump(self):
+        return [state.dump() for state in self]
+
+    def load(self, states):
+        for state in states:
+            self.get(state['ward'], state['bed']).load(state)
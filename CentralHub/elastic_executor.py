@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from hub_logging import event
+
+
+class ElasticThreadPool:
+    """Thread pool that grows under load and retires idle workers.
+
+    A worker is added when a task arrives and no worker is idle, or when tasks
+    have been waiting longer than target_wait on average. Workers above
+    min_workers exit after idle_timeout seconds without work. can_grow is an
+    optional callable consulted before adding a worker (e.g. a memory check).
+    acquire() waits until a worker is free to start one more task (or one
+    of prefetch tasks may wait for the next), so a caller can leave its
+    backlog in its own queue and submit() only what runs soon. It reserves
+    nothing: another thread submitting in between may take that worker,
+    and the task then waits in the pool. The hub has a single dispatcher
+    per pool, so its acquire() and submit() pairs do not race.
+
+    Besides acquire(), submit() and shutdown(), stats() returns a snapshot
+    of the pool's counters, and current_size and peak_size give its worker
+    count now and at most.
+    """
+    def __init__(self, name, min_workers=1, max_workers=4, idle_timeout=30.0, target_wait=0.05,
+                 can_grow=None, prefetch=0, logger=None):
+        self.name = name
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.idle_timeout = idle_timeout
+        self.target_wait = target_wait
+        self.can_grow = can_grow
+        self.prefetch = max(0, prefetch)
+        self.logger = logger
+
+        self._tasks = deque()
+        self._lock = threading.Lock()
+        self._work_ready = threading.Condition(self._lock)
+        self._worker_free = threading.Condition(self._lock)
+        self._workers = 0
+        self._idle = 0
+        self._busy = 0
+        self._shutdown = False
+        self._threads = set()
+        self._next_id = 0
+
+        # Exponentially weighted averages, in seconds
+        self._avg_wait = 0.0
+        self._avg_run = 0.0
+        self._stats = {'peak_workers': 0, 'spawned': 0, 'retired': 0, 'completed': 0}
+
+        with self._lock:
+            for _ in range(self.min_workers):
+                self._spawn_locked()
+
+    def acquire(self, timeout=None):
+        """Wait up to timeout seconds until a worker is free to start one more task, adding one if
+        the pool may grow; False if none came free (or the pool is shut down)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not self._shutdown:
+                if not self._has_free_worker_locked():
+                    self._maybe_grow_locked("backlog")
+                if self._has_free_worker_locked():
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._worker_free.wait(remaining)
+            return False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError(f"cannot submit to {self.name} after shutdown")
+            self._tasks.append((future, fn, args, kwargs, time.monotonic()))
+            if self._idle < len(self._tasks):
+                self._maybe_grow_locked("backlog")
+            self._work_ready.notify()
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            self._shutdown = True
+            self._work_ready.notify_all()
+            self._worker_free.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    @property
+    def current_size(self):
+        return self._workers
+
+    @property
+    def peak_size(self):
+        return self._stats['peak_workers']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self._workers,
+                'idle': self._idle,
+                'busy': self._busy,
+                'queued': len(self._tasks),
+                'peak_workers': self._stats['peak_workers'],
+                'spawned': self._stats['spawned'],
+                'retired': self._stats['retired'],
+                'completed': self._stats['completed'],
+                'avg_wait_ms': round(self._avg_wait * 1000, 3),
+                'avg_run_ms': round(self._avg_run * 1000, 3),
+            }
+
+    def _has_free_worker_locked(self):
+        # Workers neither running a task nor about to pick up one already submitted, plus the
+        # prefetch allowance of tasks that may wait here for the next free worker
+        return self._workers - self._busy + self.prefetch > len(self._tasks)
+
+    def _maybe_grow_locked(self, reason):
+        if self._workers >= self.max_workers:
+            return
+        if self.can_grow and not self.can_grow():
+            return
+        self._spawn_locked()
+        if self.logger:
+            self.logger.info("%s pool grew to %d workers (%s)", self.name, self._workers, reason,
+                             extra=event('pool'))
+
+    def _spawn_locked(self):
+        self._next_id += 1
+        thread = threading.Thread(target=self._worker, name=f"{self.name}-{self._next_id}", daemon=True)
+        self._workers += 1
+        self._stats['spawned'] += 1
+        self._stats['peak_workers'] = max(self._stats['peak_workers'], self._workers)
+        self._threads.add(thread)
+        thread.start()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+                idle_since = time.monotonic()
+                while not self._tasks and not self._shutdown:
+                    remaining = self.idle_timeout - (time.monotonic() - idle_since)
+                    if remaining <= 0 and self._workers > self.min_workers:
+                        self._idle -= 1
+                        self._retire_locked()
+                        if self.logger:
+                            self.logger.info("%s pool shrank to %d workers (idle)", self.name, self._workers,
+                                             extra=event('pool'))
+                        return
+                    self._work_ready.wait(remaining if remaining > 0 else self.idle_timeout)
+                self._idle -= 1
+                if not self._tasks:
+                    self._retire_locked()  # Shutting down with nothing left to run
+                    return
+                future, fn, args, kwargs, enqueued_at = self._tasks.popleft()
+                self._busy += 1
+                waited = time.monotonic() - enqueued_at
+                self._avg_wait = 0.8 * self._avg_wait + 0.2 * waited
+                # Tasks are queueing for too long: add a worker even if one just went idle
+                if self._tasks and self._avg_wait > self.target_wait:
+                    self._maybe_grow_locked(f"avg wait {self._avg_wait * 1000:.0f}ms")
+
+            if not future.set_running_or_notify_cancel():
+                self._finished()
+                continue
+            started = time.monotonic()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                ran = time.monotonic() - started
+                with self._lock:
+                    self._avg_run = 0.8 * self._avg_run + 0.2 * ran
+                    self._stats['completed'] += 1
+                self._finished()
+
+    def _finished(self):
+        with self._lock:
+            self._busy -= 1
+            self._worker_free.notify()
+
+    def _retire_locked(self):
+        self._workers -= 1
+        self._stats['retired'] += 1
+        self._threads.discard(threading.current_thread())
@@ -0,0 +1,239 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Buffer lanes, least important first; a full buffer evicts from the front of this list
+LANES = ('DEBUG', 'INFO', 'WARNING')
+
+# Records per second each high-volume category may write before it is rate limited.
+# Categories not listed, such as the per-alert 'alert' records, are never limited
+DEFAULT_RATES = {'message': 50, 'publish': 50, 'camera': 20, 'queue': 20, 'offline': 20}
+
+
+def event(category, priority=None, **fields):
+    """The `extra` for a hub log call: category for rate limiting, the alert priority it concerns
+    (LOW records are sampled) and any fields to store as-is in the JSON line."""
+    return {'category': category, 'priority': priority, 'fields': fields}
+
+
+def _lane(levelno):
+    if levelno < logging.INFO:
+        return 'DEBUG'
+    return 'INFO' if levelno < logging.WARNING else 'WARNING'
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line: time, level, category, message, priority and the record's fields."""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'category': getattr(record, 'category', record.name),
+            'msg': record.getMessage(),
+        }
+        priority = getattr(record, 'priority', None)
+        if priority:
+            entry['priority'] = priority
+        entry.update(getattr(record, 'fields', None) or {})
+        for key in ('sampled', 'suppressed'):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at the time, so redirect_stdout() in benchmarks still works."""
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class AsyncLogHandler(logging.Handler):
+    """Logging handler that never does I/O on the caller's thread.
+
+    emit() decides whether to keep a record and appends it to a bounded
+    in-memory buffer; a background thread formats it and writes it to the
+    target handlers. Messages are formatted by the writer, so pass values as
+    logger arguments rather than pre-formatted f-strings and keep them
+    immutable.
+
+    Before a record is buffered:
+      - records below WARNING with priority LOW are sampled, keeping 1 in
+        low_sample per category (kept records carry sampled=N);
+      - records below WARNING in categories in rates are limited to that
+        many per second (token bucket, one second of burst); the next record
+        written in the category carries suppressed=<records dropped since>.
+        Warnings and errors are never rate limited.
+
+    The buffer has one FIFO lane each for DEBUG, INFO and WARNING-and-above.
+    When it holds capacity records a new record evicts the oldest record of
+    the lowest non-empty lane below its own; if there is none it is dropped.
+    A full buffer therefore sheds debug output first and never blocks.
+    """
+    def __init__(self, targets, capacity=10000, rates=None, low_sample=10):
+        super().__init__()
+        self.targets = list(targets)
+        self.capacity = capacity
+        self.rates = DEFAULT_RATES if rates is None else rates
+        self.low_sample = max(1, int(low_sample))
+        self._lanes = {lane: deque() for lane in LANES}
+        self._size = 0
+        self._seq = 0
+        self._buckets = {}  # category -> [tokens, last refill, suppressed since last written]
+        self._samples = {}  # category -> LOW records seen
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._writing = 0
+        self._closed = False
+        self._stats = {'buffered': 0, 'written': 0, 'sampled_out': 0, 'rate_limited': 0, 'peak_depth': 0,
+                       'dropped': {lane: 0 for lane in LANES}}
+        self._thread = threading.Thread(target=self._writer, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def handle(self, record):
+        # Handler.handle() would serialise callers on the handler lock; emit() takes its own, briefly
+        if self.filter(record):
+            self.emit(record)
+            return True
+        return False
+
+    def emit(self, record):
+        category = getattr(record, 'category', None) or record.name
+        with self._lock:
+            if self._closed:
+                return
+            if record.levelno < logging.WARNING and getattr(record, 'priority', None) == 'LOW':
+                seen = self._samples.get(category, 0)
+                self._samples[category] = seen + 1
+                if seen % self.low_sample:
+                    self._stats['sampled_out'] += 1
+                    return
+                if self.low_sample > 1:
+                    record.sampled = self.low_sample
+            rate = self.rates.get(category) if record.levelno < logging.WARNING else None
+            if rate:
+                now = time.monotonic()
+                bucket = self._buckets.get(category)
+                if bucket is None:
+                    bucket = self._buckets[category] = [rate, now, 0]
+                bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    bucket[2] += 1
+                    self._stats['rate_limited'] += 1
+                    return
+                bucket[0] -= 1
+                if bucket[2]:
+                    record.suppressed, bucket[2] = bucket[2], 0
+            lane = _lane(record.levelno)
+            if self._size >= self.capacity:
+                victim = next((low for low in LANES[:LANES.index(lane)] if self._lanes[low]), None)
+                if victim is None:
+                    self._stats['dropped'][lane] += 1
+                    return
+                self._lanes[victim].popleft()
+                self._stats['dropped'][victim] += 1
+                self._size -= 1
+            self._seq += 1
+            self._lanes[lane].append((self._seq, record))
+            self._size += 1
+            self._stats['buffered'] += 1
+            self._stats['peak_depth'] = max(self._stats['peak_depth'], self._size)
+            self._not_empty.notify()
+
+    def _take(self, limit=256):
+        """Pop up to limit records in the order they were logged (lowest sequence number first)."""
+        batch = []
+        while self._size and len(batch) < limit:
+            lane = min((q for q in self._lanes.values() if q), key=lambda q: q[0][0])
+            batch.append(lane.popleft()[1])
+            self._size -= 1
+        return batch
+
+    def _writer(self):
+        while True:
+            with self._lock:
+                while not self._size and not self._closed:
+                    self._not_empty.wait()
+                if not self._size:
+                    return
+                batch = self._take()
+                self._writing = len(batch)
+            for record in batch:
+                for target in self.targets:
+                    if record.levelno >= target.level:
+                        target.handle(record)
+            with self._lock:
+                self._writing = 0
+                self._stats['written'] += len(batch)
+                if not self._size:
+                    self._idle.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Wait until everything buffered so far has been written."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._size or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._thread.is_alive():
+                    break
+                self._idle.wait(remaining)
+        for target in self.targets:
+            target.flush()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._not_empty.notify_all()
+        self._thread.join(timeout=5)
+        for target in self.targets:
+            target.close()
+        super().close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, dropped=dict(self._stats['dropped']))
+            stats['depth'] = self._size
+        return stats
+
+
+def setup_logging(path='Optimised_central_hub.log', level=logging.INFO, console=True, capacity=10000,
+                  rates=None, low_sample=10, max_bytes=100 * 1024 * 1024, backup_count=3):
+    """Route the root logger through one AsyncLogHandler writing JSON lines to a rotating file
+    (and plain messages to stdout). Like logging.basicConfig() the first call in a process wins;
+    later calls return the handler already installed."""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, AsyncLogHandler):
+            return handler
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JsonLinesFormatter())
+    targets = [file_handler]
+    if console:
+        console_handler = ConsoleHandler()
+        console_handler.setLevel(logging.INFO)
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        targets.append(console_handler)
+    handler = AsyncLogHandler(targets, capacity=capacity, rates=rates, low_sample=low_sample)
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(handler.close)
+    return handler
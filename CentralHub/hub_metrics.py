@@ -0,0 +1,303 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Log-linear buckets over microseconds: exact below 8us, then 8 sub-buckets per
+# power of two (~12% relative error), up to 2^36us (~19 hours)
+_SUB_BUCKETS = 8
+_MAX_EXPONENT = 33
+_BUCKETS = _SUB_BUCKETS + _MAX_EXPONENT * _SUB_BUCKETS
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def _bucket_index(value_us):
+    if value_us < _SUB_BUCKETS:
+        return max(0, value_us)
+    exponent = value_us.bit_length() - 4
+    index = _SUB_BUCKETS + exponent * _SUB_BUCKETS + ((value_us >> exponent) - _SUB_BUCKETS)
+    return min(index, _BUCKETS - 1)
+
+
+def _bucket_upper_us(index):
+    if index < _SUB_BUCKETS:
+        return index
+    exponent, mantissa = divmod(index - _SUB_BUCKETS, _SUB_BUCKETS)
+    return ((mantissa + _SUB_BUCKETS + 1) << exponent) - 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Sharded:
+    """Per-thread shards so the hot path never takes a lock; readers merge the shards.
+
+    Shards of threads that have exited (e.g. retired pool workers) are folded
+    into one retired shard so the shard list does not grow with thread churn.
+    """
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # (owning thread, shard)
+        self._retired = self._new_shard()
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._new_shard()
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _all_shards(self):
+        with self._shards_lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = live
+            return [self._retired] + [shard for _, shard in live]
+
+
+class LatencyHistogram(_Sharded):
+    """HDR-style latency histogram recorded in milliseconds."""
+    def _new_shard(self):
+        # [bucket counts, count, sum in ms, max in ms]
+        return [[0] * _BUCKETS, 0, 0.0, 0.0]
+
+    @staticmethod
+    def _merge(into, shard):
+        for i, c in enumerate(shard[0]):
+            if c:
+                into[0][i] += c
+        into[1] += shard[1]
+        into[2] += shard[2]
+        into[3] = max(into[3], shard[3])
+
+    def record(self, latency_ms):
+        shard = self._shard()
+        shard[0][_bucket_index(int(latency_ms * 1000))] += 1
+        shard[1] += 1
+        shard[2] += latency_ms
+        if latency_ms > shard[3]:
+            shard[3] = latency_ms
+
+    def snapshot(self):
+        counts = [0] * _BUCKETS
+        count, total, maximum = 0, 0.0, 0.0
+        for shard in self._all_shards():
+            for i, c in enumerate(shard[0]):
+                if c:
+                    counts[i] += c
+            count += shard[1]
+            total += shard[2]
+            maximum = max(maximum, shard[3])
+        quantiles = {}
+        if count:
+            targets = [(q, max(1, round(q * count))) for q in QUANTILES]
+            seen = 0
+            for i, c in enumerate(counts):
+                if not c:
+                    continue
+                seen += c
+                while targets and seen >= targets[0][1]:
+                    q, _ = targets.pop(0)
+                    quantiles[q] = min(_bucket_upper_us(i) / 1000, maximum)
+                if not targets:
+                    break
+        return {'count': count, 'sum': total, 'max': maximum, 'quantiles': quantiles}
+
+
+class Counter(_Sharded):
+    def _new_shard(self):
+        return [0]
+
+    @staticmethod
+    def _merge(into, shard):
+        into[0] += shard[0]
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def value(self):
+        return sum(shard[0] for shard in self._all_shards())
+
+
+class Gauge:
+    """Last value set, such as a buffer depth. Not sharded: a set replaces the value rather than adding to it."""
+    def __init__(self):
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+
+class HubMetrics:
+    """Registry of labelled histograms, counters and gauges with Prometheus text output."""
+    def __init__(self, prefix='hub'):
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._histograms.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._histograms.setdefault(key, LatencyHistogram())
+        return metric
+
+    def counter(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._counters.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._counters.setdefault(key, Counter())
+        return metric
+
+    def gauge(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._gauges.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._gauges.setdefault(key, Gauge())
+        return metric
+
+    def observe(self, name, latency_ms, **labels):
+        self.histogram(name, **labels).record(latency_ms)
+
+    def inc(self, name, amount=1, **labels):
+        self.counter(name, **labels).inc(amount)
+
+    def set(self, name, value, **labels):
+        self.gauge(name, **labels).set(value)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        typed = set()
+        for (name, labels), histogram in histograms:
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} summary")
+                typed.add(full)
+            snap = histogram.snapshot()
+            for q, value in snap['quantiles'].items():
+                lines.append(f"{full}{self._labels(labels, [('quantile', q)])} {value:.3f}")
+            lines.append(f"{full}_sum{self._labels(labels)} {snap['sum']:.3f}")
+            lines.append(f"{full}_count{self._labels(labels)} {snap['count']}")
+        for (name, labels), counter in counters:
+            full = f"{self.prefix}_{name}_total"
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter")
+                typed.add(full)
+            lines.append(f"{full}{self._labels(labels)} {counter.value()}")
+        for (name, labels), gauge in gauges:
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                lines.append(f"# TYPE {full} gauge")
+                typed.add(full)
+            lines.append(f"{full}{self._labels(labels)} {gauge.value()}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Compact JSON-friendly view (p50/p99/max per series) for the hub/metrics topic."""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        result = {'latency_ms': [], 'counters': [], 'gauges': []}
+        for (name, labels), histogram in histograms:
+            snap = histogram.snapshot()
+            if not snap['count']:
+                continue
+            result['latency_ms'].append({
+                'name': name, **dict(labels), 'count': snap['count'],
+                'p50': round(snap['quantiles'].get(0.5, 0.0), 3),
+                'p99': round(snap['quantiles'].get(0.99, 0.0), 3),
+                'max': round(snap['max'], 3)})
+        for (name, labels), counter in counters:
+            result['counters'].append({'name': name, **dict(labels), 'value': counter.value()})
+        for (name, labels), gauge in gauges:
+            result['gauges'].append({'name': name, **dict(labels), 'value': gauge.value()})
+        return result
+
+    def export(self):
+        """Raw totals of every series as plain data, so another process can add them up with load()."""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        result = {'histograms': [], 'counters': [], 'gauges': []}
+        for key, histogram in histograms:
+            merged = histogram._new_shard()
+            for shard in histogram._all_shards():
+                histogram._merge(merged, shard)
+            buckets = {i: c for i, c in enumerate(merged[0]) if c}
+            result['histograms'].append((key, buckets, merged[1], merged[2], merged[3]))
+        for key, counter in counters:
+            result['counters'].append((key, counter.value()))
+        for key, gauge in gauges:
+            result['gauges'].append((key, gauge.value()))
+        return result
+
+    def load(self, exports):
+        """Replace every series with the sum of several export()s, e.g. one per hub shard."""
+        histograms, counters, gauges = {}, {}, {}
+        for exported in exports:
+            for key, buckets, count, total, maximum in exported['histograms']:
+                histogram = histograms.setdefault(key, LatencyHistogram())
+                shard = histogram._new_shard()
+                for i, c in buckets.items():
+                    shard[0][i] = c
+                shard[1:] = [count, total, maximum]
+                histogram._merge(histogram._retired, shard)
+            for key, value in exported['counters']:
+                counters.setdefault(key, Counter())._retired[0] += value
+            for key, value in exported['gauges']:
+                gauge = gauges.setdefault(key, Gauge())
+                gauge.set(gauge.value() + value)
+        with self._lock:
+            self._histograms, self._counters, self._gauges = histograms, counters, gauges
+
+    def serve(self, host='127.0.0.1', port=9108):
+        """Expose /metrics over HTTP from a daemon thread and return the server."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not worth an SD card write each
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
@@ -0,0 +1,272 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import datetime
+
+import psutil
+
+from alert_schema import FLOW_TOPIC, encode_payload, set_default_codec
+from flow_control import LEVELS, NORMAL, flow_status
+from hub_logging import event, setup_logging
+from hub_metrics import HubMetrics
+from mqtt_transport import create_client
+
+# Sharded hub: one Python process per core.
+#
+# A HubSupervisor starts --shards worker processes, each a normal
+# OptimizedCentralHub (or AsyncCentralHub) with its own MQTT session, WAL,
+# snapshot and log file. Every worker subscribes to every bed topic and keeps
+# only the beds a ShardRing assigns to it, so all of one bed's messages, state,
+# fall windows and incidents live in one process and arrive in the order the
+# broker sent them. MQTT shared subscriptions ($share/...) would spread one
+# bed's messages over several workers, so they are not used.
+#
+# Workers report their heartbeat, metrics and load level to the supervisor
+# over a multiprocessing queue. The supervisor publishes hub/heartbeat,
+# hub/metrics and hub/flow for the whole hub, serves the merged /metrics and
+# restarts a worker that dies.
+
+
+class ShardRing:
+    """Consistent hashing of bed ids onto shards.
+
+    Each shard owns replicas points on a 64-bit ring and a bed belongs to the
+    first point at or after its own hash. Changing the number of shards moves
+    only about 1/shards of the beds, so most keep their state in the snapshot
+    of the worker that handled them before.
+    """
+    def __init__(self, shards, replicas=64):
+        self.shards = shards
+        points = sorted((self._hash(f"shard-{shard}-{replica}"), shard)
+                        for shard in range(shards) for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+        self._cache = {}
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def shard_for(self, ward, bed):
+        """Shard that handles a bed; single-bed topics (ward and bed None) count as bed 'default'."""
+        bed_id = 'default' if ward is None else f"{ward}/{bed}"
+        shard = self._cache.get(bed_id)
+        if shard is None:
+            index = bisect.bisect_left(self._points, self._hash(bed_id)) % len(self._points)
+            shard = self._cache[bed_id] = self._owners[index]
+        return shard
+
+
+def _shard_path(path, shard):
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+def shard_options(options, shard, shards, reports, report_interval):
+    """Hub keyword arguments for one worker: its own WAL directory, snapshot and log file, no /metrics."""
+    worker = dict(options, shard=shard, shards=shards, reports=reports, heartbeat_interval=report_interval,
+                  metrics_port=None, wal_dir=os.path.join(options.get('wal_dir', 'qos2_wal'), f"shard-{shard}"),
+                  log_file=_shard_path(options.get('log_file', 'Optimised_central_hub.log'), shard))
+    if options.get('snapshot_path'):
+        worker['snapshot_path'] = _shard_path(options['snapshot_path'], shard)
+    return worker
+
+
+def run_shard(engine, options, stop_event):
+    """Worker process: run one hub until the supervisor sets stop_event, then stop it cleanly."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the supervisor decides
+    if engine == 'async':
+        from async_hub import AsyncCentralHub as Hub
+    else:
+        from optimised_hub_final import OptimizedCentralHub as Hub
+    hub = Hub(**options)
+    thread = threading.Thread(target=hub.start, name='hub', daemon=True)
+    thread.start()
+    while thread.is_alive() and not stop_event.wait(0.5):
+        pass
+    hub.stop()
+    thread.join(timeout=10)
+
+
+class HubSupervisor:
+    """Runs the hub as shards worker processes and speaks for them on the hub topics.
+
+    options are the OptimizedCentralHub keyword arguments; each worker gets
+    them with its shard number and its own WAL directory, snapshot and log
+    file (see shard_options()). Workers report every report_interval
+    seconds. The supervisor publishes a combined heartbeat and the merged
+    metrics every heartbeat_interval seconds, publishes the highest load
+    level of any worker on hub/flow, and restarts a worker that exits.
+    """
+    def __init__(self, shards, options, engine='threaded', transport=None, report_interval=5, heartbeat_interval=30,
+                 restart_delay=2):
+        self.shards = shards
+        self.options = options
+        self.engine = engine
+        self.report_interval = report_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.restart_delay = restart_delay
+        self.codec = set_default_codec(options.get('codec', 'json'))
+        self.metrics_port = options.get('metrics_port')
+        self.log_writer = setup_logging(options.get('log_file', 'Optimised_central_hub.log'),
+                                        level=getattr(logging, options.get('log_level', 'INFO')))
+        self.logger = logging.getLogger(__name__)
+
+        # Workers are started with spawn: the supervisor has threads running by the time it restarts one
+        self.context = multiprocessing.get_context('spawn')
+        self.reports = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.workers = {}    # shard -> Process
+        self.started = {}    # shard -> monotonic time of its last start
+        self.restarts = {shard: 0 for shard in range(shards)}
+        self.health = {}     # shard -> (monotonic time received, last heartbeat)
+        self.exports = {}    # shard -> last HubMetrics.export()
+        self.levels = {}     # shard -> (load level, queue fill)
+        self.flow_level = NORMAL
+        self.metrics = HubMetrics()
+        self.metrics_server = None
+        self.running = False
+
+        self.client = create_client("CentralHub-supervisor", transport=transport)
+        # The supervisor owns hub/flow; a supervisor that dies must not leave the drivers throttled
+        self.client.will_set(FLOW_TOPIC, flow_status(NORMAL).encode(self.codec), qos=1, retain=True)
+
+    def spawn(self, shard):
+        options = shard_options(self.options, shard, self.shards, self.reports, self.report_interval)
+        process = self.context.Process(target=run_shard, args=(self.engine, options, self.stop_event),
+                                       name=f"hub-shard-{shard}", daemon=True)
+        process.start()
+        self.workers[shard] = process
+        self.started[shard] = time.monotonic()
+        self.logger.info("Started hub shard %d/%d (pid %d)", shard, self.shards, process.pid,
+                         extra=event('hub', shard=shard, pid=process.pid))
+
+    def check_workers(self):
+        """Restart workers that have exited, at most once per restart_delay each."""
+        for shard, process in list(self.workers.items()):
+            if process.is_alive() or time.monotonic() - self.started[shard] < self.restart_delay:
+                continue
+            self.logger.error("Hub shard %d exited with code %s, restarting", shard, process.exitcode,
+                              extra=event('hub', shard=shard, exitcode=process.exitcode))
+            self.restarts[shard] += 1
+            self.levels.pop(shard, None)
+            self.update_flow()
+            self.spawn(shard)
+
+    def receive(self, report):
+        kind, shard, *data = report
+        if kind == 'health':
+            heartbeat, exported = data
+            self.health[shard] = (time.monotonic(), heartbeat)
+            self.exports[shard] = exported
+            self.metrics.load(self.exports.values())
+            for restarted, count in self.restarts.items():
+                if count:
+                    self.metrics.inc('shard_restarts', count, shard=restarted)
+        elif kind == 'flow':
+            self.levels[shard] = tuple(data)
+            self.update_flow()
+
+    def update_flow(self):
+        """Publish the highest load level of any worker when it changes."""
+        level = max((level for level, _ in self.levels.values()), key=LEVELS.index, default=NORMAL)
+        if level == self.flow_level:
+            return
+        self.flow_level = level
+        fill = max((fill for _, fill in self.levels.values()), default=0.0)
+        self.logger.warning("Load level %s (fullest shard %.0f%% full)", level, fill * 100, extra=event('flow'))
+        self.client.publish(FLOW_TOPIC, flow_status(level, fill).encode(self.codec), qos=1, retain=True)
+
+    def build_heartbeat(self):
+        now = time.monotonic()
+        workers = []
+        for shard in range(self.shards):
+            process = self.workers.get(shard)
+            received, heartbeat = self.health.get(shard, (None, {}))
+            age = round(now - received, 1) if received is not None else None
+            try:
+                cpu = psutil.Process(process.pid).cpu_percent() if process and process.is_alive() else None
+            except psutil.Error:
+                cpu = None
+            workers.append({
+                'shard': shard,
+                'pid': process.pid if process else None,
+                'alive': bool(process and process.is_alive()),
+                'stale': age is None or age > 3 * self.report_interval,
+                'report_age_s': age,
+                'restarts': self.restarts[shard],
+                'cpu_percent': cpu,
+                'beds': heartbeat.get('beds'),
+                'flow': self.levels.get(shard, (NORMAL,))[0],
+                'message_depth': sum(lane['depth'] for lane in heartbeat.get('message_lanes', {}).values()),
+            })
+        healthy = all(worker['alive'] and not worker['stale'] for worker in workers)
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'status': 'alive' if healthy else 'degraded',
+            'shards': self.shards,
+            'beds': sum(worker['beds'] or 0 for worker in workers),
+            'flow': self.flow_level,
+            'workers': workers,
+        }
+
+    def publish_heartbeat(self):
+        heartbeat = self.build_heartbeat()
+        self.client.publish('hub/heartbeat', encode_payload(heartbeat, self.codec), qos=1)
+        self.client.publish('hub/metrics', encode_payload(self.metrics.summary(), self.codec), qos=1)
+        if heartbeat['status'] != 'alive':
+            self.logger.warning("Hub shards degraded: %s", [w['shard'] for w in heartbeat['workers']
+                                                            if not w['alive'] or w['stale']],
+                                extra=event('heartbeat'))
+
+    def start(self):
+        self.running = True
+        # Same clean shutdown on SIGTERM as on Ctrl+C (main() stops the hub), so no worker is orphaned
+        signal.signal(signal.SIGTERM, self._interrupt)
+        if self.metrics_port:
+            try:
+                self.metrics_server = self.metrics.serve(port=self.metrics_port)
+            except OSError as e:
+                self.logger.error("Metrics endpoint unavailable: %s", e, extra=event('hub'))
+        self.client.connect(self.options.get('broker_address', '192.168.61.254'),
+                            self.options.get('broker_port', 1883), 60)
+        self.client.loop_start()
+        self.logger.info("Starting Central Hub with %d shards (%s engine)...", self.shards, self.engine,
+                         extra=event('hub'))
+        for shard in range(self.shards):
+            self.spawn(shard)
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while self.running:
+            try:
+                self.receive(self.reports.get(timeout=1))
+            except queue.Empty:
+                pass
+            self.check_workers()
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
+                self.publish_heartbeat()
+
+    @staticmethod
+    def _interrupt(signum, frame):
+        raise KeyboardInterrupt
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+        for shard, process in self.workers.items():
+            process.join(timeout=15)
+            if process.is_alive():
+                self.logger.error("Hub shard %d did not stop, terminating", shard, extra=event('hub', shard=shard))
+                process.terminate()
+        self.client.disconnect()
+        self.client.loop_stop()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.logger.info("Central Hub shards stopped cleanly", extra=event('hub', restarts=self.restarts))
+        self.log_writer.flush()
@@ -0,0 +1,145 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+SEVERITY = {'LOW': 1, 'MEDIUM': 2, 'HIGH': 3}
+PRIORITY = {level: name for name, level in SEVERITY.items()}
+
+# Confidence for sources whose alerts carry none
+DEFAULT_CONFIDENCE = {'video': 0.8, 'proximity': 0.6}
+
+
+class _WindowMax:
+    """Maximum of the values pushed in the last window seconds.
+
+    A monotonic deque: each push drops the older entries it dominates, so
+    push and expire are O(1) amortised and the maximum is always at the front.
+    """
+    __slots__ = ('_entries',)
+
+    def __init__(self):
+        self._entries = deque()  # (time, value), values strictly decreasing
+
+    def push(self, now, value):
+        entries = self._entries
+        while entries and entries[-1][1] <= value:
+            entries.pop()
+        entries.append((now, value))
+
+    def expire(self, cutoff):
+        entries = self._entries
+        while entries and entries[0][0] < cutoff:
+            entries.popleft()
+
+    def max(self, default=None):
+        return self._entries[0][1] if self._entries else default
+
+
+class _BedWindow:
+    """Events from one bed over the last window seconds, with the fused figures kept up to date."""
+    __slots__ = ('events', 'counts', 'severity', 'confidence', 'labels', 'incident_id', 'started',
+                 'emitted')
+
+    def __init__(self):
+        self.events = deque()   # (time, source) in arrival order, for expiry
+        self.counts = {}        # source -> events in the window
+        self.severity = _WindowMax()
+        self.confidence = {}    # source -> _WindowMax of its confidences
+        self.labels = {}        # source -> label of its latest event
+        self.incident_id = None
+        self.started = None
+        self.emitted = None     # (priority, sources) of the last incident record sent
+
+
+class IncidentFusion:
+    """Fuses alerts from one bed's sensors into a single incident.
+
+    Each bed keeps the events of the last window seconds. observe() appends
+    one event, expires old ones from the front and updates the running
+    figures, so its cost does not depend on how much history the window holds:
+    - priority: the highest in the window, raised one level (up to HIGH) once
+      two or more sensors agree
+    - confidence: noisy-OR over sensors of each sensor's best confidence in
+      the window, 1 - prod(1 - c)
+    An incident opens with the first event after a quiet window. A record is
+    due when a second sensor corroborates it and again whenever its priority
+    or set of sensors changes; repeats of what was already reported are not
+    re-sent.
+    """
+    def __init__(self, window=30.0, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self._beds = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def observe(self, bed_id, source, priority, confidence=None, label=None):
+        """Add one event; returns the incident as a dict when a record is due, else None."""
+        now = self.clock()
+        if confidence is None:
+            confidence = DEFAULT_CONFIDENCE.get(source, 0.5)
+        with self._lock:
+            state = self._beds.get(bed_id)
+            if state is None:
+                state = self._beds[bed_id] = _BedWindow()
+            self._expire(state, now - self.window)
+            if not state.events:
+                state.incident_id = f"{bed_id}-{next(self._ids)}"
+                state.started = now
+                state.emitted = None
+            state.events.append((now, source))
+            state.counts[source] = state.counts.get(source, 0) + 1
+            state.severity.push(now, SEVERITY.get(priority, 2))
+            best = state.confidence.get(source)
+            if best is None:
+                best = state.confidence[source] = _WindowMax()
+            best.push(now, confidence)
+            if label:
+                state.labels[source] = label
+
+            sources = tuple(sorted(state.counts))
+            level = state.severity.max()
+            if len(sources) > 1:
+                level = min(level + 1, SEVERITY['HIGH'])
+            fused_priority = PRIORITY[level]
+            if len(sources) < 2 or state.emitted == (fused_priority, sources):
+                return None
+            state.emitted = (fused_priority, sources)
+            miss = 1.0
+            for name in sources:
+                miss *= 1.0 - state.confidence[name].max(0.0)
+            return {
+                'incident_id': state.incident_id,
+                'priority': fused_priority,
+                'confidence': round(1.0 - miss, 3),
+                'sources': list(sources),
+                'events': len(state.events),
+                'duration': round(now - state.started, 3),
+                'details': " + ".join(state.labels.get(name, name) for name in sources),
+            }
+
+    def _expire(self, state, cutoff):
+        events = state.events
+        while events and events[0][0] < cutoff:
+            _, source = events.popleft()
+            count = state.counts[source] - 1
+            if count:
+                state.counts[source] = count
+            else:
+                del state.counts[source]
+                state.confidence.pop(source, None)
+                state.labels.pop(source, None)
+        state.severity.expire(cutoff)
+        for best in state.confidence.values():
+            best.expire(cutoff)
+
+    def incidents(self):
+        """Open incidents per bed, for the heartbeat."""
+        now = self.clock()
+        with self._lock:
+            for state in self._beds.values():
+                self._expire(state, now - self.window)
+            return {bed_id: {'incident_id': state.incident_id, 'sources': sorted(state.counts),
+                             'events': len(state.events)}
+                    for bed_id, state in self._beds.items() if state.events}
@@ -0,0 +1,203 @@
+import os
+import struct
+import threading
+from collections import deque
+
+from priority_lanes import PRIORITIES
+
+# Spilled entry header: qos, topic length, WAL seq (-1 for none), payload length
+_HEADER = struct.Struct('<BHqI')
+
+
+class _Lane:
+    """One priority's entries: the oldest in memory, and once memory is full, the rest in a spill file
+    read front to back. Entries only go to memory while the file is empty, so the lane stays FIFO."""
+    def __init__(self, path):
+        self.path = path
+        self.memory = deque()  # (topic, data, qos, seq, size)
+        self.fd = None
+        self.read_offset = 0
+        self.write_offset = 0
+        self.disk_count = 0
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+
+    def __len__(self):
+        return len(self.memory) + self.disk_count
+
+    @property
+    def bytes(self):
+        return self.memory_bytes + self.disk_bytes
+
+
+class OfflineBuffer:
+    """Bounded store-and-forward buffer for publishes the broker cannot take.
+
+    While the hub is disconnected (or a publish queue is full) its outbound
+    messages wait here, one FIFO lane per priority, already encoded. Up to
+    memory_bytes are kept in memory; past that, new entries spill to one
+    file per lane in directory (no spilling without one). max_bytes bounds
+    everything buffered: a put() that does not fit evicts the oldest entries
+    of the lowest lanes that rank below it, and is refused if that is not
+    enough, so HIGH alerts are never pushed out by anything. take() returns
+    entries highest priority first for the hub to flush once it reconnects.
+
+    Spill files are scratch space, not a durable log: QoS 2 alerts carry
+    their WAL seq and are replayed from the WAL after a crash, so open()
+    clears whatever a previous run left behind.
+    """
+    def __init__(self, directory=None, max_bytes=16 * 1024 * 1024, memory_bytes=1024 * 1024, on_evict=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes if directory else max_bytes
+        self.on_evict = on_evict
+        self._lanes = {p: _Lane(os.path.join(directory, f"offline-{p}.spill") if directory else None)
+                       for p in PRIORITIES}
+        self._bytes = 0
+        self._memory = 0
+        self._lock = threading.Lock()
+        self.stats = {'buffered': 0, 'spilled': 0, 'taken': 0, 'evicted': 0, 'rejected': 0, 'peak_bytes': 0}
+
+    # Public API
+
+    def open(self):
+        """Create the spill directory and remove spill files left by a previous run."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for lane in self._lanes.values():
+            if os.path.exists(lane.path):
+                os.remove(lane.path)
+
+    def close(self):
+        with self._lock:
+            for lane in self._lanes.values():
+                self._bytes -= lane.disk_bytes
+                self._reset_file(lane)
+
+    def put(self, topic, data, qos, priority='MEDIUM', seq=None):
+        """Buffer one encoded publish; False if it does not fit even after evicting lower priorities."""
+        if priority not in self._lanes:
+            priority = 'MEDIUM'
+        topic_bytes = topic.encode('utf-8')
+        size = _HEADER.size + len(topic_bytes) + len(data)
+        evicted = []
+        with self._lock:
+            below = sum(self._lanes[p].bytes for p in PRIORITIES[PRIORITIES.index(priority) + 1:])
+            if self._bytes - below + size > self.max_bytes:
+                self.stats['rejected'] += 1
+                return False
+            while self._bytes + size > self.max_bytes:
+                evicted.append(self._evict_below(priority))
+            lane = self._lanes[priority]
+            if lane.disk_count or self._memory + size > self.memory_bytes:
+                self._spill(lane, topic_bytes, data, qos, seq, size)
+            else:
+                lane.memory.append((topic, data, qos, seq, size))
+                lane.memory_bytes += size
+                self._memory += size
+            self._bytes += size
+            self.stats['buffered'] += 1
+            self.stats['peak_bytes'] = max(self.stats['peak_bytes'], self._bytes)
+        if self.on_evict:
+            for victim in evicted:
+                self.on_evict(*victim)
+        return True
+
+    def take(self, count):
+        """Remove and return up to count entries as (priority, topic, data, qos, seq), highest priority
+        first and oldest first within a priority."""
+        entries = []
+        with self._lock:
+            for priority in PRIORITIES:
+                lane = self._lanes[priority]
+                while lane and len(entries) < count:
+                    topic, data, qos, seq, _ = self._pop(lane)
+                    entries.append((priority, topic, data, qos, seq))
+                if len(entries) >= count:
+                    break
+            self.stats['taken'] += len(entries)
+        return entries
+
+    def items(self):
+        """(priority, topic, data, qos, seq) for everything buffered, in flush order, without removing it."""
+        with self._lock:
+            entries = []
+            for priority in PRIORITIES:
+                lane = self._lanes[priority]
+                entries += [(priority, topic, data, qos, seq) for topic, data, qos, seq, _ in lane.memory]
+                offset = lane.read_offset
+                for _ in range(lane.disk_count):
+                    (topic, data, qos, seq, _), offset = self._read(lane, offset)
+                    entries.append((priority, topic, data, qos, seq))
+            return entries
+
+    def __len__(self):
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def depth(self):
+        """Entries buffered per priority."""
+        return {priority: len(lane) for priority, lane in self._lanes.items()}
+
+    def usage(self):
+        """Bytes buffered in memory and on disk."""
+        with self._lock:
+            return {'memory': self._memory, 'disk': self._bytes - self._memory}
+
+    def summary(self):
+        """Depth, bytes and counters for the heartbeat."""
+        with self._lock:
+            return dict(self.stats, depth={p: len(lane) for p, lane in self._lanes.items()},
+                        memory_bytes=self._memory, disk_bytes=self._bytes - self._memory,
+                        max_bytes=self.max_bytes)
+
+    # Internals; callers hold the lock
+
+    def _evict_below(self, priority):
+        for victim in reversed(PRIORITIES[PRIORITIES.index(priority) + 1:]):
+            lane = self._lanes[victim]
+            if lane:
+                topic, _, qos, seq, _ = self._pop(lane)
+                self.stats['evicted'] += 1
+                return victim, topic, qos, seq
+        raise AssertionError("put() checked there was enough to evict")
+
+    def _pop(self, lane):
+        if lane.memory:
+            entry = lane.memory.popleft()
+            lane.memory_bytes -= entry[4]
+            self._memory -= entry[4]
+        else:
+            entry, lane.read_offset = self._read(lane, lane.read_offset)
+            lane.disk_count -= 1
+            lane.disk_bytes -= entry[4]
+            if not lane.disk_count:
+                self._reset_file(lane)
+        self._bytes -= entry[4]
+        return entry
+
+    def _spill(self, lane, topic_bytes, data, qos, seq, size):
+        if lane.fd is None:
+            lane.fd = os.open(lane.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        record = _HEADER.pack(qos, len(topic_bytes), -1 if seq is None else seq, len(data)) + topic_bytes + data
+        os.pwrite(lane.fd, record, lane.write_offset)
+        lane.write_offset += len(record)
+        lane.disk_count += 1
+        lane.disk_bytes += size
+        self.stats['spilled'] += 1
+
+    def _read(self, lane, offset):
+        qos, topic_len, seq, data_len = _HEADER.unpack(os.pread(lane.fd, _HEADER.size, offset))
+        body = os.pread(lane.fd, topic_len + data_len, offset + _HEADER.size)
+        size = _HEADER.size + topic_len + data_len
+        entry = (body[:topic_len].decode('utf-8'), body[topic_len:], qos, None if seq < 0 else seq, size)
+        return entry, offset + size
+
+    def _reset_file(self, lane):
+        # The lane's spilled entries are all gone; start the file over rather than let it grow
+        if lane.fd is not None:
+            os.close(lane.fd)
+            lane.fd = None
+            os.remove(lane.path)
+        lane.read_offset = lane.write_offset = 0
+        lane.disk_count = lane.disk_bytes = 0
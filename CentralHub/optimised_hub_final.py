@@ -1,127 +1,213 @@
-import paho.mqtt.client as mqtt
-import json
+import argparse
+import base64
 import logging
-import logging.handlers
 from datetime import datetime
 import time
 import threading
 import queue
 import gc
-import psutil
 import os
-from concurrent.futures import ThreadPoolExecutor
+import sys
+from elastic_executor import ElasticThreadPool
+from priority_lanes import PriorityLaneQueue, PRIORITIES
+from qos2_wal import QoS2WriteAheadLog
+from ack_window import AckWindow
+from offline_buffer import OfflineBuffer
+from hub_metrics import HubMetrics
+from resource_sampler import ResourceSampler
+from alert_dedup import SUPPRESS, AlertDeduplicator
+from incident_fusion import IncidentFusion
+from hub_snapshot import HubSnapshot
+from hub_logging import event, setup_logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from alert_schema import (FLOW_TOPIC, NO_FALL_STATE, CameraActivation, CameraCommand, DashboardAlert, IncidentAlert,
+                          SchemaError, decode_message, encode_payload, parse_bed_topic, set_default_codec)
+from flow_control import NORMAL, PressureGauge, flow_status
+from latency_trace import CLOCK_PING, answer_ping, stamp
+from mqtt_transport import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS, MQTTMessage, create_client
+from topic_router import TopicRouter
+from bed_state import BedRegistry
+from alert_rules import AlertRules
+from hub_shards import HubSupervisor, ShardRing
 
 class OptimizedCentralHub:
-    def __init__(self, broker_address='192.168.61.254', broker_port=1883, reconnect_delay=2, publish_retry_delay=1):
-        self.client_id = "CentralHub"
-        self.client = mqtt.Client(client_id=self.client_id, clean_session=False)
+    def __init__(self, broker_address='192.168.61.254', broker_port=1883, reconnect_delay=2, publish_retry_delay=1,
+                 wal_dir='qos2_wal', pool_idle_timeout=30, metrics_port=9108, resource_interval=5,
+                 codec='json', transport=None, fall_window=10, fall_summary_interval=30,
+                 fusion_window=30, flow_control=True, flow_hold=5, snapshot_path=None, snapshot_interval=30,
+                 log_file='Optimised_central_hub.log', log_level='INFO', log_sample=10, heartbeat_interval=30,
+                 shard=0, shards=1, reports=None, max_inflight_qos2=20, ack_timeout=10, rules_path=None,
+                 offline_max_bytes=16 * 1024 * 1024, offline_memory_bytes=1024 * 1024, offline_flush_rate=200):
+        # One of shards worker processes under a HubSupervisor (see hub_shards.py) when shards > 1:
+        # it handles only its own beds and sends heartbeats, metrics and its load level to reports
+        self.shard = shard
+        self.shards = shards
+        self.reports = reports
+        self.ring = ShardRing(shards) if shards > 1 else None
+        self.heartbeat_interval = heartbeat_interval
+        self.client_id = "CentralHub" if shards == 1 else f"CentralHub-{shard}"
+        # paho, or the in-process broker for tests and benchmarks (default: $MQTT_TRANSPORT)
+        self.client = create_client(self.client_id, clean_session=False, transport=transport)
+        # paho holds back QoS > 0 publishes beyond its own limit (20); leave room for QoS 1 above the QoS 2 window
+        self.client.max_inflight_messages_set(max_inflight_qos2 + 20)
         
         self.broker_address = broker_address
         self.broker_port = broker_port
         self.reconnect_delay = reconnect_delay
         self.publish_retry_delay = publish_retry_delay
-        self._last_camera_state = None 
-        # Logging with timed rotation
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s: %(message)s',
-            handlers=[
-                logging.handlers.RotatingFileHandler(
-                    'Optimised_central_hub.log', 
-                    maxBytes=100*1024*1024,  # 100MB file size
-                    backupCount=3        # Keep 3 backup files
-                ),
-            ]
-        )
+        # Outbound codec; inbound payloads are decoded with whichever codec the sender used
+        self.codec = set_default_codec(codec)
+        # JSON-lines log with size rotation, written by a background thread so handlers never wait
+        # on the SD card. High-volume categories are rate limited, LOW alerts sampled 1 in log_sample,
+        # and a full buffer drops debug records first
+        self.log_writer = setup_logging(log_file, level=getattr(logging, log_level), low_sample=log_sample)
         self.logger = logging.getLogger(__name__)
         
-        self.topics = {
-            'audio/emergency': 2,
-            'video/emergency': 2,
-            'proximity/alert': 2,
-        }
-        
+        # Per-bed topics (ward/<ward>/bed/<bed>/...) plus the original single-bed topics. The router
+        # resolves each incoming topic to its message kind and captures the ward and bed in one trie walk
+        self.router = TopicRouter()
+        for kind in ('audio/emergency', 'video/emergency', 'proximity/alert'):
+            self.router.add(f'ward/{{ward}}/bed/{{bed}}/{kind}', kind, qos=2)
+            self.router.add(kind, kind, qos=2)
+        # Clock offset pings from the drivers and the dashboard, for end-to-end latency traces
+        self.router.add(CLOCK_PING, 'clock/ping')
+        self.topics = dict(self.router.subscriptions())
+
+        # Camera state, last readings and output topics for every bed seen so far
+        self.beds = BedRegistry()
+
+        # Handlers and rules are keyed by message kind, i.e. the topic without the bed prefix
         self.handlers = {
             'proximity/alert': self.handle_proximity_alert,
             'audio/emergency': self.handle_audio_alert,
             'video/emergency': self.handle_fall_alert
         }
 
+        # Priority, dashboard alert type and fan-out of each alert come from the rules file (see
+        # alert_rules.py), compiled once and reloaded when it changes. The priority picks the queue
+        # lane on arrival; the handler publishes the outputs the matching rule lists
+        self.rules = AlertRules(rules_path, logger=self.logger)
+
+        # The camera Pi sends a fall alert for every frame it sees one in. Repeats of the same
+        # state from one bed are dropped before they are queued; an escalation goes straight
+        # through and an ongoing fall is re-announced every fall_summary_interval seconds
+        self.fall_dedup = AlertDeduplicator(window=fall_window, summary_interval=fall_summary_interval)
+        self.dedup_rules = {
+            'video/emergency': self.fall_dedup_state
+        }
+
+        # Alerts from one bed's sensors within fusion_window seconds of each other are combined
+        # into one incident with a fused priority and confidence; 0 turns fusion off
+        self.fusion = IncidentFusion(window=fusion_window) if fusion_window else None
+
+        # Queue pressure is published as a load level on hub/flow so the drivers slow down before
+        # anything is dropped. It is retained, and the last will resets it to NORMAL so a hub that
+        # dies under load does not leave the drivers throttled
+        self.flow = PressureGauge(hold=flow_hold) if flow_control else None
+        if self.flow and self.reports is None:  # Shards report their level; the supervisor owns hub/flow
+            self.client.will_set(FLOW_TOPIC, flow_status(NORMAL).encode(self.codec), qos=1, retain=True)
+
         self.connection_active = False
         
         # Fixed queue sizes (can also be made dynamic if needed)
-        self.message_queue = queue.Queue(maxsize=100)
+        # Inbound messages and QoS 2 alerts use priority lanes so HIGH work is served first
+        # and LOW work is evicted first when the queue fills up
+        self.message_queue = PriorityLaneQueue(maxsize=100, on_evict=self.on_message_evicted)
         self.proximity_publish_queue = queue.Queue(maxsize=100)
-        self.qos2_publish_queue = queue.Queue(maxsize=100)
+        self.qos2_publish_queue = PriorityLaneQueue(maxsize=100, on_evict=self.on_qos2_evicted)
 
-        self.logger.info(f"Queue sizes - Message: {self.message_queue.maxsize}, "
-                        f"Proximity: {self.proximity_publish_queue.maxsize}, "
-                        f"QoS 2: {self.qos2_publish_queue.maxsize}")
+        # One sampler feeds both the heartbeat and the pool growth check from cached snapshots
+        self.resources = ResourceSampler(interval=resource_interval, logger=self.logger)
+
+        # Latency histograms and drop/retry counters, scraped from /metrics and
+        # published on hub/metrics with every heartbeat
+        self.metrics = HubMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+
+        # Every QoS 2 alert is logged before it is queued and acknowledged on PUBCOMP,
+        # so anything still unacknowledged after a crash is replayed on the next start
+        self.wal = QoS2WriteAheadLog(wal_dir, logger=self.logger)
+        self._wal_replay = []
+        self._inflight_lock = threading.RLock()
+        self._inflight_mids = {}  # paho mid -> WAL seq
+
+        # QoS 2 publishes are tracked by message id until PUBCOMP. At most max_inflight_qos2 wait for
+        # their acknowledgement at once while the rest stay in the priority lanes, retries wait on the
+        # window's timer thread rather than in a pool thread, and publish_latency_ms runs to PUBCOMP
+        self.max_inflight_qos2 = max_inflight_qos2
+        self.ack_timeout = ack_timeout
+        self.qos2_window = AckWindow(max_inflight_qos2, ack_timeout, on_timeout=self.on_qos2_timeout,
+                                     logger=self.logger)
+
+        # Publishes the broker cannot take while the connection is down (or a publish queue is full)
+        # wait in the offline buffer, already encoded: offline_memory_bytes in memory, the rest spilled
+        # to disk, offline_max_bytes in all, evicting LOW first. Once on_connect fires they are flushed
+        # back into the publish queues, highest priority first, at offline_flush_rate publishes a second
+        self.offline = OfflineBuffer(os.path.join(wal_dir, 'offline'), max_bytes=offline_max_bytes,
+                                     memory_bytes=offline_memory_bytes, on_evict=self.on_offline_evicted)
+        self.offline_flush_rate = offline_flush_rate
+        self.offline_batch = 20
+        self._flush_lock = threading.Lock()
+        self._flush_started = None
+        self._flushed = 0
+
+        # Bed state and dedup windows are checkpointed every snapshot_interval seconds, and with
+        # whatever is still queued on shutdown, so a restart resumes instead of starting cold
+        # (QoS 2 alerts are covered by the WAL). 0 disables snapshots
+        self.snapshot_interval = snapshot_interval
+        self.snapshot = HubSnapshot(snapshot_path or os.path.join(wal_dir, 'hub_state.snapshot'),
+                                    logger=self.logger) if snapshot_interval else None
+        self.warm_start = False
+        self._snapshot_replay = ([], [])  # Queued messages and QoS 1 publishes restored from the snapshot
+        self._replay_lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+
+        self.logger.info("Queue sizes - Message: %d, Proximity: %d, QoS 2: %d", self.message_queue.maxsize,
+                         self.proximity_publish_queue.maxsize, self.qos2_publish_queue.maxsize, extra=event('hub'))
 
         self.running = False
         self.executor_message = None
         self.executor_proximity = None
         self.executor_qos2 = None
         self.heartbeat_thread = None
+        self.thread_pool_monitor_thread = None
+        self.dispatcher_threads = []
+        self._stopping = threading.Event()  # Wakes the heartbeat and monitor threads on stop()
+        self._drain_until = 0.0  # Monotonic deadline for the dispatchers to empty the queues on stop()
+        self.stop_drain_timeout = 2.0
 
         # Dynamic thread pool settings
         self.base_thread_count = max(1, os.cpu_count() // 2)  # Start with half the CPU cores
         self.max_thread_count = max(4, os.cpu_count())  # Cap at CPU core count or a minimum of 4
-        self.thread_scaling_interval = 10  # Check scaling every 10 seconds
-
-    def adjust_thread_pool(self):
-        """Dynamically adjust the number of threads based on queue sizes and system resources."""
-        def calculate_thread_count(queue_size, max_queue_size, base_count, max_count):
-            load_factor = queue_size / max_queue_size  # How full is the queue?
-            available_memory = psutil.virtual_memory().available / (1024 * 1024)  # MB
-            if available_memory < 100:  # Low memory threshold
-                return base_count  # Scale down to base if memory is low
-            return min(max_count, max(base_count, int(base_count + (load_factor * max_count))))
-
-        # Adjust message processor threads
-        message_threads = calculate_thread_count(
-            self.message_queue.qsize(), self.message_queue.maxsize, self.base_thread_count, self.max_thread_count
-        )
-        if self.executor_message._max_workers != message_threads:
-            self.executor_message._max_workers = message_threads
-            self.logger.info(f"Adjusted message threads to {message_threads}")
-
-        # Adjust proximity publisher threads
-        proximity_threads = calculate_thread_count(
-            self.proximity_publish_queue.qsize(), self.proximity_publish_queue.maxsize, self.base_thread_count, self.max_thread_count
-        )
-        if self.executor_proximity._max_workers != proximity_threads:
-            self.executor_proximity._max_workers = proximity_threads
-            self.logger.info(f"Adjusted proximity threads to {proximity_threads}")
-
-        # Adjust QoS 2 publisher threads
-        qos2_threads = calculate_thread_count(
-            self.qos2_publish_queue.qsize(), self.qos2_publish_queue.maxsize, self.base_thread_count, self.max_thread_count
-        )
-        if self.executor_qos2._max_workers != qos2_threads:
-            self.executor_qos2._max_workers = qos2_threads
-            self.logger.info(f"Adjusted QoS 2 threads to {qos2_threads}")
+        self.thread_scaling_interval = 10  # Log pool statistics every 10 seconds
+        self.pool_idle_timeout = pool_idle_timeout  # Seconds before a surplus worker retires
+        self.pool_prefetch = 8  # Tasks taken off a queue ahead of a free worker, out of priority order
+
+    def has_memory_headroom(self):
+        """Pools only add workers while at least 100MB of memory is available."""
+        return self.resources.available_memory_mb() >= 100
 
+    def create_pool(self, name):
+        return ElasticThreadPool(name, min_workers=self.base_thread_count, max_workers=self.max_thread_count,
+                                 idle_timeout=self.pool_idle_timeout, can_grow=self.has_memory_headroom,
+                                 prefetch=self.pool_prefetch, logger=self.logger)
 
     def thread_pool_monitor(self):
-        """Periodically monitor and adjust thread pools based on system load."""
+        """Periodically log queue and pool statistics; the pools scale themselves."""
         while self.running:
             try:
-                cpu_usage = psutil.cpu_percent(interval=1)  # Monitor CPU usage
-                memory_usage = psutil.virtual_memory().percent  # Monitor memory usage
-
-                # Determine appropriate interval based on resource usage
-                if cpu_usage > 80 or memory_usage > 80:  # High resource usage
-                    self.adjust_thread_pool()  # Adjust the thread pool
-                    time.sleep(5)  # Check more frequently under high load
-                elif cpu_usage > 50 or memory_usage > 50:  # Moderate resource usage
-                    self.adjust_thread_pool()  # Adjust the thread pool
-                    time.sleep(10)  # Moderate check interval
-                else:
-                    time.sleep(20)  # Check less frequently under idle conditions
+                self.log_queue_stats()
+                self.update_flow()  # Lets the level fall back once the queues stay drained
+                self.maybe_checkpoint()
+                self.rules.maybe_reload()
+                for name, pool in (('Message', self.executor_message), ('Proximity', self.executor_proximity),
+                                   ('QoS 2', self.executor_qos2)):
+                    self.logger.info("%s pool - %s", name, pool.stats(), extra=event('pool'))
             except Exception as e:
-                self.logger.error(f"Thread pool monitor error: {e}")
-                time.sleep(10)  # Sleep for a default interval if there's an error
+                self.logger.error("Thread pool monitor error: %s", e, extra=event('pool'))
+            self._stopping.wait(self.thread_scaling_interval)
 
 
     # MQTT callbacks (on_connect, on_disconnect, etc.) remain the same
@@ -135,31 +221,162 @@ class OptimizedCentralHub:
             5: "Not authorized"
         }
         if rc != 0:
-            print(f"Connection failed: {connection_codes.get(rc, 'Unknown error')}")
             self.connection_active = False
-            self.logger.error(f"Connection failed: {connection_codes.get(rc, 'Unknown error')}")
+            self.logger.error("Connection failed: %s", connection_codes.get(rc, 'Unknown error'),
+                              extra=event('connection', rc=rc))
             return
-        print(f"Connected to MQTT Broker: {self.broker_address}")
         self.connection_active = True
-        self.logger.info(f"Connected to broker {self.broker_address}")
-        for topic in self.topics:
-            self.client.publish(topic, "", qos=1, retain=True)
+        self.logger.info("Connected to MQTT Broker: %s", self.broker_address, extra=event('connection'))
+        # A cold start clears stale retained alerts; after a warm start they are read, and the
+        # restored dedup windows drop any the hub has already handled
+        if not self.warm_start and self.shard == 0:
+            for topic in self.topics:
+                if '+' not in topic:
+                    self.client.publish(topic, "", qos=1, retain=True)
         subscription_list = [(topic, qos) for topic, qos in self.topics.items()]
         result, mid = self.client.subscribe(subscription_list)
-        if result == mqtt.MQTT_ERR_SUCCESS:
+        if result == MQTT_ERR_SUCCESS:
             topic_list_str = ", ".join(f"{topic} (QoS: {qos})" for topic, qos in self.topics.items())
-            print(f"Subscribed to {len(subscription_list)} topics: {topic_list_str}")
-            self.logger.info(f"Subscribed to topics: {', '.join(self.topics.keys())}")
+            self.logger.info("Subscribed to %d topics: %s", len(subscription_list), topic_list_str,
+                             extra=event('connection'))
         else:
-            print(f"Failed to subscribe: {result}")
-            self.logger.error(f"Failed to subscribe: {result}")
+            self.logger.error("Failed to subscribe: %s", result, extra=event('connection'))
+        if self.flow:
+            self.publish_flow(self.flow.level, self.queue_fill())  # Replaces whatever was retained
+        with self._replay_lock:
+            self.replay_qos2_wal()
+            self.replay_snapshot()
+        if len(self.offline):
+            self.start_flush()
+
+    def resume_replay(self):
+        """Queue replayed alerts and messages that did not fit last time, now that a worker has freed a slot."""
+        if not (self._wal_replay or self._snapshot_replay[0]) or not self.connection_active:
+            return
+        if self._replay_lock.acquire(blocking=False):  # Whoever holds it is already replaying
+            try:
+                self.replay_qos2_wal()
+                self.replay_snapshot()
+            finally:
+                self._replay_lock.release()
+
+    def replay_qos2_wal(self):
+        """Re-queue QoS 2 alerts that were never acknowledged before the last shutdown. Records that do
+        not fit stay pending and are queued by resume_replay() as the queue drains."""
+        pending, self._wal_replay = self._wal_replay, []
+        queued = 0
+        for index, (seq, topic, data) in enumerate(pending):
+            try:
+                payload = decode_message(topic, data)
+            except SchemaError as e:
+                self.logger.error("Unreadable WAL record %d on %s dropped: %s", seq, topic, e, extra=event('wal', seq=seq))
+                self.wal.ack(seq)
+                continue
+            priority = payload.get('priority', 'MEDIUM')
+            try:
+                self.qos2_publish_queue.put((topic, payload, seq), priority)
+                queued += 1
+            except queue.Full:
+                self._wal_replay = pending[index:]
+                break
+        if queued:
+            self.logger.info("Replayed %d unacknowledged QoS 2 alerts from WAL, %d waiting for room", queued,
+                             len(self._wal_replay), extra=event('wal'))
+
+    def checkpoint(self, pending=False):
+        """Snapshot bed state and dedup windows; pending also saves queued messages and QoS 1 publishes,
+        which is only safe on shutdown, when nothing will process them after the snapshot is taken."""
+        if not self.snapshot:
+            return
+        state = {'saved_at': time.time(), 'beds': self.beds.dump(), 'fall_dedup': self.fall_dedup.dump()}
+        if pending:
+            state['messages'] = [[priority, message.topic, base64.b64encode(message.payload).decode('ascii')]
+                                 for priority, (message, _, _) in self.message_queue.items()]
+            state['messages'] += [[priority, topic, base64.b64encode(data).decode('ascii')]
+                                  for priority, topic, data in self._snapshot_replay[0]]
+            with self.proximity_publish_queue.mutex:
+                publishes = list(self.proximity_publish_queue.queue)
+            state['publishes'] = [[topic, base64.b64encode(encode_payload(payload, self.codec)).decode('ascii'),
+                                   retries] for topic, payload, retries in publishes]
+            # Buffered QoS 0/1 publishes go out again as QoS 1; buffered QoS 2 alerts are in the WAL
+            state['publishes'] += [[topic, base64.b64encode(data).decode('ascii'), 3]
+                                   for _, topic, data, qos, _ in self.offline.items() if qos < 2]
+        try:
+            size = self.snapshot.save(state)
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error("Snapshot failed: %s", e, extra=event('snapshot'))
+            return
+        self._last_checkpoint = time.monotonic()
+        self.logger.info("Snapshot saved: %d beds, %d bytes in %sms", len(state['beds']), size,
+                         self.snapshot.stats['save_ms'], extra=event('snapshot'))
+
+    def maybe_checkpoint(self):
+        if self.snapshot and time.monotonic() - self._last_checkpoint >= self.snapshot_interval:
+            self.checkpoint()
+
+    def restore(self):
+        """Load the last snapshot, if there is one; True means a warm start."""
+        state = self.snapshot.load() if self.snapshot else None
+        if not state:
+            return False
+        offline = max(0.0, time.time() - state.get('saved_at', time.time()))
+        self.beds.load(state.get('beds', []))
+        self.fall_dedup.load(state.get('fall_dedup', []), offline)
+        self._snapshot_replay = (
+            [(priority, topic, base64.b64decode(data)) for priority, topic, data in state.get('messages', [])],
+            [(topic, base64.b64decode(data), retries) for topic, data, retries in state.get('publishes', [])])
+        self.logger.info("Warm start from snapshot (%.1fs old, loaded in %sms): %d beds, %d queued messages, "
+                         "%d QoS 1 publishes", offline, self.snapshot.stats['load_ms'], len(self.beds),
+                         len(self._snapshot_replay[0]), len(self._snapshot_replay[1]), extra=event('snapshot'))
+        return True
+
+    def replay_snapshot(self):
+        """Re-queue messages and QoS 1 publishes that were still waiting when the hub last stopped. Messages
+        that do not fit stay pending, like WAL records."""
+        messages, publishes = self._snapshot_replay
+        self._snapshot_replay = ([], [])
+        for index, (priority, topic, data) in enumerate(messages):
+            try:
+                payload = decode_message(topic, data)
+            except SchemaError as e:
+                self.logger.error("Unreadable snapshot message on %s dropped: %s", topic, e, extra=event('snapshot'))
+                continue
+            ward, bed_no, _ = self.route(topic) or (None, None, topic)
+            try:
+                self.message_queue.put((MQTTMessage(topic, data, 2), payload, self.beds.get(ward, bed_no)), priority)
+            except queue.Full:
+                self._snapshot_replay = (messages[index:], [])
+                messages = messages[:index]
+                break
+        for topic, data, retries in publishes:
+            try:
+                self.publish_with_retry(topic, decode_message(topic, data), retries)
+            except SchemaError as e:
+                self.logger.error("Unreadable snapshot publish on %s dropped: %s", topic, e, extra=event('snapshot'))
+        if messages or publishes:
+            self.logger.info("Replayed %d queued messages and %d publishes from the snapshot", len(messages),
+                             len(publishes), extra=event('snapshot'))
+
+    def on_publish(self, client, userdata, mid):
+        # QoS 2 on_publish fires on PUBCOMP, i.e. the broker has the alert
+        with self._inflight_lock:
+            seq = self._inflight_mids.pop(mid, None)
+        if seq is not None:
+            self.wal.ack(seq)
+        acked = self.qos2_window.ack(mid)
+        if acked:
+            (topic, kind, priority, attempt), latency = acked
+            self.metrics.observe('publish_latency_ms', latency, topic=kind, qos=2)
+            self.logger.debug("✓ QoS 2 to %s on attempt %d", topic, attempt,
+                              extra=event('publish', priority, qos=2, latency_ms=round(latency, 2)))
+            self.finish_qos2()
 
     def on_disconnect(self, client, userdata, rc):
         disconnect_time = datetime.now().isoformat()
         self.connection_active = False
         if rc != 0:
-            print(f"Unexpected disconnection at {disconnect_time}")
-            self.logger.warning(f"Unexpected disconnection at {disconnect_time}. Reconnecting...")
+            self.logger.warning("Unexpected disconnection at %s. Reconnecting...", disconnect_time,
+                                extra=event('connection', rc=rc))
             threading.Thread(target=self.reconnect_with_fixed_delay, daemon=True).start()
 
     def reconnect_with_fixed_delay(self):
@@ -170,11 +387,11 @@ class OptimizedCentralHub:
         aggressive_delay = 1
         while not self.connection_active and self.running and attempt <= max_attempts:
             try:
-                self.logger.info(f"Reconnection attempt {attempt}")
+                self.logger.info("Reconnection attempt %d", attempt, extra=event('connection'))
                 self.client.reconnect()
                 break
             except Exception as e:
-                self.logger.error(f"Reconnection attempt {attempt} failed: {e}")
+                self.logger.error("Reconnection attempt %d failed: %s", attempt, e, extra=event('connection'))
                 if attempt < aggressive_attempts:
                     delay = aggressive_delay
                 else:
@@ -183,291 +400,649 @@ class OptimizedCentralHub:
                 attempt += 1
                 time.sleep(delay)
         if attempt > max_attempts:
-            self.logger.critical("Max reconnection attempts reached")
+            self.logger.critical("Max reconnection attempts reached", extra=event('connection'))
 
-    def publish_with_retry(self, topic, payload, max_retries=3):
+    def publish_with_retry(self, topic, payload, max_retries=3, priority=None):
         if not self.connection_active:
-            print(f"! Not connected - queuing QoS 1 to {topic}")
+            # Buffered rather than queued, so a worker does not spend its retries waiting for the broker
+            self.logger.info("! Not connected - buffering QoS 1 to %s", topic, extra=event('publish', qos=1))
+            return self.defer(topic, encode_payload(payload, self.codec), 1,
+                              priority or payload.get('priority') or 'LOW')
         try:
             self.proximity_publish_queue.put((topic, payload, max_retries), block=False)
             return True
         except queue.Full:
-            print(f"✗ QoS 1 queue full - discarding {topic}")
-            self.logger.error(f"QoS 1 queue full - discarded {topic}")
+            self.logger.error("✗ QoS 1 queue full - discarded %s", topic, extra=event('publish', qos=1))
+            self.metrics.inc('queue_full', queue='proximity')
+            self.metrics.inc('drops', queue='proximity', reason='queue_full')
             return False
 
-    def publish_qos2(self, topic, payload):
+    def publish_qos2(self, topic, payload, priority=None):
+        priority = priority or payload.get('priority', 'MEDIUM')
+        # Encoded once here; the record caches the bytes for every publish attempt
+        seq = self.wal.append(topic, encode_payload(payload, self.codec))
         if not self.connection_active:
-            print(f"! Not connected - cannot queue QoS 2 to {topic}")
-            return False
+            self.logger.warning("! Not connected - QoS 2 to %s buffered (seq %d)", topic, seq,
+                                extra=event('publish', priority, qos=2))
+            self.metrics.inc('deferred', queue='qos2', reason='disconnected')
+            return self.defer(topic, encode_payload(payload, self.codec), 2, priority, seq)
         if self.qos2_publish_queue.qsize() >= 0.8 * self.qos2_publish_queue.maxsize:
-            self.logger.warning(f"QoS 2 queue at {self.qos2_publish_queue.qsize()}/{self.qos2_publish_queue.maxsize}")
-            with open("qos2_fallback.log", "a") as f:
-                f.write(f"{datetime.now().isoformat()} - {topic}: {json.dumps(payload)}\n")
+            self.logger.warning("QoS 2 queue at %d/%d", self.qos2_publish_queue.qsize(),
+                                self.qos2_publish_queue.maxsize, extra=event('queue'))
         try:
-            self.qos2_publish_queue.put((topic, payload), block=False)
+            self.qos2_publish_queue.put((topic, payload, seq), priority)
+            self.update_flow()
             return True
         except queue.Full:
-            self.logger.critical(f"QoS 2 queue full - persisting {topic}")
-            with open("qos2_fallback.log", "a") as f:
-                f.write(f"{datetime.now().isoformat()} - {topic}: {json.dumps(payload)}\n")
-            return False
+            self.logger.critical("QoS 2 queue full - %s %s buffered (seq %d)", priority, topic, seq,
+                                 extra=event('queue', priority))
+            self.metrics.inc('queue_full', queue='qos2')
+            self.metrics.inc('deferred', queue='qos2', reason='queue_full')
+            return self.defer(topic, encode_payload(payload, self.codec), 2, priority, seq)
 
     def proximity_publisher_worker(self, topic, payload, max_retries):
         success = False
+        data = encode_payload(payload, self.codec)
+        kind = parse_bed_topic(topic)[2]  # Metric label, so series do not multiply with beds
         for attempt in range(1, max_retries + 1):
             try:
                 if not self.connection_active:
-                    time.sleep(self.publish_retry_delay)
-                    continue
-                result = self.client.publish(topic, json.dumps(payload), qos=1)
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    print(f"✓ QoS 1 to {topic} on attempt {attempt}")
+                    # Waits for the reconnect in the offline buffer, not in this pool thread; defer()
+                    # accounts for it if the buffer has no room either
+                    self.defer(topic, data, 1, payload.get('priority') or 'LOW')
+                    success = True
+                    break
+                if attempt > 1:
+                    self.metrics.inc('retries', topic=kind, qos=1)
+                start_time = time.time()
+                result = self.client.publish(topic, data, qos=1)
+                if result.rc == MQTT_ERR_NO_CONN:
+                    # It raced the disconnect: the client keeps it and sends it on reconnect
+                    success = True
+                    break
+                if result.rc == MQTT_ERR_SUCCESS:
+                    self.metrics.observe('publish_latency_ms', (time.time() - start_time) * 1000, topic=kind, qos=1)
+                    self.logger.debug("✓ QoS 1 to %s on attempt %d", topic, attempt,
+                                      extra=event('publish', payload.get('priority'), qos=1))
                     success = True
                     break
             except Exception as e:
-                print(f"✗ QoS 1 attempt {attempt}: {e}")
+                self.logger.warning("✗ QoS 1 attempt %d to %s: %s", attempt, topic, e, extra=event('publish', qos=1))
                 time.sleep(self.publish_retry_delay)
         if not success:
-            self.logger.error(f"QoS 1 failed to {topic} after {max_retries}")
+            self.logger.error("QoS 1 failed to %s after %d", topic, max_retries, extra=event('publish', qos=1))
+            self.metrics.inc('drops', queue='proximity', reason='publish_failed')
         self.proximity_publish_queue.task_done()
 
-    def qos2_publisher_worker(self, topic, payload):
-        for attempt in range(1, 4):
-            try:
-                if not self.connection_active:
-                    time.sleep(1)
-                    continue
-                start_time = time.time()
-                result = self.client.publish(topic, json.dumps(payload), qos=2)
-                latency = (time.time() - start_time) * 1000  # ms
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    print(f"✓ QoS 2 to {topic} on attempt {attempt} ({latency:.2f}ms)")
-                    self.logger.info(f"QoS 2 to {topic} ({latency:.2f}ms)")
-                    break
-                print(f"✗ QoS 2 attempt {attempt}: {result.rc}")
-                self.logger.error(f"QoS 2 attempt {attempt}: {result.rc}")
-                time.sleep(1)
-            except Exception as e:
-                print(f"✗ QoS 2 attempt {attempt}: {e}")
-                self.logger.error(f"QoS 2 attempt {attempt}: {e}")
-                time.sleep(1)
-        else:
-            self.logger.critical(f"QoS 2 to {topic} failed after 3 retries")
+    def qos2_publisher_worker(self, topic, payload, seq=None):
+        """Publish one QoS 2 alert in the window slot the dispatcher took for it. The slot and the
+        queue task are released by its PUBCOMP, its ack timeout or its last failed attempt."""
+        self.send_qos2(topic, encode_payload(payload, self.codec), seq, payload.get('priority'))
+
+    def send_qos2(self, topic, data, seq, priority, attempt=1):
+        kind = parse_bed_topic(topic)[2]
+        if not self.connection_active:
+            # Back to the offline buffer, freeing the window slot, until the broker is back
+            self.defer(topic, data, 2, priority or 'MEDIUM', seq)
+            self.qos2_window.release()
+            self.finish_qos2()
+            return
+        try:
+            if self.connection_active:
+                if attempt > 1:
+                    self.metrics.inc('retries', topic=kind, qos=2)
+                # Hold the lock so on_publish cannot see the mid before we record it
+                # NO_CONN means it raced a disconnect; the client keeps it and sends it on reconnect, so it
+                # waits for its PUBCOMP like any other rather than going to the offline buffer as well
+                with self._inflight_lock:
+                    result = self.client.publish(topic, data, qos=2)
+                    if result.rc in (MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN):
+                        if seq is not None:
+                            self._inflight_mids[result.mid] = seq
+                        self.qos2_window.track(result.mid, (topic, kind, priority, attempt))
+                if result.rc in (MQTT_ERR_SUCCESS, MQTT_ERR_NO_CONN):
+                    return
+                self.logger.error("✗ QoS 2 attempt %d to %s: %s", attempt, topic, result.rc,
+                                  extra=event('publish', qos=2))
+        except Exception as e:
+            self.logger.error("✗ QoS 2 attempt %d to %s: %s", attempt, topic, e, extra=event('publish', qos=2))
+        if attempt < 3:
+            self.qos2_window.call_later(self.publish_retry_delay, self.send_qos2, topic, data, seq, priority,
+                                        attempt + 1)
+            return
+        self.logger.critical("QoS 2 to %s failed after 3 retries", topic, extra=event('publish', qos=2))
+        self.metrics.inc('drops', queue='qos2', reason='publish_failed')
+        self.qos2_window.release()
+        self.finish_qos2()
+
+    def on_qos2_timeout(self, mid, item):
+        topic, kind, priority, attempt = item
+        # paho keeps retransmitting it and the WAL keeps it until its PUBCOMP, however late; only the slot is freed
+        self.logger.warning("QoS 2 to %s not acknowledged within %ss", topic, self.ack_timeout,
+                            extra=event('publish', priority, qos=2))
+        self.metrics.inc('ack_timeouts', topic=kind, qos=2)
+        self.finish_qos2()
+
+    def finish_qos2(self):
         self.qos2_publish_queue.task_done()
+        self.resume_replay()
+
+    def build_heartbeat(self):
+        resources = self.resources.latest()
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'status': 'alive',
+            'cpu': resources['cpu'],
+            'memory': resources['memory'],
+            'available_memory': resources['available_memory'],  # MB
+            'total_memory': resources['total_memory'],  # MB
+            'disk_usage': resources['disk_usage'],
+            'load_average': resources['load_average'],
+            'network_in_rate': resources['network_in_rate'],  # Received bytes/s
+            'network_out_rate': resources['network_out_rate'],  # Sent bytes/s
+            'swap_used': resources['swap_used'],
+            'beds': len(self.beds),
+            'flow': self.flow.stats() if self.flow else None,
+            'fall_dedup': self.fall_dedup.stats(),
+            'incidents': self.fusion.incidents() if self.fusion else {},
+            'message_lanes': self.message_queue.lane_stats(),
+            'qos2_lanes': self.qos2_publish_queue.lane_stats(),
+            'qos2_window': self.qos2_window.stats(),
+            'rules': self.rules.stats(),
+            'offline': self.offline.summary(),
+            'pools': {name: pool.stats() for name, pool in (
+                ('message', self.executor_message), ('proximity', self.executor_proximity),
+                ('qos2', self.executor_qos2)) if pool}
+        }
+
+    def send_heartbeat(self):
+        self.update_flow(announce=True)
+        heartbeat_msg = self.build_heartbeat()
+        if self.reports is not None:
+            self.reports.put(('health', self.shard, heartbeat_msg, self.metrics.export()))
+        else:
+            self.publish_with_retry('hub/heartbeat', heartbeat_msg)
+            self.publish_with_retry('hub/metrics', self.metrics.summary())
+        self.logger.debug("Heartbeat sent", extra=event('heartbeat'))
 
     def heartbeat(self):
         while self.running:
             try:
                 if self.connection_active:
-                    available_memory_mb = psutil.virtual_memory().available / (1024 * 1024)  # Available memory in MB
-                    total_memory_mb = psutil.virtual_memory().total / (1024 * 1024)  # Total memory in MB
-                    disk_usage = psutil.disk_usage('/').percent  # Disk usage percentage
-                    load_avg = os.getloadavg()  # System load averages for 1, 5, and 15 minutes
-                    network_io = psutil.net_io_counters()  # Network I/O stats
-                    swap_memory = psutil.swap_memory()  # Swap memory usage
-
-                    heartbeat_msg = {
-                        'timestamp': datetime.now().isoformat(),
-                        'status': 'alive',
-                        'cpu': psutil.cpu_percent(),
-                        'memory': psutil.virtual_memory().percent,
-                        'available_memory': available_memory_mb,
-                        'total_memory': total_memory_mb,
-                        'disk_usage': disk_usage,
-                        'load_average': load_avg,
-                        'network_in': network_io.bytes_recv,  # Total received bytes
-                        'network_out': network_io.bytes_sent,  # Total sent bytes
-                        'swap_used': swap_memory.percent  # Swap memory usage
-                    }
-
-                    self.client.publish_with_retry('hub/heartbeat', json.dumps(heartbeat_msg), qos=1)
-                    self.logger.debug("Heartbeat sent")
-                time.sleep(30)
+                    self.send_heartbeat()
             except Exception as e:
-                self.logger.error(f"Heartbeat error: {e}")
-                time.sleep(30)
-
+                self.logger.error("Heartbeat error: %s", e, extra=event('heartbeat'))
+            self._stopping.wait(self.heartbeat_interval)
 
     def on_message(self, client, userdata, message):
+        received_at = time.time()
         try:
-            if not message.payload or message.payload.decode('utf-8').strip() == "":
+            if not message.payload or not message.payload.strip():
+                return
+            route = self.route(message.topic)
+            if route is None:
+                self.logger.debug("No route for %s", message.topic, extra=event('message'))
+                return
+            ward, bed_no, kind = route
+            if kind == 'clock/ping':
+                if self.shard == 0:  # Every shard has the same clock; one answer is enough
+                    answer_ping(self.client, message.payload, received_at, self.codec)
                 return
+            if self.ring and self.ring.shard_for(ward, bed_no) != self.shard:
+                return  # Another shard's bed
+            # Decode and validate once here so the lane can be chosen; the processor reuses the record
+            try:
+                payload = decode_message(message.topic, message.payload)
+            except SchemaError as e:
+                self.logger.error("✗ Decode error on %s: %s", message.topic, e, extra=event('message'))
+                self.metrics.inc('decode_errors', topic=kind)
+                return
+            if payload.trace:
+                # An inbound record is never encoded again (snapshots keep the raw payload), so it can take the stamp
+                payload.trace = stamp(payload.trace, 'hub_in', received_at)
+            self.metrics.inc('messages_received', topic=kind)
+            bed = self.beds.get(ward, bed_no)
+            if self.is_duplicate(kind, payload, bed):
+                return
+            priority = self.classify_priority(kind, payload)
             if self.message_queue.qsize() >= 0.8 * self.message_queue.maxsize:
-                self.logger.warning(f"Message queue at {self.message_queue.qsize()}/{self.message_queue.maxsize}")
+                self.logger.warning("Message queue at %d/%d", self.message_queue.qsize(), self.message_queue.maxsize,
+                                    extra=event('queue'))
             try:
-                self.message_queue.put(message, block=False)
+                self.message_queue.put((message, payload, bed), priority)
+                self.update_flow()
             except queue.Full:
-                self.logger.error(f"Message queue full - dropping {message.topic}")
+                self.logger.error("Message queue full - dropping %s %s", priority, message.topic,
+                                  extra=event('queue', priority))
+                self.metrics.inc('queue_full', queue='message')
+                self.metrics.inc('drops', queue='message', reason='queue_full')
         except Exception as e:
-            print(f"Message queueing error: {e}")
-            self.logger.error(f"Message queueing error: {e}")
+            self.logger.error("Message queueing error on %s: %s", message.topic, e, extra=event('message'))
 
-    def message_processor(self, message):
+    def route(self, topic):
+        """(ward, bed, kind) for an incoming topic, or None if no subscription covers it."""
+        for route in self.router.match(topic):
+            return route.params.get('ward'), route.params.get('bed'), route.target
+        return None
+
+    def message_processor(self, message, payload=None, bed=None):
         start_time = time.time()
-        print(f"Processing {message.topic}")
+        self.logger.debug("Processing %s", message.topic, extra=event('message'))
+        ward, bed_no, kind = self.route(message.topic) or (None, None, message.topic)
         try:
             if not message.payload:
-                self.message_queue.task_done()
                 return
-            payload = json.loads(message.payload.decode('utf-8'))
-            if message.topic in self.handlers:
-                self.handlers[message.topic](payload)
-        except json.JSONDecodeError as e:
-            print(f"✗ JSON decode error: {e}")
-            self.logger.error(f"JSON decode error on {message.topic}: {e}")
+            if payload is None:
+                payload = decode_message(message.topic, message.payload)
+            if getattr(payload, 'trace', None):
+                payload.trace = stamp(payload.trace, 'hub_start')
+            handler = self.handlers.get(kind)
+            if handler:
+                handler_start = time.time()
+                handler(payload, bed or self.beds.get(ward, bed_no))
+                self.metrics.observe('handler_latency_ms', (time.time() - handler_start) * 1000,
+                                     handler=handler.__name__)
+        except SchemaError as e:
+            self.logger.error("✗ Decode error on %s: %s", message.topic, e, extra=event('message'))
         except Exception as e:
-            print(f"Message handling error: {e}")
-            self.logger.error(f"Message handling error on {message.topic}: {e}")
+            self.logger.error("Message handling error on %s: %s", message.topic, e, extra=event('message'))
         finally:
             latency = (time.time() - start_time) * 1000  # ms
+            self.metrics.observe('message_latency_ms', latency, topic=kind)
             self.message_queue.task_done()
+            self.update_flow()
+            self.resume_replay()
             if self.message_queue.qsize() >= 0.8 * self.message_queue.maxsize:
                 gc.collect()
 
-    def handle_audio_alert(self, payload):
-        timestamp = payload.get('timestamp', datetime.now().isoformat())
-        source = payload.get('source', 'audio')
-
-        video_alert = {'activate': True,
-                       'timestamp': timestamp,  
-                       'source': source}
-        dashboard_camera_activation_alert = {'activate': True,
-                       'timestamp': timestamp,  
-                       'source': 'camera_activation'}               
-        self.publish_qos2('video/monitor', video_alert)
-        self.publish_qos2('nurse/dashboard', dashboard_camera_activation_alert)
-        phrase = payload.get('phrase', '')
-        alert_type = payload.get('alert_type')
-        confidence = payload.get('confidence')
-        print(f"Audio Alert: {alert_type}")
-        priority = 'HIGH' if alert_type in ['Urgent Assistance', 'Pain/Discomfort'] else 'MEDIUM'
-        alert_data = {
-            'timestamp': timestamp,
-            'alert_type': alert_type,
-            'confidence': confidence,
-            'source': source,
-            'details': f"Detected: {phrase}",
-            'priority': priority
-        }
-        self.publish_qos2('nurse/dashboard', alert_data)
-        self.logger.info(f"Audio Alert: {phrase}")
-
-    def handle_fall_alert(self, payload):
-        mediapipe_state = payload.get('mediapipe_state','No fall detected (Standing, Sitting, Lying Down)')
-        timestamp = payload.get('timestamp', datetime.now().isoformat())
-        source = payload.get('source', 'video')
-        camera_state = payload.get('cameraState', False)  # True for activated, False for deactivated
-        print(f"Patient state: {mediapipe_state}")
-        priority = 'HIGH' if mediapipe_state == 'Fallen out of bed' else 'MEDIUM'
-        # Creating alert data for fall detection
-        alert_data = {
-            'timestamp': timestamp,
-            'alert_type': 'FALL_DETECTED',
-            'source': source,
-            'details': mediapipe_state,
-            'priority': priority
-        }
+    def fall_dedup_state(self, alert):
+        # Camera on/off reports carry no pose state and are never collapsed
+        return alert.mediapipe_state if alert.mediapipe_state != NO_FALL_STATE else None
+
+    def is_duplicate(self, kind, payload, bed):
+        """True if payload repeats an ongoing event for this bed and should not be queued."""
+        rule = self.dedup_rules.get(kind)
+        state = rule(payload) if rule else None
+        if state is None:
+            return False
+        decision, repeats = self.fall_dedup.check((bed.ward, bed.bed, payload.source), state)
+        if decision == SUPPRESS:
+            bed.last_fall = payload
+            bed.last_seen = payload.timestamp
+            self.metrics.inc('deduplicated', topic=kind)
+            return True
+        bed.fall_repeats = repeats
+        return False
+
+    def classify_priority(self, kind, payload):
+        rule = self.rules.classify(kind, payload)
+        return rule.priority if rule else 'MEDIUM'
+
+    def on_message_evicted(self, priority, item):
+        message = item[0]
+        self.logger.warning("Message queue full - evicted %s %s", priority, message.topic,
+                            extra=event('queue', priority))
+        self.metrics.inc('drops', queue='message', reason='evicted', priority=priority)
+
+    def on_qos2_evicted(self, priority, item):
+        topic, payload, seq = item
+        self.logger.warning("QoS 2 queue full - evicted %s %s to the offline buffer (seq %d)", priority, topic, seq,
+                            extra=event('queue', priority))
+        self.metrics.inc('deferred', queue='qos2', reason='evicted', priority=priority)
+        self.defer(topic, encode_payload(payload, self.codec), 2, priority, seq)
+
+    def defer(self, topic, data, qos, priority, seq=None):
+        """Keep an encoded publish in the offline buffer until it can be flushed; False if there was no
+        room for it (a QoS 2 alert is still in the WAL then, and replayed on the next start)."""
+        try:
+            kept = self.offline.put(topic, data, qos, priority, seq)
+        except OSError as e:
+            self.logger.error("Offline buffer spill failed: %s", e, extra=event('offline'))
+            kept = False
+        if kept:
+            self.metrics.inc('deferred', queue='offline', qos=qos)
+        else:
+            self.logger.error("✗ Offline buffer full - discarded %s %s", priority, topic,
+                              extra=event('offline', priority, qos=qos))
+            self.metrics.inc('drops', queue='offline', reason='buffer_full', priority=priority)
+        self.update_offline_gauges()
+        if self.connection_active:
+            self.start_flush()  # A full queue deferred it, not the broker; flush as the queue drains
+        return kept
+
+    def on_offline_evicted(self, priority, topic, qos, seq):
+        where = f"kept in WAL (seq {seq})" if seq is not None else "discarded"
+        self.logger.warning("Offline buffer full - evicted %s %s, %s", priority, topic, where,
+                            extra=event('offline', priority, qos=qos))
+        self.metrics.inc('drops', queue='offline', reason='evicted', priority=priority)
+
+    def update_offline_gauges(self):
+        for priority, depth in self.offline.depth().items():
+            self.metrics.set('offline_buffered', depth, priority=priority)
+        for store, size in self.offline.usage().items():
+            self.metrics.set('offline_buffered_bytes', size, store=store)
+
+    def start_flush(self):
+        """Flush the offline buffer on its own thread, unless a flush is already running."""
+        if self._flush_lock.acquire(blocking=False):
+            threading.Thread(target=self.flush_offline, name='offline-flush', daemon=True).start()
+
+    def flush_offline(self):
+        try:
+            while True:
+                pause = self.flush_offline_step()
+                if pause is None:
+                    break
+                time.sleep(pause)
+        finally:
+            self._flush_lock.release()
+
+    def flush_offline_step(self):
+        """Move the next batch of buffered publishes, highest priority first, into the publish queues, as
+        much as they have room for. Returns the pause before the next batch that keeps the flush to
+        offline_flush_rate publishes a second, or None when the buffer is empty or the broker gone."""
+        if not len(self.offline) or not (self.running and self.connection_active):
+            if self._flush_started is not None:
+                elapsed = (time.monotonic() - self._flush_started) * 1000
+                self.metrics.observe('offline_flush_ms', elapsed, complete=not len(self.offline))
+                self.logger.info("Flushed %d buffered publishes in %.0fms, %d left", self._flushed, elapsed,
+                                 len(self.offline), extra=event('offline'))
+                self._flush_started = None
+            return None
+        if self._flush_started is None:
+            self._flush_started = time.monotonic()
+            self._flushed = 0
+        room = min(self.qos2_publish_queue.maxsize - self.qos2_publish_queue.qsize(),
+                   self.proximity_publish_queue.maxsize - self.proximity_publish_queue.qsize())
+        entries = self.offline.take(min(self.offline_batch, room)) if room > 0 else []
+        for priority, topic, data, qos, seq in entries:
+            self.resend(priority, topic, data, qos, seq)
+        self._flushed += len(entries)
+        self.update_offline_gauges()
+        return (len(entries) or self.offline_batch) / self.offline_flush_rate
+
+    def resend(self, priority, topic, data, qos, seq):
+        """Hand one buffered publish back to the path it was deferred from."""
+        try:
+            if qos == 0:
+                self.client.publish(topic, data, qos=0)
+                return
+            payload = decode_message(topic, data)
+            if qos == 2:
+                self.qos2_publish_queue.put((topic, payload, seq), priority)
+            else:
+                self.proximity_publish_queue.put((topic, payload, 3), block=False)
+            self.metrics.inc('offline_flushed', qos=qos)
+        except SchemaError as e:
+            self.logger.error("Unreadable buffered publish on %s dropped: %s", topic, e, extra=event('offline'))
+        except queue.Full:
+            self.defer(topic, data, qos, priority, seq)  # The room went to a live publish; next batch
+
+    def log_queue_stats(self):
+        for name, lanes in (('Message', self.message_queue), ('QoS 2', self.qos2_publish_queue)):
+            stats = lanes.lane_stats()
+            summary = ", ".join(
+                f"{p} depth={stats[p]['depth']} peak={stats[p]['peak_depth']} "
+                f"wait avg/max={stats[p]['avg_wait_ms']}/{stats[p]['max_wait_ms']}ms "
+                f"evicted={stats[p]['evicted']} rejected={stats[p]['rejected']}"
+                for p in PRIORITIES)
+            self.logger.info("%s lanes - %s", name, summary, extra=event('queue'))
+
+    def queue_fill(self):
+        """How full the inbound and QoS 2 queues are, 0 to 1. The dispatchers only take work a pool can
+        start at once, so everything waiting is in the queues."""
+        return min(1.0, max(self.message_queue.qsize() / self.message_queue.maxsize,
+                            self.qos2_publish_queue.qsize() / self.qos2_publish_queue.maxsize))
+
+    def update_flow(self, announce=False):
+        """Publish the load level if the queues moved it, or (announce) repeat it while it is raised."""
+        if not self.flow:
+            return
+        fill = self.queue_fill()
+        level = self.flow.update(fill)
+        if level:
+            self.logger.warning("Load level %s (queues %.0f%% full)", level, fill * 100, extra=event('flow'))
+            self.metrics.inc('flow_level_changes', level=level)
+        elif announce and self.flow.level != NORMAL:
+            level = self.flow.level
+        if level and self.connection_active:
+            self.publish_flow(level, fill)
+
+    def publish_flow(self, level, fill):
+        if self.reports is not None:
+            self.reports.put(('flow', self.shard, level, fill))
+            return
+        # Straight to the client: the publish queues may be the ones that are full
+        self.client.publish(FLOW_TOPIC, flow_status(level, fill).encode(self.codec), qos=1, retain=True)
+
+    def log_camera_state(self, bed, camera_state, timestamp):
+        # A change is never sampled, whatever lane the reading that caused it came in on
+        self.logger.info("Camera %s for %s at %s", 'activated' if camera_state else 'deactivated', bed.bed_id,
+                         timestamp, extra=event('camera', bed=bed.bed_id, camera_state=camera_state))
+
+    def log_camera_unchanged(self, bed, camera_state, priority):
+        # Every in-bed proximity reading ends here; as a LOW record it is sampled
+        self.logger.info("Camera state unchanged for %s (%s), not sending update", bed.bed_id, camera_state,
+                         extra=event('camera', priority, bed=bed.bed_id, camera_state=camera_state))
+
+    def update_camera_state(self, bed, camera_state):
+        """Record the bed's camera state; True if it changed and an update should be sent."""
+        with bed.lock:
+            if camera_state == bed.camera_state:
+                return False
+            bed.camera_state = camera_state
+            return True
+
+    def send(self, bed, rule, output, record, priority=None):
+        """Publish one of a handler's outputs to the bed topic and at the QoS the alert's rule gives it;
+        False if the rule leaves this output out."""
+        route = rule.outputs.get(output)
+        if route is None:
+            return False
+        kind, qos = route
+        topic = bed.topic(kind)
+        if qos == 2:
+            self.publish_qos2(topic, record, priority)
+            return True
+        # The lane it waits in if the broker is unreachable: a reading's own LOW, else the alert's priority
+        priority = priority or record.get('priority') or rule.priority
+        if qos == 1:
+            self.publish_with_retry(topic, record, priority=priority)
+        elif self.connection_active:
+            self.client.publish(topic, encode_payload(record, self.codec), qos=0)
+        else:
+            self.defer(topic, encode_payload(record, self.codec), 0, priority)
+        return True
+
+    @staticmethod
+    def trace_out(alert):
+        """The alert's latency trace stamped hub_out, for each message published because of it."""
+        return stamp(alert.trace, 'hub_out') if alert.trace else None
+
+    def fuse(self, bed, source, priority, confidence, label, timestamp, trace=None):
+        """Add an alert to the bed's incident and publish the incident when it has changed."""
+        if not self.fusion:
+            return
+        incident = self.fusion.observe(bed.bed_id, source, priority, confidence, label)
+        if incident is None:
+            return
+        self.publish_qos2(bed.dashboard_topic, IncidentAlert(
+            timestamp, incident['incident_id'], incident['priority'], incident['confidence'], incident['sources'],
+            incident['events'], details=incident['details'], trace=trace))
+        self.metrics.inc('incidents', priority=incident['priority'])
+        self.logger.info("Incident %s (%s): %s - %s, confidence %s", incident['incident_id'], bed.bed_id,
+                         incident['details'], incident['priority'], incident['confidence'],
+                         extra=event('alert', incident['priority'], bed=bed.bed_id))
+
+    def handle_audio_alert(self, alert, bed):
+        timestamp = alert.timestamp
+        source = alert.source
+        trace = self.trace_out(alert)
+        bed.last_audio = alert
+        bed.last_seen = timestamp
+
+        rule = self.rules.classify('audio/emergency', alert)
+        priority = rule.priority
+        video_alert = CameraCommand(timestamp, source, True, trace=trace)
+        dashboard_camera_activation_alert = CameraActivation(timestamp, True, trace=trace)
+        phrase = alert.phrase
+        self.send(bed, rule, 'camera', video_alert, priority)
+        self.send(bed, rule, 'camera_status', dashboard_camera_activation_alert, priority)
+        alert_data = DashboardAlert(timestamp, rule.alert_type or alert.alert_type, source, priority,
+                                    details=f"Detected: {phrase}", confidence=alert.confidence, trace=trace)
+        self.send(bed, rule, 'alert', alert_data, priority)
+        self.logger.info("Audio Alert (%s): %s - %s", bed.bed_id, alert.alert_type, phrase,
+                         extra=event('alert', priority, bed=bed.bed_id))
+        if rule.incident:
+            self.fuse(bed, 'audio', priority, alert.confidence, alert.alert_type, timestamp, trace)
+
+    def handle_fall_alert(self, alert, bed):
+        mediapipe_state = alert.mediapipe_state
+        timestamp = alert.timestamp
+        camera_state = alert.camera_state  # True for activated, False for deactivated
+        trace = self.trace_out(alert)
+        bed.last_fall = alert
+        bed.last_seen = timestamp
+        rule = self.rules.classify('video/emergency', alert)
+        priority = rule.priority
+        self.logger.info("Patient state (%s): %s", bed.bed_id, mediapipe_state,
+                         extra=event('alert', priority, bed=bed.bed_id))
+        # Creating alert data for fall detection; a summary of an ongoing fall says how many frames it stands for
+        repeats, bed.fall_repeats = bed.fall_repeats, 0
+        details = f"{mediapipe_state} (ongoing, {repeats} repeats suppressed)" if repeats else mediapipe_state
+        alert_data = DashboardAlert(timestamp, rule.alert_type or 'FALL_DETECTED', alert.source, priority,
+                                    details=details, trace=trace)
         
         # Publish fall detection alert
-        self.publish_qos2('nurse/dashboard', alert_data)
+        self.send(bed, rule, 'alert', alert_data, priority)
+        if rule.incident:
+            self.fuse(bed, 'video', priority, None, 'Fall', timestamp, trace)
         
-        # Only send camera state change if it's different from the last state
-        if camera_state != self._last_camera_state:
-            # Update the tracked state
-            self._last_camera_state = camera_state
-            
+        # Only send camera state change if it's different from the bed's last state
+        if self.update_camera_state(bed, camera_state):
             # Send camera activation/deactivation message
-            dashboard_camera_state_alert = {
-                'timestamp': timestamp,
-                'source': 'camera_activation',
-                'activate': camera_state
-            }
-            self.publish_qos2('nurse/dashboard', dashboard_camera_state_alert)
-            print(f"Camera {'activated' if camera_state else 'deactivated'} at {timestamp}")
-            self.logger.info(f"Camera state changed to {'activated' if camera_state else 'deactivated'}")
+            dashboard_camera_state_alert = CameraActivation(timestamp, camera_state, trace=trace)
+            self.send(bed, rule, 'camera_status', dashboard_camera_state_alert, priority)
+            self.log_camera_state(bed, camera_state, timestamp)
         else:
-            print(f"Camera state unchanged ({camera_state}), not sending update")
-            self.logger.debug(f"Camera state unchanged ({camera_state}), not sending update")
+            self.log_camera_unchanged(bed, camera_state, priority)
 
-    def handle_proximity_alert(self, payload):
+    def handle_proximity_alert(self, reading, bed):
         try:
-            out_of_bed = payload.get('out_of_bed', False)
-            distances = payload.get('distances', [])
-            timestamp = payload.get('timestamp', datetime.now().isoformat())
-            source = payload.get('source', 'proximity')
+            out_of_bed = reading.out_of_bed
+            distances = reading.distances
+            timestamp = reading.timestamp
+            source = reading.source
+            trace = self.trace_out(reading)
+            bed.proximity = reading
+            bed.last_seen = timestamp
             details = 'Out of bed' if out_of_bed else 'Still in bed'
-            proximity_data = {
-                'timestamp': timestamp,
-                'alert_type': 'PROXIMITY_DATA',
-                'source': source,
-                'details': details,
-                'distances': distances,
-                'priority': 'LOW'
-            }
-            self.publish_with_retry('nurse/dashboard', proximity_data)
-             # Always send patient out-of-bed alert if applicable
-            if out_of_bed:
-                alert_data = {
-                    'timestamp': timestamp,
-                    'alert_type': 'PATIENT_OUT_OF_BED',
-                    'source': source,
-                    'distances': distances,
-                    'priority': 'HIGH'
-                }
-                self.publish_qos2('nurse/dashboard', alert_data)
-                self.logger.info("Out-of-bed alert sent")
+            rule = self.rules.classify('proximity/alert', reading)
+            priority = rule.priority
+            proximity_data = DashboardAlert(timestamp, 'PROXIMITY_DATA', source, 'LOW',
+                                            details=details, distances=distances, trace=trace)
+            self.send(bed, rule, 'reading', proximity_data)
+            # The default rules send an out-of-bed alert for every out-of-bed reading
+            alert_data = DashboardAlert(timestamp, rule.alert_type or 'PATIENT_OUT_OF_BED', source, priority,
+                                        distances=distances, trace=trace)
+            if self.send(bed, rule, 'alert', alert_data, priority):
+                self.logger.info("Out-of-bed alert sent for %s", bed.bed_id, extra=event('alert', priority, bed=bed.bed_id))
+            if rule.incident:
+                self.fuse(bed, 'proximity', priority, None, 'Out of bed', timestamp, trace)
 
             # Determine the desired camera state based on out_of_bed status
             camera_state = out_of_bed  # True if out of bed, False otherwise
             
-            # Only send camera state change if it's different from the last state
-            if camera_state != self._last_camera_state:
-                # Update the tracked state
-                self._last_camera_state = camera_state
-                
-                # Common message for both video/monitor and nurse/dashboard
-                camera_state_msg = {
-                    'timestamp': timestamp,
-                    'source': source,
-                    'activate': camera_state
-                }
+            # Only send camera state change if it's different from the bed's last state
+            if self.update_camera_state(bed, camera_state):
+                # Send to the bed's camera
+                self.send(bed, rule, 'camera', CameraCommand(timestamp, source, camera_state, trace=trace), priority)
                 
-                # Send to video/monitor
-                self.publish_qos2('video/monitor', camera_state_msg)
+                # Send to the bed's dashboard
+                dashboard_camera_state_alert = CameraActivation(timestamp, camera_state, trace=trace)
+                self.send(bed, rule, 'camera_status', dashboard_camera_state_alert, priority)
                 
-                # Send to nurse/dashboard
-                dashboard_camera_state_alert = {
-                    'timestamp': timestamp,
-                    'source': 'camera_activation',
-                    'activate': camera_state
-                }
-                self.publish_qos2('nurse/dashboard', dashboard_camera_state_alert)
-                
-                print(f"Camera {'activated' if camera_state else 'deactivated'} at {timestamp}")
-                self.logger.info(f"Camera state changed to {'activated' if camera_state else 'deactivated'}")
+                self.log_camera_state(bed, camera_state, timestamp)
             else:
-                print(f"Camera state unchanged ({camera_state}), not sending update")
-                self.logger.debug(f"Camera state unchanged ({camera_state}), not sending update")
+                self.log_camera_unchanged(bed, camera_state, priority)
             
         except Exception as e:
-            print(f"✗ Proximity alert error: {e}")
-            self.logger.error(f"Proximity alert error: {e}")
+            self.logger.error("✗ Proximity alert error (%s): %s", bed.bed_id, e, extra=event('alert', bed=bed.bed_id))
+
+    def _dispatch_loop(self, work_queue, executor, worker, window=None):
+        """Hand items from one queue to its thread pool, taking each only once a worker is free to run
+        it (and, with a window, a slot is free), so work that cannot start yet stays in the queue's
+        lanes, where HIGH goes first and LOW is evicted when they fill. Once stop() has cut intake it
+        keeps going until the queue is empty or stop_drain_timeout has passed."""
+        while self.running or (work_queue.qsize() and time.monotonic() < self._drain_until):
+            if not executor.acquire(timeout=1):
+                continue
+            if window is not None and not window.acquire(timeout=1):
+                continue
+            try:
+                # Wakes immediately on put(); the timeout only lets us notice stop()
+                item = work_queue.get(block=self.running, timeout=1)
+            except queue.Empty:
+                if window is not None:
+                    window.release()
+                continue
+            try:
+                executor.submit(worker, *item)
+            except Exception as e:
+                self.logger.error("Dispatch error: %s", e, extra=event('hub'))
+                if window is not None:
+                    window.release()
+                work_queue.task_done()
+
+    def start_metrics_server(self):
+        if not self.metrics_port:
+            return
+        try:
+            self.metrics_server = self.metrics.serve(port=self.metrics_port)
+            self.logger.info("Metrics available at http://127.0.0.1:%d/metrics", self.metrics_port, extra=event('hub'))
+        except OSError as e:
+            self.logger.error("Metrics endpoint unavailable: %s", e, extra=event('hub'))
+
+    def start_dispatchers(self):
+        """Start one dispatcher thread per work queue."""
+        routes = [
+            ('message', self.message_queue, self.executor_message, self.message_processor, None),
+            ('proximity', self.proximity_publish_queue, self.executor_proximity, self.proximity_publisher_worker,
+             None),
+            ('qos2', self.qos2_publish_queue, self.executor_qos2, self.qos2_publisher_worker, self.qos2_window),
+        ]
+        self.qos2_window.start()
+        self.dispatcher_threads = []
+        for name, work_queue, executor, worker, window in routes:
+            thread = threading.Thread(target=self._dispatch_loop, args=(work_queue, executor, worker, window),
+                                      name=f"dispatch-{name}", daemon=True)
+            thread.start()
+            self.dispatcher_threads.append(thread)
 
     def start(self):
         try:
             self.running = True
+            self._stopping.clear()
             self.client.on_connect = self.on_connect
             self.client.on_message = self.on_message
             self.client.on_disconnect = self.on_disconnect
+            self.client.on_publish = self.on_publish
             self.client.keepalive = 120
+
+            # Load unacknowledged alerts now; they are queued once the broker connection is up
+            self._wal_replay = self.wal.open()
+            self.offline.open()
+            self.warm_start = self.restore()
+            self.checkpoint()  # Without the restored queue contents, so a crash cannot replay them twice
+            self.start_metrics_server()
+            self.resources.start()
             
-            print("Starting Central Hub...")
+            self.logger.info("Starting Central Hub...", extra=event('hub'))
             
             # Initialize thread pools
-            self.executor_message = ThreadPoolExecutor(max_workers=self.base_thread_count)
-            self.executor_proximity = ThreadPoolExecutor(max_workers=self.base_thread_count)
-            self.executor_qos2 = ThreadPoolExecutor(max_workers=self.base_thread_count)
+            self.executor_message = self.create_pool('message')
+            self.executor_proximity = self.create_pool('proximity')
+            self.executor_qos2 = self.create_pool('qos2')
             self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
             self.thread_pool_monitor_thread = threading.Thread(target=self.thread_pool_monitor, daemon=True)
 
@@ -475,43 +1050,47 @@ class OptimizedCentralHub:
             self.heartbeat_thread.start()
             self.thread_pool_monitor_thread.start()
 
-            # Submit tasks to thread pools
-            def submit_tasks():
-                while self.running:
-                    try:
-                        # Message processing
-                        message = self.message_queue.get(block=True, timeout=1)
-                        self.executor_message.submit(self.message_processor, message)
-                    except queue.Empty:
-                        pass
-                    try:
-                        # Proximity publishing
-                        topic, payload, max_retries = self.proximity_publish_queue.get(block=True, timeout=1)
-                        self.executor_proximity.submit(self.proximity_publisher_worker, topic, payload, max_retries)
-                    except queue.Empty:
-                        pass
-                    try:
-                        # QoS 2 publishing
-                        topic, payload = self.qos2_publish_queue.get(block=True, timeout=1)
-                        self.executor_qos2.submit(self.qos2_publisher_worker, topic, payload)
-                    except queue.Empty:
-                        pass
-
-            threading.Thread(target=submit_tasks, daemon=True).start()
-            
-            print("Thread pools started")
-            print("Waiting for messages...")
+            # One dispatcher per queue so an empty queue never delays the others
+            self.start_dispatchers()
+
+            self.logger.info("Thread pools started, waiting for messages...", extra=event('hub'))
             
             self.client.connect(self.broker_address, self.broker_port, 60)
             self.client.loop_forever()
         except Exception as e:
-            self.logger.error(f"Startup error: {e}")
+            self.logger.error("Startup error: %s", e, extra=event('hub'))
             self.running = False
             raise
 
     def stop(self):
+        self._drain_until = time.monotonic() + self.stop_drain_timeout
         self.running = False
-        
+        self._stopping.set()
+
+        # Stop intake first: anything newer waits at the broker for our persistent session instead of
+        # evicting alerts already queued while the pools wind down. What the pools still publish goes
+        # to the offline buffer (QoS 2 alerts are in the WAL as well) and is saved below
+        if self.client:
+            self.client.disconnect()
+            self.client.loop_stop()
+
+        # Let the dispatchers hand the pools what is queued and the pools finish it; anything left
+        # after stop_drain_timeout goes into the snapshot, and QoS 2 alerts left queued are in the WAL
+        for thread in self.dispatcher_threads:
+            thread.join(timeout=self.stop_drain_timeout + 1)
+        for pool in (self.executor_message, self.executor_proximity, self.executor_qos2):
+            if pool:
+                pool.shutdown(wait=True)
+        self.qos2_window.stop()
+        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
+            self.heartbeat_thread.join(timeout=2)
+        if self.thread_pool_monitor_thread and self.thread_pool_monitor_thread.is_alive():
+            self.thread_pool_monitor_thread.join(timeout=2)
+
+        # Save what is still queued or buffered before it is discarded
+        self.checkpoint(pending=True)
+        self.offline.close()
+
         for q in [self.message_queue, self.proximity_publish_queue, self.qos2_publish_queue]:
             while not q.empty():
                 try:
@@ -519,30 +1098,79 @@ class OptimizedCentralHub:
                     q.task_done()
                 except queue.Empty:
                     break
-        
-        # Shutdown thread pools
-        if self.executor_message:
-            self.executor_message.shutdown(wait=True)
-        if self.executor_proximity:
-            self.executor_proximity.shutdown(wait=True)
-        if self.executor_qos2:
-            self.executor_qos2.shutdown(wait=True)
-        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
-            self.heartbeat_thread.join(timeout=2)
-        if self.thread_pool_monitor_thread and self.thread_pool_monitor_thread.is_alive():
-            self.thread_pool_monitor_thread.join(timeout=2)
-        
-        if self.client:
-            self.client.disconnect()
-            self.client.loop_stop()
-        self.logger.info("Central Hub stopped cleanly")
+
+        self.wal.close()
+        self.resources.stop()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.logger.info("Central Hub stopped cleanly", extra=event('hub', log=self.log_writer.stats()))
+        self.log_writer.flush()
 
 def main():
-    hub = OptimizedCentralHub()
+    parser = argparse.ArgumentParser(description="Central Hub")
+    parser.add_argument('--engine', choices=['threaded', 'async'], default='threaded',
+                        help="threaded: MQTT loop thread + worker pools, async: single asyncio event loop")
+    parser.add_argument('--codec', choices=['json', 'msgpack', 'cbor'], default='json',
+                        help="Encoding for messages the hub publishes (msgpack/cbor need their package installed)")
+    parser.add_argument('--broker', default='192.168.61.254', help="MQTT broker address")
+    parser.add_argument('--port', type=int, default=1883, help="MQTT broker port")
+    parser.add_argument('--wal-dir', default='qos2_wal', help="Directory for the QoS 2 write-ahead log")
+    parser.add_argument('--metrics-port', type=int, default=9108, help="Port for /metrics, 0 to disable")
+    parser.add_argument('--fall-window', type=float, default=10,
+                        help="Seconds without a repeat before a fall counts as a new event, 0 to forward every frame")
+    parser.add_argument('--fall-summary-interval', type=float, default=30,
+                        help="Seconds between 'still ongoing' alerts for the same fall")
+    parser.add_argument('--fusion-window', type=float, default=30,
+                        help="Seconds over which one bed's alerts are fused into an incident, 0 to disable")
+    parser.add_argument('--no-flow-control', action='store_true',
+                        help="Do not publish the hub's load level on hub/flow for the drivers to throttle to")
+    parser.add_argument('--flow-hold', type=float, default=5,
+                        help="Seconds a raised load level is held before it may fall again")
+    parser.add_argument('--snapshot', default=None,
+                        help="State snapshot file for warm restarts (default: hub_state.snapshot in --wal-dir)")
+    parser.add_argument('--snapshot-interval', type=float, default=30,
+                        help="Seconds between state snapshots, 0 to always start cold")
+    parser.add_argument('--log-file', default='Optimised_central_hub.log', help="JSON-lines log file (rotated at 100MB)")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO')
+    parser.add_argument('--log-sample', type=int, default=10,
+                        help="Log 1 in N routine records about LOW priority alerts, 1 to log all")
+    parser.add_argument('--max-inflight-qos2', type=int, default=20,
+                        help="QoS 2 alerts published but not yet acknowledged (PUBCOMP) at any one time")
+    parser.add_argument('--ack-timeout', type=float, default=10,
+                        help="Seconds a QoS 2 alert may wait for PUBCOMP before its window slot is freed")
+    parser.add_argument('--rules', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_rules.json'),
+                        help="JSON file of alert rules (priority, alert type, fan-out), reloaded when it changes; "
+                             "the built-in rules are used while it is missing. Defaults to the one next to this script")
+    parser.add_argument('--offline-max-mb', type=float, default=16,
+                        help="MB of publishes buffered while the broker is unreachable; LOW ones are evicted first")
+    parser.add_argument('--offline-memory-mb', type=float, default=1,
+                        help="MB of the offline buffer kept in memory before it spills to disk (in --wal-dir)")
+    parser.add_argument('--offline-flush-rate', type=float, default=200,
+                        help="Buffered publishes a second sent after the broker connection comes back")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Worker processes, each handling its share of the beds (e.g. one per core)")
+    args = parser.parse_args()
+
+    options = dict(broker_address=args.broker, broker_port=args.port, wal_dir=args.wal_dir,
+                   metrics_port=args.metrics_port, codec=args.codec, fall_window=args.fall_window,
+                   fall_summary_interval=args.fall_summary_interval, fusion_window=args.fusion_window,
+                   flow_control=not args.no_flow_control, flow_hold=args.flow_hold, snapshot_path=args.snapshot,
+                   snapshot_interval=args.snapshot_interval, log_file=args.log_file, log_level=args.log_level,
+                   log_sample=args.log_sample, max_inflight_qos2=args.max_inflight_qos2,
+                   ack_timeout=args.ack_timeout, rules_path=args.rules,
+                   offline_max_bytes=int(args.offline_max_mb * 1024 * 1024),
+                   offline_memory_bytes=int(args.offline_memory_mb * 1024 * 1024),
+                   offline_flush_rate=args.offline_flush_rate)
+    if args.shards > 1:
+        hub = HubSupervisor(args.shards, options, engine=args.engine)
+    elif args.engine == 'async':
+        from async_hub import AsyncCentralHub
+        hub = AsyncCentralHub(**options)
+    else:
+        hub = OptimizedCentralHub(**options)
     try:
         hub.start()
     except KeyboardInterrupt:
-        print("\nShutting down...")
         logging.info("Shutting down via interrupt...")
         hub.stop()
     except Exception as e:
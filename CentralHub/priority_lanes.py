@@ -0,0 +1,163 @@
+import queue
+import threading
+import time
+from collections import deque
+
+# Highest priority first; dispatch order and eviction order both follow this list
+PRIORITIES = ('HIGH', 'MEDIUM', 'LOW')
+
+
+class PriorityLaneQueue:
+    """Bounded queue with one FIFO lane per priority.
+
+    get() always serves HIGH before MEDIUM before LOW. When the queue is full
+    a put() evicts the oldest item of the lowest non-empty lane that ranks
+    below the new item; if there is none, queue.Full is raised. A lane never
+    evicts its own items, so a HIGH alert can never push out another HIGH alert.
+
+    The get/put/qsize/task_done interface mirrors queue.Queue so the hub's
+    dispatchers and stop() work unchanged.
+    """
+    def __init__(self, maxsize=100, lane_maxsize=None, on_evict=None):
+        self.maxsize = maxsize
+        lane_maxsize = lane_maxsize or {}
+        self.lane_maxsize = {p: lane_maxsize.get(p, maxsize) for p in PRIORITIES}
+        self.on_evict = on_evict
+        self._lanes = {p: deque() for p in PRIORITIES}
+        self._size = 0
+        self._unfinished = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._stats = {p: {'enqueued': 0, 'dispatched': 0, 'evicted': 0, 'rejected': 0,
+                           'peak_depth': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+                       for p in PRIORITIES}
+
+    def put(self, item, priority='MEDIUM', block=False, timeout=None):
+        """Queue item in its priority lane. Never blocks; block/timeout are accepted for queue.Queue parity."""
+        if priority not in self._lanes:
+            priority = 'MEDIUM'
+        evicted = None
+        with self._lock:
+            lane = self._lanes[priority]
+            stats = self._stats[priority]
+            if len(lane) >= self.lane_maxsize[priority]:
+                stats['rejected'] += 1
+                raise queue.Full
+            if self._size >= self.maxsize:
+                evicted = self._evict_below(priority)
+                if evicted is None:
+                    stats['rejected'] += 1
+                    raise queue.Full
+            lane.append((time.monotonic(), item))
+            self._size += 1
+            self._unfinished += 1
+            stats['enqueued'] += 1
+            stats['peak_depth'] = max(stats['peak_depth'], len(lane))
+            self._not_empty.notify()
+        if evicted is not None and self.on_evict:
+            self.on_evict(*evicted)
+        return True
+
+    def put_nowait(self, item, priority='MEDIUM'):
+        return self.put(item, priority)
+
+    def _evict_below(self, priority):
+        # Caller holds the lock
+        rank = PRIORITIES.index(priority)
+        for victim in reversed(PRIORITIES[rank + 1:]):
+            lane = self._lanes[victim]
+            if lane:
+                _, item = lane.popleft()
+                self._size -= 1
+                self._stats[victim]['evicted'] += 1
+                self._task_done_locked()
+                return victim, item
+        return None
+
+    def get(self, block=True, timeout=None):
+        """Return the oldest item of the highest-priority non-empty lane."""
+        with self._not_empty:
+            if not block:
+                if not self._size:
+                    raise queue.Empty
+            elif timeout is None:
+                while not self._size:
+                    self._not_empty.wait()
+            else:
+                deadline = time.monotonic() + timeout
+                while not self._size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            for priority in PRIORITIES:
+                lane = self._lanes[priority]
+                if lane:
+                    enqueued_at, item = lane.popleft()
+                    self._size -= 1
+                    waited = time.monotonic() - enqueued_at
+                    stats = self._stats[priority]
+                    stats['dispatched'] += 1
+                    stats['wait_total'] += waited
+                    stats['wait_max'] = max(stats['wait_max'], waited)
+                    return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        with self._lock:
+            self._task_done_locked()
+
+    def _task_done_locked(self):
+        if self._unfinished <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._all_done.notify_all()
+
+    def join(self):
+        with self._all_done:
+            while self._unfinished:
+                self._all_done.wait()
+
+    def qsize(self):
+        return self._size
+
+    @property
+    def unfinished_tasks(self):
+        return self._unfinished
+
+    def empty(self):
+        return not self._size
+
+    def full(self):
+        return self._size >= self.maxsize
+
+    def depth(self, priority):
+        return len(self._lanes[priority])
+
+    def items(self):
+        """(priority, item) for everything queued, in dispatch order, without removing anything."""
+        with self._lock:
+            return [(priority, item) for priority in PRIORITIES for _, item in self._lanes[priority]]
+
+    def lane_stats(self):
+        """Per-lane depth, counters and wait times (ms) for logging and the heartbeat."""
+        with self._lock:
+            snapshot = {}
+            for priority in PRIORITIES:
+                stats = self._stats[priority]
+                dispatched = stats['dispatched']
+                snapshot[priority] = {
+                    'depth': len(self._lanes[priority]),
+                    'peak_depth': stats['peak_depth'],
+                    'enqueued': stats['enqueued'],
+                    'dispatched': dispatched,
+                    'evicted': stats['evicted'],
+                    'rejected': stats['rejected'],
+                    'avg_wait_ms': round(stats['wait_total'] / dispatched * 1000, 3) if dispatched else 0.0,
+                    'max_wait_ms': round(stats['wait_max'] * 1000, 3),
+                }
+            return snapshot
@@ -0,0 +1,274 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from hub_logging import event
+
+# Record header: magic, type, seq, body length, crc32(body)
+_HEADER = struct.Struct('<HBxQII')
+_MAGIC = 0x5157  # "QW"
+_APPEND = 1
+_ACK = 2
+_TOPIC_LEN = struct.Struct('<H')
+
+
+class QoS2WriteAheadLog:
+    """Append-only, segmented write-ahead log for outbound QoS 2 alerts.
+
+    append() and ack() only buffer records in memory; a single writer thread
+    group-commits everything buffered with one pwrite and one fdatasync per
+    commit_interval, so SD card syscalls per second stay bounded no matter
+    how many alerts go out. Segments are preallocated so appends never grow
+    the file, and a segment is deleted once every alert appended to it (and
+    to all older segments) has been acknowledged by the broker.
+    """
+    def __init__(self, directory='qos2_wal', segment_size=4 * 1024 * 1024, commit_interval=0.05,
+                 logger=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.commit_interval = commit_interval
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._durable = threading.Condition(self._lock)
+        self._buffer = []           # (seq, record bytes) waiting for the next group commit
+        self._next_seq = 1
+        self._durable_seq = 0
+        self._segments = []         # [segment number, set of unacked seqs]
+        self._seq_segment = {}      # unacked seq -> segment number
+        self._fd = None
+        self._offset = 0
+        self._running = False
+        self._writer = None
+        self.stats = {'appended': 0, 'acked': 0, 'commits': 0, 'bytes_written': 0,
+                      'segments_created': 0, 'segments_retired': 0}
+
+    # Public API
+
+    def open(self):
+        """Scan existing segments and return unacknowledged records as (seq, topic, payload bytes) in seq order."""
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.time()
+        appended = {}
+        appended_segment = {}
+        acked = set()
+        max_seq = 0
+        for number in self._existing_segments():
+            for rtype, seq, body in self._scan(self._segment_path(number)):
+                max_seq = max(max_seq, seq)
+                if rtype == _APPEND:
+                    appended[seq] = body
+                    appended_segment[seq] = number
+                else:
+                    acked.add(seq)
+            self._segments.append([number, set()])
+
+        pending = []
+        for seq in sorted(appended):
+            if seq in acked:
+                continue
+            body = appended[seq]
+            (topic_len,) = _TOPIC_LEN.unpack_from(body)
+            topic = body[2:2 + topic_len].decode('utf-8')
+            payload = bytes(body[2 + topic_len:])
+            pending.append((seq, topic, payload))
+            number = appended_segment[seq]
+            self._seq_segment[seq] = number
+            self._segment_entry(number)[1].add(seq)
+
+        self._next_seq = max_seq + 1
+        self._durable_seq = max_seq
+        self._roll_segment()
+        self._retire_segments()
+        self._running = True
+        self._writer = threading.Thread(target=self._writer_loop, name="qos2-wal", daemon=True)
+        self._writer.start()
+        self._log('info', "QoS 2 WAL opened with %d unacked records in %.1fms", len(pending),
+                  (time.time() - start) * 1000, pending=len(pending))
+        return pending
+
+    def append(self, topic, payload):
+        """Buffer an alert for the next group commit and return its sequence number.
+
+        payload is stored as given if it is already encoded bytes, otherwise as JSON.
+        """
+        topic_bytes = topic.encode('utf-8')
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = json.dumps(payload).encode('utf-8')
+        body = _TOPIC_LEN.pack(len(topic_bytes)) + topic_bytes + payload
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._buffer.append((seq, self._record(_APPEND, seq, body)))
+            self.stats['appended'] += 1
+            self._wakeup.notify()
+        return seq
+
+    def ack(self, seq):
+        """Mark an alert as delivered; it will not be replayed after a restart."""
+        with self._lock:
+            self._buffer.append((None, self._record(_ACK, seq, b'')))
+            self.stats['acked'] += 1
+            self._wakeup.notify()
+
+    def wait_durable(self, seq, timeout=None):
+        """Block until the record with this sequence number has been fsynced."""
+        with self._durable:
+            return self._durable.wait_for(lambda: self._durable_seq >= seq, timeout)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._seq_segment)
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        if self._writer:
+            self._writer.join(timeout=5)
+        self._commit()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    # Writer thread
+
+    def _writer_loop(self):
+        while True:
+            with self._lock:
+                if not self._buffer and self._running:
+                    self._wakeup.wait()
+                if not self._running and not self._buffer:
+                    return
+            # Let more records pile up so one fsync covers the whole batch
+            time.sleep(self.commit_interval)
+            try:
+                self._commit()
+            except OSError as e:
+                self._log('error', "QoS 2 WAL commit failed: %s", e)
+
+    def _commit(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        chunk = []
+        chunk_size = 0
+        for seq, record in batch:
+            if self._offset + chunk_size + len(record) > self.segment_size:
+                self._write(b''.join(chunk))
+                chunk, chunk_size = [], 0
+                self._roll_segment()
+            chunk.append(record)
+            chunk_size += len(record)
+            if seq is not None:
+                with self._lock:
+                    number = self._segments[-1][0]
+                    self._seq_segment[seq] = number
+                    self._segments[-1][1].add(seq)
+        self._write(b''.join(chunk))
+
+        acked = []
+        for seq, record in batch:
+            if seq is None:
+                acked.append(_HEADER.unpack_from(record)[2])
+        with self._lock:
+            for seq in acked:
+                number = self._seq_segment.pop(seq, None)
+                if number is not None:
+                    self._segment_entry(number)[1].discard(seq)
+            last_seq = max((seq for seq, _ in batch if seq is not None), default=self._durable_seq)
+            self._durable_seq = max(self._durable_seq, last_seq)
+            self.stats['commits'] += 1
+            self._durable.notify_all()
+        self._retire_segments()
+
+    def _write(self, data):
+        if not data:
+            return
+        os.pwrite(self._fd, data, self._offset)
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self._fd)
+        else:
+            os.fsync(self._fd)
+        self._offset += len(data)
+        self.stats['bytes_written'] += len(data)
+
+    # Segment management
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment-{number:08d}.wal")
+
+    def _existing_segments(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith('.wal'):
+                numbers.append(int(name[8:-4]))
+        return sorted(numbers)
+
+    def _segment_entry(self, number):
+        for entry in self._segments:
+            if entry[0] == number:
+                return entry
+        raise KeyError(number)
+
+    def _roll_segment(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        with self._lock:
+            number = self._segments[-1][0] + 1 if self._segments else 1
+            self._segments.append([number, set()])
+        fd = os.open(self._segment_path(number), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.posix_fallocate(fd, 0, self.segment_size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, self.segment_size)
+        self._fd = fd
+        self._offset = 0
+        self.stats['segments_created'] += 1
+
+    def _retire_segments(self):
+        # Only a fully acknowledged prefix of closed segments can go, so ack records
+        # for alerts that are still pending are never deleted ahead of them
+        retired = []
+        with self._lock:
+            while len(self._segments) > 1 and not self._segments[0][1]:
+                retired.append(self._segments.pop(0)[0])
+        for number in retired:
+            try:
+                os.remove(self._segment_path(number))
+                self.stats['segments_retired'] += 1
+            except OSError as e:
+                self._log('error', "Failed to remove WAL segment %d: %s", number, e, segment=number)
+
+    # Encoding
+
+    @staticmethod
+    def _record(rtype, seq, body):
+        return _HEADER.pack(_MAGIC, rtype, seq, len(body), zlib.crc32(body)) + body
+
+    @staticmethod
+    def _scan(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        view = memoryview(data)
+        offset = 0
+        end = len(data)
+        while offset + _HEADER.size <= end:
+            magic, rtype, seq, length, crc = _HEADER.unpack_from(view, offset)
+            if magic != _MAGIC:
+                break  # Reached the preallocated, never-written tail
+            body_start = offset + _HEADER.size
+            body = bytes(view[body_start:body_start + length])
+            if len(body) != length or zlib.crc32(body) != crc:
+                break  # Torn write from a crash mid-commit
+            yield rtype, seq, body
+            offset = body_start + length
+
+    def _log(self, level, message, *args, **extra):
+        if self.logger:
+            getattr(self.logger, level)(message, *args, extra=event('wal', **extra))
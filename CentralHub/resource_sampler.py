@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+from hub_logging import event
+
+
+class ResourceSampler:
+    """Samples system resources at a fixed rate and serves cached snapshots.
+
+    One sample costs one call each to cpu_percent (non-blocking, measured
+    since the previous sample), virtual_memory, swap_memory, disk_usage,
+    getloadavg and net_io_counters. Readers such as the heartbeat and the
+    pool growth check only read the latest snapshot, so they add no
+    syscalls of their own. Counters like network bytes are turned into
+    per-second rates against the previous sample.
+    """
+    def __init__(self, interval=5.0, history=60, disk_path='/', logger=None):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.logger = logger
+        self._samples = deque(maxlen=history)
+        self._latest = {}
+        self._previous_net = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        psutil.cpu_percent(interval=None)  # Prime the CPU counter so the first sample is meaningful
+
+    def sample(self):
+        """Take one sample now, store it in the ring buffer and return it."""
+        now = time.monotonic()
+        memory = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+        net = psutil.net_io_counters()
+        snapshot = {
+            'timestamp': time.time(),
+            'cpu': psutil.cpu_percent(interval=None),
+            'memory': memory.percent,
+            'available_memory': memory.available / (1024 * 1024),  # MB
+            'total_memory': memory.total / (1024 * 1024),  # MB
+            'swap_used': swap.percent,
+            'disk_usage': psutil.disk_usage(self.disk_path).percent,
+            'load_average': os.getloadavg(),
+            'network_in_rate': 0.0,  # bytes/s
+            'network_out_rate': 0.0,  # bytes/s
+        }
+        if self._previous_net:
+            previous_time, previous = self._previous_net
+            elapsed = now - previous_time
+            if elapsed > 0:
+                snapshot['network_in_rate'] = max(0, net.bytes_recv - previous.bytes_recv) / elapsed
+                snapshot['network_out_rate'] = max(0, net.bytes_sent - previous.bytes_sent) / elapsed
+        self._previous_net = (now, net)
+        self._samples.append(snapshot)
+        self._latest = snapshot  # Single reference swap; readers never see a half-built sample
+        return snapshot
+
+    def latest(self):
+        """Most recent snapshot, sampling once if nothing has been collected yet."""
+        return self._latest or self.sample()
+
+    def history(self):
+        return list(self._samples)
+
+    def average(self, key, samples=None):
+        values = [s[key] for s in list(self._samples)[-samples if samples else 0:]]
+        return sum(values) / len(values) if values else 0.0
+
+    def available_memory_mb(self):
+        return self.latest()['available_memory']
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=2)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error("Resource sampler error: %s", e, extra=event('hub'))
+            self._stop_event.wait(self.interval)
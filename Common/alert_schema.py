@@ -0,0 +1,473 @@
+import json
+from datetime import datetime
+from functools import lru_cache
+from operator import attrgetter
+
+# Message schemas shared by the drivers, the Central Hub and the Flask dashboard.
+#
+# Inbound payloads are validated once in decode_message() and become slotted
+# records, so handlers read attributes instead of re-checking dict keys. Each
+# record serialises itself once per codec and caches the bytes, so a publish
+# that is retried (or written to the WAL and then published) is not encoded
+# again. Records must not be modified after they have been encoded.
+
+FALLEN_OUT_OF_BED = 'Fallen out of bed'
+BED_TOPIC = 'ward/{ward}/bed/{bed}/{kind}'  # e.g. ward/3/bed/12/audio/emergency
+NO_FALL_STATE = 'No fall detected (Standing, Sitting, Lying Down)'
+FLOW_TOPIC = 'hub/flow'  # Retained hub load level that the drivers throttle to
+
+
+class SchemaError(ValueError):
+    """Raised when a payload cannot be decoded or is missing/mistyping a field."""
+
+
+# Topics
+
+def bed_topic(ward, bed, kind):
+    """Topic for one bed, or the single-bed topic (kind itself) when ward/bed are None."""
+    if ward is None or bed is None:
+        return kind
+    return BED_TOPIC.format(ward=ward, bed=bed, kind=kind)
+
+
+@lru_cache(maxsize=8192)
+def parse_bed_topic(topic):
+    """Split 'ward/<ward>/bed/<bed>/<kind>' into (ward, bed, kind).
+
+    Single-bed topics such as 'audio/emergency' come back as (None, None, topic).
+    Results are cached, so routing a message costs one dict lookup however
+    many beds there are.
+    """
+    parts = topic.split('/', 4)
+    if len(parts) == 5 and parts[0] == 'ward' and parts[2] == 'bed' and parts[1] and parts[3]:
+        return parts[1], parts[3], parts[4]
+    return None, None, topic
+
+
+# Codecs
+
+class JsonCodec:
+    name = 'json'
+
+    def __init__(self):
+        # json.dumps() with any option builds a new encoder per call; build it once
+        self._encode = json.JSONEncoder(separators=(',', ':'), check_circular=False).encode
+
+    def encode(self, obj):
+        return self._encode(obj).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgPackCodec:
+    name = 'msgpack'
+
+    def __init__(self):
+        import msgpack  # Optional dependency: pip install msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, obj):
+        return self._packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return self._unpackb(data, raw=False)
+
+
+class CborCodec:
+    name = 'cbor'
+
+    def __init__(self):
+        import cbor2  # Optional dependency: pip install cbor2
+        self._dumps = cbor2.dumps
+        self._loads = cbor2.loads
+
+    def encode(self, obj):
+        return self._dumps(obj)
+
+    def decode(self, data):
+        return self._loads(data)
+
+
+CODECS = {'json': JsonCodec, 'msgpack': MsgPackCodec, 'cbor': CborCodec}
+_codecs = {}
+_default_codec = None
+
+
+def get_codec(name=None):
+    """Return the shared codec instance for name (the default codec when name is None)."""
+    if name is None:
+        return _default_codec
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in CODECS:
+            raise ValueError(f"Unknown codec '{name}', expected one of {', '.join(CODECS)}")
+        try:
+            codec = _codecs[name] = CODECS[name]()
+        except ImportError as e:
+            raise ValueError(f"Codec '{name}' is not available: {e}") from e
+    return codec
+
+
+def set_default_codec(name):
+    """Choose the codec used for outbound messages on this node."""
+    global _default_codec
+    _default_codec = get_codec(name)
+    return _default_codec
+
+
+set_default_codec('json')
+
+
+def codec_for(data):
+    """Pick the codec a payload was written with from its first byte.
+
+    Every schema is a map, and a map starts with '{' in JSON, 0x80-0x8f/0xde/0xdf
+    in MessagePack and 0xa0-0xbb/0xbf in CBOR, so nodes can switch codecs one at
+    a time without the others being reconfigured.
+    """
+    first = data[0] if data else 0
+    if 0x80 <= first <= 0x8f or first in (0xde, 0xdf):
+        return get_codec('msgpack')
+    if 0xa0 <= first <= 0xbb or first == 0xbf:
+        return get_codec('cbor')
+    return get_codec('json')
+
+
+def _decode(data):
+    try:
+        codec = codec_for(data)
+        obj = codec.decode(data)
+    except Exception as e:
+        raise SchemaError(f"undecodable payload: {e}") from e
+    if not isinstance(obj, dict):
+        raise SchemaError(f"expected a map, got {type(obj).__name__}")
+    return codec, obj
+
+
+def decode_payload(data):
+    """Decode raw MQTT payload bytes into a dict, whatever codec produced them."""
+    return _decode(data)[1]
+
+
+def encode_payload(payload, codec=None):
+    """Serialise a record (cached) or a plain dict such as the hub heartbeat."""
+    if isinstance(payload, Record):
+        return payload.encode(codec)
+    return (codec or _default_codec).encode(payload)
+
+
+# Field validation
+
+_MISSING = object()
+
+
+def _field(data, key, types, default=_MISSING):
+    value = data.get(key)
+    if value is None:
+        if default is _MISSING:
+            raise SchemaError(f"missing field '{key}'")
+        return default
+    # bool is an int subclass, so only accept it where bool is asked for
+    if not isinstance(value, types) or (value is True or value is False) and types is not bool:
+        raise SchemaError(f"field '{key}' has type {type(value).__name__}")
+    return value
+
+
+def _timestamp(data):
+    return _field(data, 'timestamp', str, None) or datetime.now().isoformat()
+
+
+def _trace(data):
+    trace = _field(data, 'trace', dict, None)
+    if trace is not None and not (
+            isinstance(trace.get('id'), str) and isinstance(trace.get('hops'), list) and all(
+                isinstance(hop, list) and len(hop) == 2 and isinstance(hop[0], str)
+                and isinstance(hop[1], (int, float)) and not isinstance(hop[1], bool) for hop in trace['hops'])):
+        raise SchemaError("field 'trace' must have an id and a list of [hop, time] stamps")
+    return trace
+
+
+def _distances(data, default=_MISSING):
+    distances = _field(data, 'distances', list, default)
+    if distances is not None and not all(
+            isinstance(d, (int, float)) and not isinstance(d, bool) for d in distances):
+        raise SchemaError("field 'distances' must be a list of numbers")
+    return distances
+
+
+# Records
+
+class Record:
+    """Base for slotted message records.
+
+    FIELDS maps attribute names to wire keys in serialisation order; fields
+    that are None are left out of the encoded message.
+    """
+    __slots__ = ('_wire',)
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._keys = tuple(key for _, key in cls.FIELDS)
+        cls._values = attrgetter(*(attr for attr, _ in cls.FIELDS))
+
+    def to_dict(self):
+        return {key: value for key, value in zip(self._keys, self._values(self)) if value is not None}
+
+    def encode(self, codec=None):
+        codec = codec or _default_codec
+        wire = getattr(self, '_wire', None)
+        if wire is None or wire[0] is not codec:
+            wire = (codec, codec.encode(self.to_dict()))
+            self._wire = wire
+        return wire[1]
+
+    def _prime(self, codec, data):
+        # Keep the bytes a record was decoded from so republishing it costs nothing
+        self._wire = (codec, bytes(data))
+        return self
+
+    def get(self, key, default=None):
+        """Dict-style access by wire key, for code that still treats messages as dicts."""
+        for attr, wire_key in self.FIELDS:
+            if wire_key == key:
+                value = getattr(self, attr)
+                return default if value is None else value
+        return default
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, attr) == getattr(other, attr) for attr, _ in self.FIELDS)
+
+    def __repr__(self):
+        fields = ", ".join(f"{attr}={getattr(self, attr)!r}" for attr, _ in self.FIELDS)
+        return f"{type(self).__name__}({fields})"
+
+
+class AudioAlert(Record):
+    """audio/emergency: wake word or distress sound detected by the audio Pi."""
+    __slots__ = ('timestamp', 'alert_type', 'confidence', 'phrase', 'source', 'trace')
+    FIELDS = (('timestamp', 'timestamp'), ('alert_type', 'alert_type'), ('confidence', 'confidence'),
+              ('phrase', 'phrase'), ('source', 'source'), ('trace', 'trace'))
+
+    def __init__(self, timestamp, alert_type, confidence=None, phrase='', source='audio', trace=None):
+        self.timestamp = timestamp
+        self.alert_type = alert_type
+        self.confidence = confidence
+        self.phrase = phrase
+        self.source = source
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        confidence = _field(data, 'confidence', (int, float), None)
+        return cls(_timestamp(data), _field(data, 'alert_type', str, None),
+                   float(confidence) if confidence is not None else None,
+                   _field(data, 'phrase', str, ''), _field(data, 'source', str, 'audio'), _trace(data))
+
+
+class FallAlert(Record):
+    """video/emergency: pose state from the camera Pi, or its camera on/off state."""
+    __slots__ = ('timestamp', 'source', 'mediapipe_state', 'camera_state', 'trace')
+    FIELDS = (('timestamp', 'timestamp'), ('mediapipe_state', 'mediapipe_state'), ('source', 'source'),
+              ('camera_state', 'cameraState'), ('trace', 'trace'))
+
+    def __init__(self, timestamp, source='video', mediapipe_state=None, camera_state=None, trace=None):
+        self.timestamp = timestamp
+        self.source = source
+        self.mediapipe_state = mediapipe_state
+        self.camera_state = camera_state
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(_timestamp(data), _field(data, 'source', str, 'video'),
+                   _field(data, 'mediapipe_state', str, NO_FALL_STATE),
+                   _field(data, 'cameraState', bool, False), _trace(data))
+
+
+class ProximityReading(Record):
+    """proximity/alert: ultrasonic distances and the derived out-of-bed flag."""
+    __slots__ = ('timestamp', 'out_of_bed', 'distances', 'source', 'trace')
+    FIELDS = (('out_of_bed', 'out_of_bed'), ('distances', 'distances'), ('timestamp', 'timestamp'),
+              ('source', 'source'), ('trace', 'trace'))
+
+    def __init__(self, timestamp, out_of_bed, distances, source='proximity', trace=None):
+        self.timestamp = timestamp
+        self.out_of_bed = out_of_bed
+        self.distances = distances
+        self.source = source
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(_timestamp(data), _field(data, 'out_of_bed', bool, False), _distances(data, []),
+                   _field(data, 'source', str, 'proximity'), _trace(data))
+
+
+class CameraCommand(Record):
+    """video/monitor: hub tells the camera Pi to start or stop streaming."""
+    __slots__ = ('timestamp', 'source', 'activate', 'trace')
+    FIELDS = (('activate', 'activate'), ('timestamp', 'timestamp'), ('source', 'source'), ('trace', 'trace'))
+
+    def __init__(self, timestamp, source, activate, trace=None):
+        self.timestamp = timestamp
+        self.source = source
+        self.activate = activate
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(_timestamp(data), _field(data, 'source', str, ''), _field(data, 'activate', bool, False),
+                   _trace(data))
+
+
+class CameraActivation(Record):
+    """nurse/dashboard with source 'camera_activation': show or hide the live stream."""
+    __slots__ = ('timestamp', 'activate', 'source', 'trace')
+    FIELDS = (('activate', 'activate'), ('timestamp', 'timestamp'), ('source', 'source'), ('trace', 'trace'))
+
+    def __init__(self, timestamp, activate, source='camera_activation', trace=None):
+        self.timestamp = timestamp
+        self.activate = activate
+        self.source = source
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(_timestamp(data), _field(data, 'activate', bool, False), trace=_trace(data))
+
+
+class DashboardAlert(Record):
+    """nurse/dashboard: an alert card for the nurse dashboard."""
+    __slots__ = ('timestamp', 'alert_type', 'source', 'priority', 'details', 'confidence', 'distances', 'trace')
+    FIELDS = (('timestamp', 'timestamp'), ('alert_type', 'alert_type'), ('confidence', 'confidence'),
+              ('source', 'source'), ('details', 'details'), ('distances', 'distances'),
+              ('priority', 'priority'), ('trace', 'trace'))
+
+    def __init__(self, timestamp, alert_type, source, priority, details=None, confidence=None, distances=None,
+                 trace=None):
+        self.timestamp = timestamp
+        self.alert_type = alert_type
+        self.source = source
+        self.priority = priority
+        self.details = details
+        self.confidence = confidence
+        self.distances = distances
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        confidence = _field(data, 'confidence', (int, float), None)
+        return cls(_timestamp(data), _field(data, 'alert_type', str, 'Unknown'),
+                   _field(data, 'source', str, 'Unknown'), _field(data, 'priority', str, 'MEDIUM').upper(),
+                   _field(data, 'details', str, None), float(confidence) if confidence is not None else None,
+                   _distances(data, None), _trace(data))
+
+
+class IncidentAlert(Record):
+    """nurse/dashboard with source 'fusion': one incident the hub built from several sensors' alerts."""
+    __slots__ = ('timestamp', 'alert_type', 'source', 'priority', 'confidence', 'details', 'incident_id',
+                 'sources', 'events', 'trace')
+    FIELDS = (('timestamp', 'timestamp'), ('alert_type', 'alert_type'), ('incident_id', 'incident_id'),
+              ('confidence', 'confidence'), ('source', 'source'), ('sources', 'sources'), ('events', 'events'),
+              ('details', 'details'), ('priority', 'priority'), ('trace', 'trace'))
+    distances = None  # Read like a DashboardAlert by the dashboard
+
+    def __init__(self, timestamp, incident_id, priority, confidence, sources, events, details=None,
+                 alert_type='INCIDENT', source='fusion', trace=None):
+        self.timestamp = timestamp
+        self.incident_id = incident_id
+        self.priority = priority
+        self.confidence = confidence
+        self.sources = sources
+        self.events = events
+        self.details = details
+        self.alert_type = alert_type
+        self.source = source
+        self.trace = trace
+
+    @classmethod
+    def from_dict(cls, data):
+        sources = _field(data, 'sources', list, [])
+        if not all(isinstance(s, str) for s in sources):
+            raise SchemaError("field 'sources' must be a list of strings")
+        confidence = _field(data, 'confidence', (int, float), None)
+        return cls(_timestamp(data), _field(data, 'incident_id', str, ''),
+                   _field(data, 'priority', str, 'MEDIUM').upper(),
+                   float(confidence) if confidence is not None else None, sources,
+                   _field(data, 'events', int, len(sources)), _field(data, 'details', str, None),
+                   _field(data, 'alert_type', str, 'INCIDENT'), trace=_trace(data))
+
+
+class FlowStatus(Record):
+    """hub/flow: the hub's load level (NORMAL, ELEVATED or CRITICAL) and how full its queues are."""
+    __slots__ = ('timestamp', 'level', 'load', 'source')
+    FIELDS = (('timestamp', 'timestamp'), ('level', 'level'), ('load', 'load'), ('source', 'source'))
+
+    def __init__(self, timestamp, level, load=None, source='hub'):
+        self.timestamp = timestamp
+        self.level = level
+        self.load = load
+        self.source = source
+
+    @classmethod
+    def from_dict(cls, data):
+        load = _field(data, 'load', (int, float), None)
+        return cls(_timestamp(data), _field(data, 'level', str, 'NORMAL').upper(),
+                   float(load) if load is not None else None, _field(data, 'source', str, 'hub'))
+
+
+class ClockPing(Record):
+    """clock/ping/<node> and clock/pong/<node>: one clock offset sample between a node and the hub.
+
+    The node fills in sent; the hub's reply adds when it received the ping
+    and when it sent the pong, all in seconds since the epoch on each clock.
+    """
+    __slots__ = ('node', 'sent', 'hub_received', 'hub_sent')
+    FIELDS = (('node', 'node'), ('sent', 'sent'), ('hub_received', 'hub_received'), ('hub_sent', 'hub_sent'))
+
+    def __init__(self, node, sent, hub_received=None, hub_sent=None):
+        self.node = node
+        self.sent = sent
+        self.hub_received = hub_received
+        self.hub_sent = hub_sent
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(_field(data, 'node', str), float(_field(data, 'sent', (int, float))),
+                   _field(data, 'hub_received', (int, float), None), _field(data, 'hub_sent', (int, float), None))
+
+
+def _dashboard_record(data):
+    source = data.get('source')
+    if source == 'camera_activation':
+        return CameraActivation.from_dict(data)
+    if source == 'fusion':
+        return IncidentAlert.from_dict(data)
+    return DashboardAlert.from_dict(data)
+
+
+TOPIC_SCHEMAS = {
+    'audio/emergency': AudioAlert.from_dict,
+    'video/emergency': FallAlert.from_dict,
+    'proximity/alert': ProximityReading.from_dict,
+    'video/monitor': CameraCommand.from_dict,
+    'nurse/dashboard': _dashboard_record,
+    FLOW_TOPIC: FlowStatus.from_dict,
+}
+
+
+def decode_message(topic, data):
+    """Decode and validate a payload for topic (single-bed or per-bed) into its record type.
+
+    Topics without a schema are returned as plain dicts. Raises SchemaError
+    if the payload cannot be decoded or a field has the wrong type.
+    """
+    codec, obj = _decode(data)
+    build = TOPIC_SCHEMAS.get(parse_bed_topic(topic)[2])
+    if build is None:
+        return obj
+    return build(obj)._prime(codec, data)
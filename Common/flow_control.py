@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from alert_schema import FLOW_TOPIC, FlowStatus, SchemaError, decode_message
+
+# Flow control between the Central Hub and the edge drivers.
+#
+# The hub turns how full its queues are into a load level with a
+# PressureGauge and publishes it, retained, on hub/flow whenever it changes
+# (and again with every heartbeat while it is raised). Each driver keeps a
+# FlowGovernor subscribed to that topic and asks it before publishing: under
+# pressure, routine readings are sent less often, repeats of an unchanged
+# state are held back and LOW data drops to QoS 0, so the hub's queues are
+# left to the HIGH alerts. Drivers go back to normal on their own once the hub
+# says so, or if they stop hearing from it.
+
+NORMAL = 'NORMAL'
+ELEVATED = 'ELEVATED'
+CRITICAL = 'CRITICAL'
+LEVELS = (NORMAL, ELEVATED, CRITICAL)
+
+# Queue fill ratio at which a level is entered, and the lower ratio it must fall below to be left
+ENTER = {ELEVATED: 0.6, CRITICAL: 0.8}
+EXIT = {ELEVATED: 0.3, CRITICAL: 0.5}
+
+# How much drivers stretch their publish intervals at each level
+BACKOFF = {NORMAL: 1, ELEVATED: 2, CRITICAL: 4}
+
+logger = logging.getLogger(__name__)
+
+
+def flow_status(level, load=None):
+    return FlowStatus(datetime.now().isoformat(), level, round(load, 3) if load is not None else None)
+
+
+class PressureGauge:
+    """Hub side: the load level for a queue fill ratio between 0 and 1.
+
+    A level is raised as soon as the fill reaches its ENTER ratio. It is only
+    lowered once the fill is below the EXIT ratio and hold seconds have passed
+    since the last change, so a queue hovering at a threshold does not make
+    every driver flip back and forth.
+    """
+    def __init__(self, hold=5.0, clock=time.monotonic):
+        self.hold = hold
+        self.clock = clock
+        self.level = NORMAL
+        self._index = 0
+        self._changed = clock()
+        self._changes = 0
+        self._peak = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, fill):
+        """Return the new level if fill changes it, else None."""
+        now = self.clock()
+        with self._lock:
+            self._peak = max(self._peak, fill)
+            index = self._index
+            while index < len(LEVELS) - 1 and fill >= ENTER[LEVELS[index + 1]]:
+                index += 1
+            if index == self._index:
+                while index and fill < EXIT[LEVELS[index]] and now - self._changed >= self.hold:
+                    index -= 1
+            if index == self._index:
+                return None
+            self._index = index
+            self.level = LEVELS[index]
+            self._changed = now
+            self._changes += 1
+            return self.level
+
+    def stats(self):
+        with self._lock:
+            return {'level': self.level, 'changes': self._changes, 'peak_fill': round(self._peak, 3)}
+
+
+class FlowGovernor:
+    """Driver side: follows the hub's load level and decides what to publish.
+
+    subscribe(client) from on_connect routes hub/flow to this governor. A
+    raised level that has not been repeated for stale_after seconds (the hub
+    repeats it every heartbeat) counts as NORMAL, so a driver never stays
+    throttled by a hub that has gone away.
+    """
+    def __init__(self, stale_after=90.0, clock=time.monotonic):
+        self.stale_after = stale_after
+        self.clock = clock
+        self._level = NORMAL
+        self._received = None
+        self._last = {}  # key -> (state, time) of the last message sent
+        self._lock = threading.Lock()
+        self._counts = {'sent': 0, 'held': 0}
+
+    def subscribe(self, client):
+        client.message_callback_add(FLOW_TOPIC, self.on_message)
+        return client.subscribe(FLOW_TOPIC, 1)
+
+    def on_message(self, client, userdata, message):
+        try:
+            status = decode_message(message.topic, message.payload)
+        except SchemaError as e:
+            logger.warning(f"Ignoring flow status: {e}")
+            return
+        level = status.level if status.level in BACKOFF else NORMAL
+        with self._lock:
+            if level != self._level:
+                print(f"Hub load level {self._level} -> {level}")
+            self._level = level
+            self._received = self.clock()
+
+    @property
+    def level(self):
+        with self._lock:
+            if self._level != NORMAL and self.clock() - self._received > self.stale_after:
+                self._level = NORMAL
+            return self._level
+
+    def interval(self, base):
+        """base seconds between routine publishes, stretched to the hub's load."""
+        return base * BACKOFF[self.level]
+
+    def qos(self, priority, qos):
+        """LOW data goes at QoS 0 while the hub is under pressure."""
+        return 0 if priority == 'LOW' and self.level != NORMAL else qos
+
+    def should_send(self, key, state, repeat_every):
+        """Whether to publish state for key (e.g. a topic) now.
+
+        Always while NORMAL. Under pressure a change of state is sent straight
+        away, and a repeat of the same state once every repeat_every seconds
+        (twice that at CRITICAL), so the hub still hears that it is ongoing.
+        """
+        level = self.level
+        now = self.clock()
+        with self._lock:
+            last = self._last.get(key)
+            send = (level == NORMAL or last is None or last[0] != state
+                    or now - last[1] >= repeat_every * (2 if level == CRITICAL else 1))
+            if send:
+                self._last[key] = (state, now)
+            self._counts['sent' if send else 'held'] += 1
+        return send
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, level=self._level)
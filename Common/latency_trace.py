@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from collections import deque
+
+from alert_schema import ClockPing, SchemaError, decode_payload
+
+# End-to-end latency tracing, from the sensor to the nurse's screen.
+#
+# A driver starts a trace when it captures what an alert is about (a camera
+# frame, an audio chunk, an ultrasonic reading) and stamps it again just
+# before it publishes. The trace rides in the message's 'trace' field: an id
+# and a list of [hop, time] stamps. The hub stamps it when the message
+# arrives (hub_in) and when the message processor picks it up (hub_start),
+# and every message the hub publishes because of it carries a copy stamped
+# hub_out. The dashboard stamps dashboard_in in on_message and emitted after
+# the Socket.IO emit, and records the time between each pair of hops.
+#
+# Every stamp is on the hub's clock. Each node estimates how far its own
+# clock is from the hub's with ClockSync, which pings the hub over MQTT the
+# way NTP does; the hub answers with answer_ping().
+
+CLOCK_PING = 'clock/ping/{node}'
+CLOCK_PONG = 'clock/pong/{node}'
+
+# Where a trace starts, by driver
+FRAME = 'frame'              # Camera frame read
+AUDIO_CHUNK = 'audio_chunk'  # Audio chunk finished recording
+READING = 'reading'          # Ultrasonic distances read
+
+
+def start_trace(origin, at):
+    """New trace whose first hop is origin at time at (hub clock)."""
+    return {'id': os.urandom(8).hex(), 'hops': [[origin, round(at, 6)]]}
+
+
+def stamp(trace, hop, at=None):
+    """Copy of trace with hop stamped at time at (default: now on this clock). Traces already
+    encoded into a record are never changed, so each node stamps its own copy."""
+    at = time.time() if at is None else at
+    return {'id': trace['id'], 'hops': trace['hops'] + [[hop, round(at, 6)]]}
+
+
+def answer_ping(client, data, received_at, codec=None):
+    """Hub side: reply to a clock/ping payload received at received_at. Pongs go at QoS 0, since a
+    retransmitted one would skew the sample; a lost ping is simply not answered."""
+    try:
+        ping = ClockPing.from_dict(decode_payload(data))
+    except SchemaError:
+        return False
+    pong = ClockPing(ping.node, ping.sent, received_at, time.time())
+    client.publish(CLOCK_PONG.format(node=ping.node), pong.encode(codec), qos=0)
+    return True
+
+
+class ClockSync:
+    """Node side: this node's clock offset from the hub's, over MQTT ping/pong.
+
+    subscribe(client) from on_connect routes the node's pong topic here and
+    starts pinging: burst pings a second apart, then one every interval
+    seconds. Each reply gives an offset of ((t1 - t0) + (t2 - t3)) / 2 and a
+    round trip of (t3 - t0) - (t2 - t1), for ping sent at t0, received by the
+    hub at t1, answered at t2 and back at t3. Of the last samples replies,
+    the one with the shortest round trip is used, since it waited in the
+    fewest queues. now() is the current time on the hub's clock.
+    """
+    def __init__(self, node, interval=60.0, burst=5, samples=8, clock=time.time):
+        self.node = node
+        self.interval = interval
+        self.burst = burst
+        self.clock = clock
+        self.offset = 0.0
+        self.rtt = None
+        self._samples = deque(maxlen=samples)  # (rtt, offset)
+        self._client = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._counts = {'pings': 0, 'pongs': 0}
+
+    def subscribe(self, client):
+        self._client = client
+        topic = CLOCK_PONG.format(node=self.node)
+        client.message_callback_add(topic, self.on_pong)
+        result = client.subscribe(topic, 0)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='clock-sync', daemon=True)
+            self._thread.start()
+        return result
+
+    def now(self):
+        return self.clock() + self.offset
+
+    def ping(self):
+        self._counts['pings'] += 1
+        self._client.publish(CLOCK_PING.format(node=self.node), ClockPing(self.node, self.clock()).encode(), qos=0)
+
+    def on_pong(self, client, userdata, message):
+        received = self.clock()
+        try:
+            pong = ClockPing.from_dict(decode_payload(message.payload))
+        except SchemaError:
+            return
+        if pong.hub_received is None or pong.hub_sent is None:
+            return
+        rtt = (received - pong.sent) - (pong.hub_sent - pong.hub_received)
+        offset = ((pong.hub_received - pong.sent) + (pong.hub_sent - received)) / 2
+        with self._lock:
+            self._counts['pongs'] += 1
+            self._samples.append((rtt, offset))
+            self.rtt, self.offset = min(self._samples)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, offset_ms=round(self.offset * 1000, 3),
+                        rtt_ms=round(self.rtt * 1000, 3) if self.rtt is not None else None)
+
+    def _run(self):
+        sent = 0
+        while True:
+            try:
+                self.ping()
+            except Exception as e:
+                print(f"Clock ping failed: {e}")
+            sent += 1
+            time.sleep(1.0 if sent < self.burst else self.interval)
+
+
+def _percentiles(values):
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(p / 100 * len(values)))], 3)  # noqa: E731
+    return {'count': len(values), 'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'max': round(values[-1], 3)}
+
+
+class TraceRecorder:
+    """Hop and total latencies of completed traces, in ms, over the last keep traces per origin.
+
+    report() gives percentiles for each origin (frame, audio_chunk, reading):
+    one entry per pair of consecutive hops, such as 'sent>hub_in', and the
+    total from the first stamp to the last.
+    """
+    def __init__(self, keep=1000):
+        self.keep = keep
+        self._origins = {}  # origin -> {hop pair or 'total': deque of ms}, in the order first seen
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        hops = trace['hops']
+        if len(hops) < 2:
+            return
+        durations = [(f"{a}>{b}", (tb - ta) * 1000) for (a, ta), (b, tb) in zip(hops, hops[1:])]
+        durations.append(('total', (hops[-1][1] - hops[0][1]) * 1000))
+        with self._lock:
+            series = self._origins.setdefault(hops[0][0], {})
+            for name, ms in durations:
+                series.setdefault(name, deque(maxlen=self.keep)).append(ms)
+
+    def report(self):
+        with self._lock:
+            return {origin: {name: _percentiles(values) for name, values in series.items()}
+                    for origin, series in self._origins.items()}
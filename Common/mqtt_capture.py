@@ -0,0 +1,248 @@
+import argparse
+import bisect
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+
+# Record-and-replay captures of MQTT traffic.
+#
+# A capture is a binary log of every message seen on the broker: when it
+# arrived (monotonic, microseconds since the capture started), topic, QoS,
+# retain flag and payload bytes as sent, so a night-shift incident or a fall
+# alert storm can be fed back into the hub or the dashboard later, on any
+# machine, at the original pace or faster.
+#
+# Layout, all little-endian:
+#   file header   magic, version, wall-clock start time
+#   topic record  kind 'T', topic id, name length, name     (first use of a topic)
+#   message       kind 'M', time, topic id, qos, retain, payload length, payload
+#   index         every index_every messages: (message number, time, offset)
+#   topic table   every topic name, in id order
+#   footer        index offset, index entries, topics, message count, duration, magic
+#
+# Topic names are written once and referenced by id, so a message costs 17
+# bytes plus its payload. The index and footer are written by close(); a
+# capture cut short by a crash has neither and is read sequentially instead.
+
+_FILE_HEADER = struct.Struct('<6sHd')
+_FILE_MAGIC = b'MQCAP\x00'
+_VERSION = 1
+_TOPIC = struct.Struct('<cHH')
+_MESSAGE = struct.Struct('<cQHBBI')
+_INDEX_ENTRY = struct.Struct('<QQQ')
+_TOPIC_NAME = struct.Struct('<H')
+_FOOTER = struct.Struct('<QIHQQ6s')
+_FOOTER_MAGIC = b'MQIDX\x00'
+_KIND_TOPIC = b'T'
+_KIND_MESSAGE = b'M'
+
+CapturedMessage = namedtuple('CapturedMessage', 'time topic qos retain payload')
+
+
+class CaptureError(Exception):
+    """The file is not a capture or is damaged before its first message."""
+
+
+class CaptureWriter:
+    """Appends messages to a capture file; thread-safe, so it can sit behind on_message directly."""
+    def __init__(self, path, index_every=1000, clock=time.monotonic):
+        self.path = path
+        self.index_every = index_every
+        self.clock = clock
+        self.started_at = time.time()
+        self._start = clock()
+        self._file = open(path, 'wb')
+        self._file.write(_FILE_HEADER.pack(_FILE_MAGIC, _VERSION, self.started_at))
+        self._topics = {}
+        self._index = []
+        self._count = 0
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def write(self, topic, payload, qos=0, retain=False, at=None):
+        """Record one message; at is seconds since the capture started (default: now)."""
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elapsed = self.clock() - self._start if at is None else at
+        micros = max(0, int(elapsed * 1_000_000))
+        with self._lock:
+            topic_id = self._topics.get(topic)
+            if topic_id is None:
+                topic_id = self._topics[topic] = len(self._topics)
+                name = topic.encode('utf-8')
+                self._file.write(_TOPIC.pack(_KIND_TOPIC, topic_id, len(name)) + name)
+            if self._count % self.index_every == 0:
+                self._index.append((self._count, micros, self._file.tell()))
+            self._file.write(_MESSAGE.pack(_KIND_MESSAGE, micros, topic_id, qos, bool(retain), len(payload)))
+            self._file.write(payload)
+            self._count += 1
+            self._last = max(self._last, micros)
+
+    def on_message(self, client, userdata, message):
+        """paho-style callback: capture everything the client is subscribed to."""
+        self.write(message.topic, message.payload, message.qos, message.retain)
+
+    @property
+    def count(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            index_offset = self._file.tell()
+            for entry in self._index:
+                self._file.write(_INDEX_ENTRY.pack(*entry))
+            for topic in self._topics:  # Insertion order is id order
+                name = topic.encode('utf-8')
+                self._file.write(_TOPIC_NAME.pack(len(name)) + name)
+            self._file.write(_FOOTER.pack(index_offset, len(self._index), len(self._topics), self._count,
+                                          self._last, _FOOTER_MAGIC))
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """Reads a capture back as CapturedMessage tuples, in the order they were recorded."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_FILE_HEADER.size)
+            if len(header) < _FILE_HEADER.size:
+                raise CaptureError(f"{path} is too short to be a capture")
+            magic, version, self.started_at = _FILE_HEADER.unpack(header)
+            if magic != _FILE_MAGIC or version != _VERSION:
+                raise CaptureError(f"{path} is not a version {_VERSION} capture")
+            self._index, self._topics, self.count, self.duration, self._end = self._read_footer(f)
+        self.indexed = self._index is not None
+
+    def _read_footer(self, f):
+        """Index, topic table, message count, duration and where the messages end; Nones if unindexed."""
+        size = f.seek(0, os.SEEK_END)
+        if size < _FILE_HEADER.size + _FOOTER.size:
+            return None, None, None, None, size
+        f.seek(size - _FOOTER.size)
+        index_offset, entries, topics, count, last, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != _FOOTER_MAGIC:
+            return None, None, None, None, size
+        f.seek(index_offset)
+        index = [_INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size)) for _ in range(entries)]
+        names = []
+        for _ in range(topics):
+            (length,) = _TOPIC_NAME.unpack(f.read(_TOPIC_NAME.size))
+            names.append(f.read(length).decode('utf-8'))
+        return index, names, count, last / 1_000_000, index_offset
+
+    def messages(self, start=0.0):
+        """Yield messages recorded at or after start seconds; the index lets this skip ahead."""
+        micros = int(start * 1_000_000)
+        topics = list(self._topics) if self._topics else []
+        offset = _FILE_HEADER.size
+        if self.indexed and micros and self._index:
+            position = bisect.bisect_right([entry[1] for entry in self._index], micros) - 1
+            if position > 0:
+                offset = self._index[position][2]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while f.tell() < self._end:
+                kind = f.read(1)
+                if not kind:
+                    break
+                if kind == _KIND_TOPIC:
+                    rest = f.read(_TOPIC.size - 1)
+                    if len(rest) < _TOPIC.size - 1:
+                        break
+                    _, topic_id, length = _TOPIC.unpack(kind + rest)
+                    name = f.read(length).decode('utf-8')
+                    if topic_id == len(topics):
+                        topics.append(name)
+                    continue
+                if kind != _KIND_MESSAGE:
+                    break  # Torn write at the end of a capture that was never closed
+                rest = f.read(_MESSAGE.size - 1)
+                if len(rest) < _MESSAGE.size - 1:
+                    break
+                _, at, topic_id, qos, retain, length = _MESSAGE.unpack(kind + rest)
+                payload = f.read(length)
+                if len(payload) < length or topic_id >= len(topics):
+                    break
+                if at >= micros:
+                    yield CapturedMessage(at / 1_000_000, topics[topic_id], qos, bool(retain), payload)
+
+    def __iter__(self):
+        return self.messages()
+
+    def summary(self):
+        """Message count, duration, bytes and message count per topic."""
+        per_topic = Counter()
+        count = last = 0
+        for message in self:
+            per_topic[message.topic] += 1
+            count += 1
+            last = message.time
+        return {'messages': count, 'duration': round(last, 3), 'bytes': os.path.getsize(self.path),
+                'indexed': self.indexed, 'topics': dict(per_topic.most_common())}
+
+
+def record(path, broker='localhost', port=1883, topics=('#',), seconds=None, transport=None):
+    """Capture everything published on topics until seconds have passed or Ctrl+C."""
+    from mqtt_transport import create_client
+    writer = CaptureWriter(path)
+    client = create_client('mqtt-capture', transport=transport)
+    client.on_message = writer.on_message
+    # QoS 2 subscriptions so each message is delivered with the QoS it was published at
+    client.on_connect = lambda c, userdata, flags, rc: c.subscribe([(topic, 2) for topic in topics])
+    client.connect(broker, port, 60)
+    client.loop_start()
+    try:
+        deadline = time.monotonic() + seconds if seconds else None
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1)
+            print(f"\r{writer.count} messages captured", end='', flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.disconnect()
+        client.loop_stop()
+        writer.close()
+    print(f"\nWrote {writer.count} messages to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record MQTT traffic to a capture file, or describe one")
+    commands = parser.add_subparsers(dest='command', required=True)
+    rec = commands.add_parser('record', help="Subscribe to every topic and write what is published")
+    rec.add_argument('path')
+    rec.add_argument('--broker', default='192.168.61.254')
+    rec.add_argument('--port', type=int, default=1883)
+    rec.add_argument('--topic', action='append', help="Subscription pattern, repeatable (default: #)")
+    rec.add_argument('--seconds', type=float, help="Stop after this long (default: until Ctrl+C)")
+    info = commands.add_parser('info', help="Message count, duration and topics of a capture")
+    info.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from mqtt_transport import broker_address
+        broker, port = broker_address(args.broker, args.port)
+        record(args.path, broker, port, args.topic or ('#',), args.seconds)
+        return
+    try:
+        summary = CaptureReader(args.path).summary()
+    except CaptureError as e:
+        sys.exit(str(e))
+    print(f"{summary['messages']} messages over {summary['duration']}s, {summary['bytes']} bytes"
+          f"{'' if summary['indexed'] else ' (not closed cleanly, no index)'}")
+    for topic, count in summary['topics'].items():
+        print(f"  {count:>8}  {topic}")
+
+
+if __name__ == "__main__":
+    main()
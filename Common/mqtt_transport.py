@@ -0,0 +1,584 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+
+# MQTT transport shared by the drivers, the Central Hub and the Flask dashboard.
+#
+# create_client() returns either a real paho client or an InProcessClient
+# attached to an InProcessBroker in the same process. Both expose the subset of
+# paho's (v1 callback) interface the nodes use, so the same code runs against
+# a broker on the network or, with MQTT_TRANSPORT=inprocess, entirely in one
+# process with no network: topic wildcards, QoS 1/2 acknowledgement and
+# retransmission, retained messages, persistent sessions, and injectable
+# latency, jitter, loss and disconnects.
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_CONN_LOST = 7
+TRANSPORTS = ('paho', 'inprocess')
+
+logger = logging.getLogger(__name__)
+
+
+def broker_address(host, port=1883):
+    """The broker a node connects to: MQTT_BROKER / MQTT_PORT override the node's own defaults."""
+    return os.environ.get('MQTT_BROKER', host), int(os.environ.get('MQTT_PORT', port))
+
+
+def create_client(client_id='', clean_session=True, userdata=None, transport=None, broker=None):
+    """New MQTT client for transport 'paho' or 'inprocess' (default: $MQTT_TRANSPORT, else paho).
+
+    broker picks the InProcessBroker an in-process client connects to; it defaults to
+    the process-wide default_broker().
+    """
+    transport = transport or os.environ.get('MQTT_TRANSPORT', 'paho')
+    if transport == 'inprocess':
+        return InProcessClient(client_id, clean_session=clean_session, userdata=userdata, broker=broker)
+    if transport != 'paho':
+        raise ValueError(f"Unknown MQTT transport '{transport}', expected one of {', '.join(TRANSPORTS)}")
+    import paho.mqtt.client as mqtt
+    kwargs = {}
+    if hasattr(mqtt, 'CallbackAPIVersion'):  # paho 2.x needs the callback signatures spelled out
+        kwargs['callback_api_version'] = mqtt.CallbackAPIVersion.VERSION1
+    return mqtt.Client(client_id=client_id, clean_session=clean_session, userdata=userdata, **kwargs)
+
+
+def topic_matches(pattern, topic):
+    """True if topic matches a subscription pattern with + and # wildcards."""
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return not topic.startswith('$') or i > 0
+        if i >= len(topic_parts):
+            return False
+        if part == '+':
+            if i == 0 and topic.startswith('$'):
+                return False
+        elif part != topic_parts[i]:
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def _to_bytes(payload):
+    if payload is None:
+        return b''
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+    if isinstance(payload, (int, float)):
+        return str(payload).encode('ascii')
+    raise TypeError("payload must be a string, bytearray, int, float or None")
+
+
+class MQTTMessage:
+    """What on_message receives; the same attributes as paho's MQTTMessage."""
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'mid', 'dup')
+
+    def __init__(self, topic, payload, qos=0, retain=False, mid=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+        self.dup = False
+
+
+class MessageInfo:
+    """Returned by publish(); set once the broker acknowledges (QoS 1/2) or the message is sent (QoS 0)."""
+    def __init__(self, mid, rc=MQTT_ERR_SUCCESS):
+        self.mid = mid
+        self.rc = rc
+        self._published = threading.Event()
+
+    def wait_for_publish(self, timeout=None):
+        if self.rc != MQTT_ERR_SUCCESS:
+            raise RuntimeError(f"Message publish failed: rc {self.rc}")
+        self._published.wait(timeout)
+
+    def is_published(self):
+        return self._published.is_set()
+
+
+class _Session:
+    """Broker-side state of one client id; kept across reconnects unless clean_session."""
+    def __init__(self, client):
+        self.client = client
+        self.subscriptions = {}  # pattern -> granted qos
+        self.pending = []        # QoS 1/2 messages queued while the client was away
+        self.received_qos2 = set()  # inbound QoS 2 mids routed but not yet completed
+        self.next_mid = itertools.count(1)
+
+
+class InProcessBroker:
+    """MQTT broker stand-in running on one delivery thread.
+
+    Every hop (client -> broker, broker -> client, and each acknowledgement)
+    is scheduled latency + uniform(0, jitter) seconds ahead and lost with
+    probability loss. Lost QoS 0 messages are gone; QoS 1/2 hops are resent
+    after retry_interval, so QoS 1 can arrive twice when an ack is lost and
+    QoS 2 is routed exactly once. With a seed the loss and jitter draws repeat
+    from run to run.
+    """
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, retry_interval=0.5, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.retry_interval = retry_interval
+        self.available = True
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._schedule = []  # heap of (due, seq, fn, args)
+        self._order = itertools.count()
+        self._sessions = {}  # client id -> _Session
+        self._retained = {}  # topic -> MQTTMessage
+        self._thread = None
+        self.stats = dict.fromkeys(('published', 'delivered', 'lost', 'retransmitted', 'duplicates'), 0)
+
+    # Fault injection
+
+    def set_faults(self, latency=None, jitter=None, loss=None):
+        with self._lock:
+            if latency is not None:
+                self.latency = latency
+            if jitter is not None:
+                self.jitter = jitter
+            if loss is not None:
+                self.loss = loss
+
+    def drop_client(self, client_id, rc=MQTT_ERR_CONN_LOST):
+        """Cut one client's connection as if the network failed; it sees on_disconnect(rc)."""
+        with self._lock:
+            session = self._sessions.get(client_id)
+            client = session.client if session else None
+        if client and client.is_connected():
+            client._connection_lost(rc)
+
+    def set_available(self, available):
+        """Take the broker down (dropping every client, refusing connects) or bring it back."""
+        with self._lock:
+            self.available = available
+            clients = [s.client for s in self._sessions.values() if s.client] if not available else []
+        for client in clients:
+            if client.is_connected():
+                client._connection_lost(MQTT_ERR_CONN_LOST)
+
+    def retained(self, topic):
+        with self._lock:
+            message = self._retained.get(topic)
+        return message.payload if message else None
+
+    # Delivery thread
+
+    def _delay(self):
+        return self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _lost(self):
+        if self.loss and self._rng.random() < self.loss:
+            self.stats['lost'] += 1
+            return True
+        return False
+
+    def _after(self, delay, fn, *args):
+        with self._lock:
+            heapq.heappush(self._schedule, (time.monotonic() + delay, next(self._order), fn, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mqtt-inprocess-broker', daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._schedule or self._schedule[0][0] > time.monotonic():
+                    self._wakeup.wait(self._schedule[0][0] - time.monotonic() if self._schedule else None)
+                _, _, fn, args = heapq.heappop(self._schedule)
+                try:
+                    fn(*args)
+                except Exception:
+                    logger.exception("In-process broker delivery failed")
+
+    # Client side of the protocol, called by InProcessClient
+
+    def _connect(self, client):
+        with self._lock:
+            if not self.available:
+                raise ConnectionRefusedError("in-process broker is unavailable")
+            session = self._sessions.get(client._client_id)
+            if session and session.client is not client and session.client and session.client.is_connected():
+                self._after(0, session.client._connection_lost, MQTT_ERR_CONN_LOST)  # Client id takeover
+            session_present = bool(session) and not client._clean_session
+            if not session_present:
+                session = self._sessions[client._client_id] = _Session(client)
+            session.client = client
+            pending, session.pending = session.pending, []
+        for message in pending:
+            self._after(self._delay(), self._deliver, session, client, message)
+        return session_present
+
+    def _disconnect(self, client):
+        with self._lock:
+            session = self._sessions.get(client._client_id)
+            if session and session.client is client and client._clean_session:
+                del self._sessions[client._client_id]
+
+    def _subscribe(self, client, subscriptions):
+        with self._lock:
+            session = self._sessions[client._client_id]
+            retained = []
+            for pattern, qos in subscriptions:
+                session.subscriptions[pattern] = qos
+                retained.extend((message, min(qos, message.qos)) for topic, message in self._retained.items()
+                                if topic_matches(pattern, topic))
+        for message, qos in retained:
+            copy = MQTTMessage(message.topic, message.payload, qos, retain=True)
+            self._after(self._delay(), self._deliver, session, client, copy)
+
+    def _unsubscribe(self, client, patterns):
+        with self._lock:
+            session = self._sessions.get(client._client_id)
+            for pattern in patterns:
+                if session:
+                    session.subscriptions.pop(pattern, None)
+
+    def _publish(self, client, message):
+        self._after(self._delay(), self._inbound, client, message)
+
+    def _inbound(self, client, message):
+        """PUBLISH reaching the broker."""
+        if not client.is_connected():
+            return  # Still in the client's inflight set; resent when it reconnects
+        if self._lost():
+            if message.qos:
+                self.stats['retransmitted'] += 1
+                self._after(self.retry_interval, self._inbound, client, message)
+            return
+        with self._lock:
+            session = self._sessions.get(client._client_id)
+            duplicate = message.qos == 2 and session is not None and message.mid in session.received_qos2
+            if message.qos == 2 and session is not None:
+                session.received_qos2.add(message.mid)
+        if duplicate:
+            self.stats['duplicates'] += 1
+        else:
+            self._route(message)
+        if message.qos:
+            self._after(self._delay(), self._acknowledge, client, message)
+
+    def _acknowledge(self, client, message):
+        """PUBACK (QoS 1) or PUBREC/PUBREL/PUBCOMP (QoS 2) reaching the client."""
+        if not client.is_connected():
+            return
+        if self._lost():
+            # The client never heard back, so it resends; QoS 1 is routed again, QoS 2 is not
+            self.stats['retransmitted'] += 1
+            self._after(self.retry_interval, self._inbound, client, message)
+            return
+        with self._lock:
+            session = self._sessions.get(client._client_id)
+            if session is not None:
+                session.received_qos2.discard(message.mid)
+        client._acknowledged(message.mid)
+
+    def _route(self, message):
+        with self._lock:
+            self.stats['published'] += 1
+            if message.retain:
+                if message.payload:
+                    self._retained[message.topic] = MQTTMessage(message.topic, message.payload, message.qos)
+                else:
+                    self._retained.pop(message.topic, None)
+            targets = []
+            for session in self._sessions.values():
+                granted = [qos for pattern, qos in session.subscriptions.items()
+                           if topic_matches(pattern, message.topic)]
+                if not granted:
+                    continue
+                qos = min(message.qos, max(granted))
+                copy = MQTTMessage(message.topic, message.payload, qos, mid=next(session.next_mid) if qos else 0)
+                client = session.client
+                if client and client.is_connected():
+                    targets.append((session, client, copy))
+                elif qos and not (client and client._clean_session):
+                    session.pending.append(copy)
+        for session, client, copy in targets:
+            self._after(self._delay(), self._deliver, session, client, copy)
+
+    def _deliver(self, session, client, message):
+        """PUBLISH reaching a subscriber."""
+        if not client.is_connected():
+            if message.qos and not client._clean_session:
+                with self._lock:
+                    session.pending.append(message)
+            return
+        if self._lost():
+            if message.qos:
+                self.stats['retransmitted'] += 1
+                self._after(self.retry_interval, self._deliver, session, client, message)
+            return
+        self.stats['delivered'] += 1
+        client._post(client._on_message_event, message)
+
+
+_default_broker = None
+_default_lock = threading.Lock()
+
+
+def default_broker():
+    """The InProcessBroker in-process clients use unless given another one."""
+    global _default_broker
+    with _default_lock:
+        if _default_broker is None:
+            _default_broker = InProcessBroker()
+        return _default_broker
+
+
+def reset_default_broker(**options):
+    """Replace the default broker with a fresh one (options as for InProcessBroker) and return it."""
+    global _default_broker
+    with _default_lock:
+        _default_broker = InProcessBroker(**options)
+        return _default_broker
+
+
+class InProcessClient:
+    """paho-compatible client for an InProcessBroker.
+
+    Callbacks run on whatever drives the client's network loop, as with paho:
+    loop_start()'s thread, loop_forever(), loop(), or loop_read() when an event
+    loop watches the socket handed to on_socket_open. The host and port given to
+    connect() are kept for reconnect() but do not select a broker.
+    """
+    def __init__(self, client_id='', clean_session=True, userdata=None, broker=None):
+        self._client_id = client_id or f"inprocess-{id(self):x}"
+        self._clean_session = clean_session
+        self._userdata = userdata
+        self._broker = broker
+        self._address = None
+        self.keepalive = 60
+        self.on_connect = self.on_disconnect = self.on_message = None
+        self.on_publish = self.on_subscribe = self.on_unsubscribe = None
+        self.on_socket_open = self.on_socket_close = None
+        self.on_socket_register_write = self.on_socket_unregister_write = None
+
+        self._lock = threading.Lock()
+        self._mids = itertools.count(1)
+        self._inflight = {}  # mid -> (MQTTMessage, MessageInfo) awaiting the broker's ack
+        self._events = queue.SimpleQueue()  # callbacks waiting for the network loop
+        self._connected = False
+        self._looping = False
+        self._loop_thread = None
+        self._sock = None
+        self._wake = None
+        self._will = None
+        self._topic_callbacks = {}  # subscription pattern -> callback, as message_callback_add
+
+    # Connection
+
+    def connect(self, host, port=1883, keepalive=60):
+        self._address = (host, port, keepalive)
+        self.keepalive = keepalive
+        broker = self._broker or default_broker()
+        self._broker = broker
+        session_present = broker._connect(self)
+        with self._lock:
+            self._connected = True
+            resend = [message for message, _ in self._inflight.values()]
+        if self.on_socket_open and self._sock is None:
+            # Lets an event loop watch the client like a paho socket; a byte arrives per queued callback
+            self._sock, self._wake = socket.socketpair()
+            self._sock.setblocking(False)
+            self._wake.setblocking(False)
+            self.on_socket_open(self, self._userdata, self._sock)
+        self._post(self._callback, 'on_connect', {'session present': int(session_present)}, 0)
+        for message in resend:
+            message.dup = True
+            broker._publish(self, message)
+        return MQTT_ERR_SUCCESS
+
+    def reconnect(self):
+        if self._address is None:
+            raise ValueError("reconnect() called before connect()")
+        return self.connect(*self._address)
+
+    def disconnect(self):
+        was_connected = self._connected
+        self._connected = False
+        self._looping = False
+        if self._broker:
+            self._broker._disconnect(self)
+        if was_connected:
+            self._post(self._callback, 'on_disconnect', 0)
+        return MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self._connected
+
+    def will_set(self, topic, payload=None, qos=0, retain=False):
+        """Message the broker publishes for this client if its connection is lost rather than closed."""
+        self._will = MQTTMessage(topic, _to_bytes(payload), qos, retain)
+
+    def will_clear(self):
+        self._will = None
+
+    def max_inflight_messages_set(self, inflight):
+        """Accepted for paho compatibility; the in-process broker takes any number of unacknowledged publishes."""
+
+    def _connection_lost(self, rc):
+        self._connected = False
+        if self._will and self._broker:
+            self._broker._after(self._broker._delay(), self._broker._route, self._will)
+        self._post(self._callback, 'on_disconnect', rc)
+
+    # Messaging
+
+    def subscribe(self, topic, qos=0):
+        subscriptions = topic if isinstance(topic, list) else [(topic, qos)]
+        if not self._connected:
+            return MQTT_ERR_NO_CONN, None
+        mid = next(self._mids)
+        self._broker._subscribe(self, subscriptions)
+        self._post(self._callback, 'on_subscribe', mid, tuple(qos for _, qos in subscriptions))
+        return MQTT_ERR_SUCCESS, mid
+
+    def unsubscribe(self, topic):
+        if not self._connected:
+            return MQTT_ERR_NO_CONN, None
+        mid = next(self._mids)
+        self._broker._unsubscribe(self, topic if isinstance(topic, list) else [topic])
+        self._post(self._callback, 'on_unsubscribe', mid)
+        return MQTT_ERR_SUCCESS, mid
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        mid = next(self._mids)
+        message = MQTTMessage(topic, _to_bytes(payload), qos, retain, mid)
+        info = MessageInfo(mid)
+        if qos:
+            with self._lock:
+                self._inflight[mid] = (message, info)  # Resent on reconnect until acknowledged
+        if not self._connected:
+            info.rc = MQTT_ERR_NO_CONN
+            return info
+        self._broker._publish(self, message)
+        if not qos:
+            self._post(self._published, mid, info)
+        return info
+
+    def _acknowledged(self, mid):
+        with self._lock:
+            entry = self._inflight.pop(mid, None)
+        if entry:
+            self._post(self._published, mid, entry[1])
+
+    def _published(self, mid, info):
+        info._published.set()
+        self._callback('on_publish', mid)
+
+    def message_callback_add(self, sub, callback):
+        """Send messages matching sub to callback instead of on_message."""
+        self._topic_callbacks[sub] = callback
+
+    def message_callback_remove(self, sub):
+        self._topic_callbacks.pop(sub, None)
+
+    def _on_message_event(self, message):
+        matched = False
+        for pattern, callback in list(self._topic_callbacks.items()):
+            if topic_matches(pattern, message.topic):
+                matched = True
+                callback(self, self._userdata, message)
+        if not matched:
+            self._callback('on_message', message)
+
+    def _callback(self, name, *args):
+        callback = getattr(self, name)
+        if callback:
+            callback(self, self._userdata, *args)
+
+    # Network loop
+
+    def _post(self, fn, *args):
+        self._events.put((fn, args))
+        wake = self._wake
+        if wake is not None:
+            try:
+                wake.send(b'\0')
+            except (BlockingIOError, OSError):
+                pass  # Socket buffer full: the reader is already behind and will drain the queue
+
+    def _run_events(self):
+        ran = 0
+        while True:
+            try:
+                fn, args = self._events.get_nowait()
+            except queue.Empty:
+                return ran
+            ran += 1
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception(f"Callback error in {self._client_id}")
+
+    def loop(self, timeout=1.0):
+        try:
+            fn, args = self._events.get(timeout=timeout)
+        except queue.Empty:
+            return MQTT_ERR_SUCCESS
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"Callback error in {self._client_id}")
+        self._run_events()
+        return MQTT_ERR_SUCCESS
+
+    def loop_forever(self, timeout=1.0, retry_first_connection=False):
+        self._looping = True
+        while self._looping:
+            self.loop(timeout)
+        self._run_events()  # on_disconnect from disconnect()
+        return MQTT_ERR_SUCCESS
+
+    def loop_start(self):
+        if self._loop_thread is not None:
+            return MQTT_ERR_SUCCESS
+        self._looping = True
+        self._loop_thread = threading.Thread(target=self.loop_forever, name=f"mqtt-loop-{self._client_id}",
+                                             daemon=True)
+        self._loop_thread.start()
+        return MQTT_ERR_SUCCESS
+
+    def loop_stop(self, force=False):
+        if self._loop_thread is None:
+            return MQTT_ERR_SUCCESS
+        self._looping = False
+        if self._loop_thread is not threading.current_thread():
+            self._loop_thread.join()
+        self._loop_thread = None
+        return MQTT_ERR_SUCCESS
+
+    def loop_read(self, max_packets=1):
+        if self._sock is not None:
+            try:
+                while self._sock.recv(4096):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+        self._run_events()
+        return MQTT_ERR_SUCCESS
+
+    def loop_write(self, max_packets=1):
+        return MQTT_ERR_SUCCESS
+
+    def loop_misc(self):
+        return MQTT_ERR_SUCCESS if self._connected else MQTT_ERR_NO_CONN
+
+    def want_write(self):
+        return False
@@ -0,0 +1,150 @@
+import threading
+from collections import namedtuple
+
+# Topic routing shared by the Central Hub and the Flask dashboard.
+#
+# A TopicRouter holds routes: a subscription pattern and whatever should
+# receive the matching messages (a handler, or a key such as the hub's
+# message kind). Patterns are compiled into a trie with one level per topic
+# level, so matching a topic walks its levels once, trying the literal, '+'
+# and '#' branches at each, however many routes are registered. Results are
+# cached per topic.
+#
+# A '+' level may be named, 'ward/{ward}/bed/{bed}/audio/emergency', and the
+# level it matched is captured under that name; the router subscribes to it
+# as a plain '+'. A trailing '#' captures the rest of the topic under '#'.
+
+Route = namedtuple('Route', 'target pattern params')
+
+_HASH = '#'
+_PLUS = '+'
+
+
+class _Node:
+    __slots__ = ('children', 'plus', 'hash', 'routes')
+
+    def __init__(self):
+        self.children = {}
+        self.plus = None  # Child for '+'
+        self.hash = []    # Routes ending in '#' at this level
+        self.routes = []  # Routes ending exactly here
+
+
+def compile_pattern(pattern):
+    """Split pattern into levels and capture names; returns (MQTT subscription, levels, names).
+
+    Raises ValueError for wildcards that do not fill a whole level, a '#'
+    that is not last, or a capture name used twice.
+    """
+    levels, names, seen = [], [], set()
+    parts = pattern.split('/')
+    for i, part in enumerate(parts):
+        name = None
+        if part.startswith('{') and part.endswith('}'):
+            name, part = part[1:-1], _PLUS
+            if not name or name in seen:
+                raise ValueError(f"Bad capture '{{{name}}}' in topic pattern '{pattern}'")
+            seen.add(name)
+        elif part == _HASH:
+            if i != len(parts) - 1:
+                raise ValueError(f"'#' must be the last level of topic pattern '{pattern}'")
+            name = _HASH
+        elif part != _PLUS and (_PLUS in part or _HASH in part or '{' in part or '}' in part):
+            raise ValueError(f"Wildcard must fill a whole level in topic pattern '{pattern}'")
+        levels.append(part)
+        names.append(name)
+    return '/'.join(levels), levels, names
+
+
+class TopicRouter:
+    """Routes topics to targets registered against MQTT subscription patterns.
+
+    match(topic) returns every Route whose pattern covers topic, in the
+    order the routes were added, each with the levels its named wildcards
+    captured. dispatch(topic, *args) calls each target with
+    (*args, **params). A topic costs one walk of its levels the first time
+    and one dict lookup after that; the cache holds cache_size topics (0
+    turns it off).
+    """
+    def __init__(self, cache_size=8192):
+        self.cache_size = cache_size
+        self._root = _Node()
+        self._subscriptions = {}  # MQTT subscription -> highest QoS asked for
+        self._routes = []         # Every route, in the order added
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def add(self, pattern, target, qos=0):
+        """Route topics matching pattern to target; returns the MQTT subscription to make for it."""
+        subscription, levels, names = compile_pattern(pattern)
+        with self._lock:
+            # What the trie stores: position added, target, pattern and the names of its wildcards in order
+            route = (len(self._routes), target, pattern,
+                     tuple(name for level, name in zip(levels, names) if level in (_PLUS, _HASH)))
+            node = self._root
+            for level in levels:
+                if level == _HASH:
+                    node.hash.append(route)
+                    break
+                if level == _PLUS:
+                    if node.plus is None:
+                        node.plus = _Node()
+                    node = node.plus
+                else:
+                    node = node.children.setdefault(level, _Node())
+            else:
+                node.routes.append(route)
+            self._routes.append(route)
+            self._subscriptions[subscription] = max(qos, self._subscriptions.get(subscription, 0))
+            self._cache = {}
+        return subscription
+
+    def subscriptions(self):
+        """(subscription, qos) pairs covering every route, for client.subscribe()."""
+        return list(self._subscriptions.items())
+
+    def __len__(self):
+        return len(self._routes)
+
+    def match(self, topic):
+        """Routes for topic, each with the captured levels as params; do not modify the result."""
+        cache = self._cache
+        routes = cache.get(topic)
+        if routes is None:
+            routes = self._walk(topic)
+            if self.cache_size:
+                if len(cache) >= self.cache_size:
+                    cache.clear()
+                cache[topic] = routes
+        return routes
+
+    def dispatch(self, topic, *args):
+        """Call every target routed to topic with (*args, **params); returns how many were called."""
+        routes = self.match(topic)
+        for route in routes:
+            route.target(*args, **route.params)
+        return len(routes)
+
+    def _walk(self, topic):
+        levels = topic.split('/')
+        system = topic.startswith('$')  # Wildcards at the first level never match $SYS and friends
+        found = []
+        stack = [(self._root, 0, ())]
+        while stack:
+            node, depth, captured = stack.pop()
+            wild = not (system and depth == 0)
+            if node.hash and wild:
+                rest = '/'.join(levels[depth:])
+                found.extend((route, captured + (rest,)) for route in node.hash)
+            if depth == len(levels):
+                found.extend((route, captured) for route in node.routes)
+                continue
+            level = levels[depth]
+            child = node.children.get(level)
+            if child is not None:
+                stack.append((child, depth + 1, captured))
+            if node.plus is not None and wild:
+                stack.append((node.plus, depth + 1, captured + (level,)))
+        found.sort(key=lambda item: item[0][0])
+        return tuple(Route(target, pattern, {name: value for name, value in zip(names, captured) if name})
+                     for (_, target, pattern, names), captured in found)
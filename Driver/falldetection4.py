@@ -2,15 +2,19 @@ import cv2
 import mediapipe as mp
 import math
 import time
-import paho.mqtt.client as mqtt
 from datetime import datetime
-import json
 import socketio
-import base64
 import threading
 import sys
+import os
 from concurrent.futures import ThreadPoolExecutor
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from alert_schema import FALLEN_OUT_OF_BED, FallAlert, bed_topic, decode_message, set_default_codec
+from mqtt_transport import broker_address, create_client
+from flow_control import FlowGovernor
+from latency_trace import FRAME, ClockSync, start_trace, stamp
+
 # WebSocket client setup
 sio = socketio.Client()
 try:
@@ -35,9 +39,14 @@ KEYPOINTS = {
 }
 
 # MQTT Configuration
-MQTT_BROKER = "192.168.61.254"
-MQTT_PORT = 1883
-MQTT_TOPIC = "video/emergency"
+MQTT_BROKER, MQTT_PORT = broker_address("192.168.61.254", 1883)  # MQTT_BROKER / MQTT_PORT env override
+WARD_ID = "1"  # Ward and bed this camera watches; set both to None for the single-bed topics
+BED_ID = "1"
+MQTT_TOPIC = bed_topic(WARD_ID, BED_ID, "video/emergency")
+MONITOR_TOPIC = bed_topic(WARD_ID, BED_ID, "video/monitor")
+MESSAGE_CODEC = "json"  # json, msgpack or cbor; the hub reads all three
+set_default_codec(MESSAGE_CODEC)
+FALL_REPEAT_SECONDS = 1.0  # While the hub is under load, repeat an ongoing fall this often instead of every frame
 
 # Camera control flag
 camera_active = False
@@ -54,22 +63,18 @@ def stop_video_after_timeout():
     with video_timer_lock:
         camera_active = False
         print("Camera deactivated after 10 seconds timeout")
-        camerastate_data = {
-            "timestamp": datetime.now().isoformat(),
-            "source": "video",
-            "cameraState": camera_active
-        }
-        executor.submit(client.publish, MQTT_TOPIC, json.dumps(camerastate_data), 2)
+        camerastate_data = FallAlert(datetime.now().isoformat(), "video", camera_state=camera_active)
+        executor.submit(client.publish, MQTT_TOPIC, camerastate_data.encode(), 2)
 
 # MQTT subscriber setup
 def on_message(client, userdata, message):
     global camera_active, video_timer
     try:
-        payload = json.loads(message.payload.decode('utf-8'))
-        if message.topic == "video/monitor":
+        if message.topic == MONITOR_TOPIC:
+            command = decode_message(message.topic, message.payload)
             with camera_state_lock:
-                source = payload.get('source', '')
-                activate = payload.get('activate', False)
+                source = command.source
+                activate = command.activate
 
                 # ✅ Ignore activation if already active
                 if activate and camera_active:
@@ -108,33 +113,32 @@ def on_message(client, userdata, message):
 
                     # Publish the camera activation state after it has been updated                    
                     #print("camera_activate State", camera_active)
-                    camerastate_data = {
-                        'timestamp': datetime.now().isoformat(),
-                        'source': source,
-                        'cameraState': camera_active
-                    }
-                    executor.submit(client.publish, MQTT_TOPIC, json.dumps(camerastate_data), 2)
+                    camerastate_data = FallAlert(datetime.now().isoformat(), source, camera_state=camera_active)
+                    executor.submit(client.publish, MQTT_TOPIC, camerastate_data.encode(), 2)
                 else:
                     # Publish deactivation message if camera is deactivated
-                    camerastate_data = {
-                        'timestamp': datetime.now().isoformat(),
-                        'source': source,
-                        'cameraState': camera_active
-                    }
-                    executor.submit(client.publish, MQTT_TOPIC, json.dumps(camerastate_data), 2)
+                    camerastate_data = FallAlert(datetime.now().isoformat(), source, camera_state=camera_active)
+                    executor.submit(client.publish, MQTT_TOPIC, camerastate_data.encode(), 2)
     except Exception as e:
         print(f"Error processing MQTT message: {e}")
 
 
-# Initialize MQTT client
-client = mqtt.Client()
+# Initialize MQTT client; MQTT_TRANSPORT=inprocess runs it against the in-process broker
+client = create_client()
 client.on_message = on_message
-try:
-    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-    client.subscribe("video/monitor")
-    client.loop_start()
-except Exception as e:
-    print(f"Failed to connect to MQTT broker: {e}")
+flow = FlowGovernor()  # Follows the hub's load level on hub/flow
+clock = ClockSync(f"video-{WARD_ID}-{BED_ID}")  # Offset from the hub's clock, for latency traces
+
+
+def connect_mqtt():
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        client.subscribe(MONITOR_TOPIC)
+        flow.subscribe(client)
+        clock.subscribe(client)
+        client.loop_start()
+    except Exception as e:
+        print(f"Failed to connect to MQTT broker: {e}")
 
 # Function to calculate angle between three points
 def calculate_angle(a, b, c):
@@ -200,6 +204,7 @@ def generate_frames():
 
             try:
                 ret, frame = cap.read()
+                captured_at = clock.now()
                 if not ret:
                     print("Error: Failed to capture frame")
                     continue
@@ -255,19 +260,16 @@ def generate_frames():
 
                     mqttDataMP = state_mediapipe
 
-                if mqttDataMP == "Fallen out of bed":
-                    mqtt_data = {
-                        "timestamp": datetime.now().isoformat(),
-                        "mediapipe_state": mqttDataMP,
-                        "source": "video",
-                    }
-                    executor.submit(client.publish, MQTT_TOPIC, json.dumps(mqtt_data), 2)
+                if mqttDataMP == FALLEN_OUT_OF_BED and flow.should_send(MQTT_TOPIC, mqttDataMP, FALL_REPEAT_SECONDS):
+                    trace = stamp(start_trace(FRAME, captured_at), 'sent', clock.now())
+                    mqtt_data = FallAlert(datetime.now().isoformat(), "video", mediapipe_state=mqttDataMP, trace=trace)
+                    executor.submit(client.publish, MQTT_TOPIC, mqtt_data.encode(), 2)
                     print(f"Fall alert sent via MQTT: State={mqttDataMP}")
 
                 if sio.connected:
+                    # Sent as a binary Socket.IO attachment: base64 would add a third to every frame
                     _, jpeg = cv2.imencode('.jpg', frame)
-                    encoded_frame = base64.b64encode(jpeg).decode('utf-8')
-                    executor.submit(sio.emit, 'video_frame', encoded_frame)               
+                    executor.submit(sio.emit, 'video_frame', jpeg.tobytes())
 
             except Exception as e:
                 print(f"Error processing frame: {e}")
@@ -283,4 +285,5 @@ def generate_frames():
             time.sleep(1)
 
 if __name__ == "__main__":
+    connect_mqtt()
     generate_frames()
@@ -1,20 +1,33 @@
 from gpiozero import DistanceSensor
 from time import sleep, time
-import paho.mqtt.client as mqtt
-import json
+import os
+import sys
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from alert_schema import ProximityReading, bed_topic, set_default_codec
+from mqtt_transport import broker_address, create_client
+from flow_control import FlowGovernor
+from latency_trace import READING, ClockSync, start_trace, stamp
+
 # Configuration
-mqtt_broker = "localhost" #Change to broker ip
-mqtt_port = 1883
+mqtt_broker, mqtt_port = broker_address("localhost", 1883)  # Change to broker ip, or set MQTT_BROKER / MQTT_PORT
+ward_id = "1"  # Ward and bed these sensors are fitted to; set both to None for the single-bed topics
+bed_id = "1"
+mqtt_topic = bed_topic(ward_id, bed_id, "proximity/alert")
+message_codec = "json"  # json, msgpack or cbor; the hub reads all three
+set_default_codec(message_codec)
 DISTANCE_THRESHOLD = 0.35  
 PUBLISH_INTERVAL = 5.0    # Seconds between readings
+IN_BED_REPEAT = 10.0      # While the hub is under load, seconds between unchanged in-bed readings
 MAX_CONSECUTIVE_ERRORS = 3  # Number of errors before attempting restart
 SENSOR_ERROR_DELAY = 2.0    # Seconds to wait after sensor error
 ERROR_THRESHOLD = float('inf')  # Value returned on error
 
-# Initialize MQTT client
-client = mqtt.Client()
+# Initialize MQTT client; MQTT_TRANSPORT=inprocess runs it against the in-process broker
+client = create_client()
+flow = FlowGovernor()  # Follows the hub's load level on hub/flow
+clock = ClockSync(f"proximity-{ward_id}-{bed_id}")  # Offset from the hub's clock, for latency traces
 
 def on_connect(client, userdata, flags, rc):
     """MQTT Connection Callback"""
@@ -27,6 +40,9 @@ def on_connect(client, userdata, flags, rc):
         5: "Not authorized"
     }
     print(f"Connected with result code: {connection_codes.get(rc, 'Unknown error')}")
+    if rc == 0:
+        flow.subscribe(client)
+        clock.subscribe(client)
 
 def on_disconnect(client, userdata, rc):
     """Handle disconnections"""
@@ -38,11 +54,14 @@ def on_disconnect(client, userdata, rc):
         except Exception as e:
             print(f"Reconnection failed: {e}")
 
-def publish_data(sensor_data):
+client.on_connect = on_connect
+client.on_disconnect = on_disconnect
+
+def publish_data(sensor_data, qos=2):
     """Send data to MQTT broker"""
     try:
         # Store result of publish
-        result = client.publish("proximity/alert", json.dumps(sensor_data),qos=2)
+        result = client.publish(mqtt_topic, sensor_data.encode(), qos=qos)
         
         # Wait for publish to complete
         result.wait_for_publish()
@@ -117,6 +136,7 @@ if __name__ == "__main__":
             # Don't exit, let it try to reconnect
 
         last_publish_time = 0
+        last_out_of_bed = None
         error_count = 0
 
         while True:
@@ -125,6 +145,7 @@ if __name__ == "__main__":
                 
                 if current_time - last_publish_time >= PUBLISH_INTERVAL:
                     # Get raw distances with improved error handling
+                    read_at = clock.now()
                     d1 = get_safe_distance(ultrasonic1, "Head sensor")
                     d2 = get_safe_distance(ultrasonic2, "Foot sensor")
                     d3 = get_safe_distance(ultrasonic3, "Side sensor")
@@ -149,21 +170,23 @@ if __name__ == "__main__":
                     out_of_bed = check_bed_occupancy(d1, d2, d3)
                     distances_cm = [round(d * 100, 2) for d in [d1, d2, d3]]
                     timestamp = datetime.now().isoformat()
-                    sensor_data = {
-                        "out_of_bed": out_of_bed,
-                        "distances": distances_cm,
-                        "timestamp": timestamp,
-                        "source": "proximity"
-                    }
+                    trace = stamp(start_trace(READING, read_at), 'sent', clock.now())
+                    sensor_data = ProximityReading(timestamp, out_of_bed, distances_cm, trace=trace)
 
                     # Print sensor readings immediately
                     print(f"Distances: {[f'{d:.1f}' for d in distances_cm]} cm")
                     print(f"Out of bed: {out_of_bed}")
                     print(f"Timestamp: {timestamp}")
 
-                    # Then attempt to publish
-                    if publish_data(sensor_data):
+                    # Under hub load, unchanged in-bed readings are thinned out and sent at QoS 0;
+                    # out-of-bed readings and changes of state always go at QoS 2
+                    changed = out_of_bed != last_out_of_bed
+                    if not flow.should_send(mqtt_topic, out_of_bed, IN_BED_REPEAT) and not out_of_bed:
+                        print(f"Reading held back: hub load {flow.level}")
+                        last_publish_time = current_time
+                    elif publish_data(sensor_data, 2 if changed or out_of_bed else flow.qos('LOW', 2)):
                         last_publish_time = current_time
+                        last_out_of_bed = out_of_bed
                     else:
                         print("! Will retry on next interval")
                         # Don't update last_publish_time so it retries immediately next loop
@@ -10,20 +10,32 @@ from vosk import Model, KaldiRecognizer
 import json
 import threading
 import os
-import paho.mqtt.client as mqtt
+import sys
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from alert_schema import AudioAlert, bed_topic, set_default_codec
+from mqtt_transport import broker_address, create_client
+from flow_control import FlowGovernor
+from latency_trace import AUDIO_CHUNK, ClockSync, start_trace, stamp
+
 warnings.filterwarnings("ignore", category=UserWarning)
 
 # MQTT Configuration
-MQTT_BROKER = "192.168.61.254"
-MQTT_PORT = 1883
-MQTT_TOPIC = "audio/emergency"
+MQTT_BROKER, MQTT_PORT = broker_address("192.168.61.254", 1883)  # MQTT_BROKER / MQTT_PORT env override
+WARD_ID = "1"  # Ward and bed this microphone covers; set both to None for the single-bed topics
+BED_ID = "1"
+MQTT_TOPIC = bed_topic(WARD_ID, BED_ID, "audio/emergency")
 MQTT_BUFFER_SECONDS = 30  # Buffer time between MQTT messages
+MESSAGE_CODEC = "json"  # json, msgpack or cbor; the hub reads all three
+set_default_codec(MESSAGE_CODEC)
 
-# Initialize MQTT client
-client = mqtt.Client()
+# Initialize MQTT client; MQTT_TRANSPORT=inprocess runs it against the in-process broker
+client = create_client()
+flow = FlowGovernor()  # Follows the hub's load level on hub/flow
+clock = ClockSync(f"audio-{WARD_ID}-{BED_ID}")  # Offset from the hub's clock, for latency traces
 last_mqtt_time = 0  # Track last MQTT send time globally
+URGENT_ALERTS = ("Urgent Assistance", "Pain/Discomfort")  # HIGH at the hub, never held back for load
 
 # MQTT Callbacks
 def on_connect(client, userdata, flags, rc):
@@ -36,6 +48,9 @@ def on_connect(client, userdata, flags, rc):
         5: "Not authorized"
     }
     print(f"Connected with result code: {connection_codes.get(rc, 'Unknown error')}")
+    if rc == 0:
+        flow.subscribe(client)
+        clock.subscribe(client)
 
 def on_disconnect(client, userdata, rc):
     if rc != 0:
@@ -48,30 +63,29 @@ def on_disconnect(client, userdata, rc):
 client.on_connect = on_connect
 client.on_disconnect = on_disconnect
 
-try:
-    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-    client.loop_start()
-except Exception as e:
-    print(f"Failed to connect to MQTT broker: {e}")
+def connect_mqtt():
+    try:
+        client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_start()
+    except Exception as e:
+        print(f"Failed to connect to MQTT broker: {e}")
 
-def send_mqtt_alert(class_id, confidence, detected_phrase=""):
-    """Send alert to MQTT broker with buffer time"""
+def send_mqtt_alert(class_id, confidence, detected_phrase="", recorded_at=None):
+    """Send alert to MQTT broker with buffer time; recorded_at (hub clock) starts its latency trace"""
     global last_mqtt_time
     current_time = time.time()
+    # The buffer stretches while the hub is under load, except for urgent calls
+    buffer_seconds = MQTT_BUFFER_SECONDS if CLASS_LABELS[class_id] in URGENT_ALERTS else flow.interval(MQTT_BUFFER_SECONDS)
 
-    if current_time - last_mqtt_time < MQTT_BUFFER_SECONDS:
-        print(f"MQTT message blocked: Waiting {MQTT_BUFFER_SECONDS - (current_time - last_mqtt_time):.1f}s for buffer")
+    if current_time - last_mqtt_time < buffer_seconds:
+        print(f"MQTT message blocked: Waiting {buffer_seconds - (current_time - last_mqtt_time):.1f}s for buffer")
         return False
 
-    alert_data = {
-        "timestamp": datetime.now().isoformat(),
-        "alert_type": CLASS_LABELS[class_id],
-        "confidence": float(confidence),
-        "phrase": detected_phrase,
-        "source": "audio"
-    }
+    trace = stamp(start_trace(AUDIO_CHUNK, recorded_at), 'sent', clock.now()) if recorded_at else None
+    alert_data = AudioAlert(datetime.now().isoformat(), CLASS_LABELS[class_id], float(confidence), detected_phrase,
+                            trace=trace)
     try:
-        result = client.publish(MQTT_TOPIC, json.dumps(alert_data), qos=2)
+        result = client.publish(MQTT_TOPIC, alert_data.encode(), qos=2)
         result.wait_for_publish()
         if result.is_published():
             print(f"MQTT Alert successfully published")
@@ -161,7 +175,7 @@ def audio_processing_thread():
     last_trigger_time = 0
     while True:
         try:
-            audio = audio_queue.get()
+            audio, recorded_at = audio_queue.get()
             start_time = time.time()
 
             if np.sqrt(np.mean(audio ** 2)) < 0.005:
@@ -197,20 +211,21 @@ def audio_processing_thread():
                 # Case 1: Both TFLite and Vosk detect something
                 if tflite_class is not None and vosk_text and any(keyword in vosk_text for keyword in KEYWORDS):
                     print(f"Both models agree! TFLite: {CLASS_LABELS[tflite_class]}, Vosk: {vosk_text}")
-                    if send_mqtt_alert(tflite_class, tflite_confidence, vosk_text):
+                    if send_mqtt_alert(tflite_class, tflite_confidence, vosk_text, recorded_at):
                         last_trigger_time = current_time
 
                 # Case 2: Only Vosk detects a keyword (TFLite missed)
                 elif vosk_text and any(keyword in vosk_text for keyword in KEYWORDS) and tflite_class is None:
                     print(f"Vosk-only detection: {vosk_text}")
-                    if send_mqtt_alert(3, 0.75, vosk_text):  # Default to "Urgent Assistance"
+                    if send_mqtt_alert(3, 0.75, vosk_text, recorded_at):  # Default to "Urgent Assistance"
                         last_trigger_time = current_time
 
                 # Case 3: Only TFLite detects (less reliable due to sensitivity)
                 elif tflite_class is not None and not vosk_text:
                     print(f"TFLite-only detection (no Vosk confirmation), lowering confidence")
                     adjusted_confidence = tflite_confidence * 0.8  # Reduce confidence
-                    if adjusted_confidence >= TFLITE_THRESHOLD and send_mqtt_alert(tflite_class, adjusted_confidence):
+                    if adjusted_confidence >= TFLITE_THRESHOLD and \
+                            send_mqtt_alert(tflite_class, adjusted_confidence, recorded_at=recorded_at):
                         last_trigger_time = current_time
 
             print(f"Processing time: {1000 * (time.time() - start_time):.1f}ms")
@@ -221,7 +236,8 @@ def audio_processing_thread():
 
 # Audio Callback
 def audio_callback(indata, frames, time, status):
-    audio_queue.put(indata.copy().flatten())
+    # Stamped as the chunk finishes recording, so the trace includes its wait in the queue
+    audio_queue.put((indata.copy().flatten(), clock.now()))
 
 # Main Function
 def main():
@@ -241,4 +257,5 @@ def main():
             print("Stopping...")
 
 if __name__ == "__main__":
+    connect_mqtt()
     main()
\ No newline at end of file
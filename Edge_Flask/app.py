@@ -3,119 +3,137 @@ import eventlet
 # Monkey patching must come first to enable non-blocking I/O
 eventlet.monkey_patch()
 
-from collections import deque
 from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, join_room
 import json
-import paho.mqtt.client as mqtt  # MQTT temporarily disabled
+import os
+import sys
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Common'))
+from alert_schema import CameraActivation, decode_message
+from frame_fanout import FrameFanout
+from latency_trace import ClockSync, TraceRecorder, stamp
+from mqtt_transport import broker_address, create_client
+from topic_router import TopicRouter
+
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins='*')
 
-# Store latest frame from WebSocket camera
-latest_frame = ""
-
-# List to store received notifications (for rendering on page load)
-notifications = []
-
-# Store latest data for dashboard with larger capacity
-dashboard_data = {
-    'alerts': {
-        'high_priority': deque(maxlen=100),
-        'medium_priority': deque(maxlen=200),
-        'low_priority': deque(maxlen=500)
-    },
-    'current_states': {
-        'video': {
-            'details': None,
-            'last_updated': None
-        },
-        'audio': {
-            'details': None,
-            'confidence': None,
-            'last_detection': None
-        },
-        'proximity': {
-            'distances': [],
-            'out_of_bed': False,
-            'last_reading': None
-        }
-    },
-    'patient_status': 'Normal',
-    'room_number': '101'
-}
-
-# Helper function to add alerts into dashboard_data structure
-def add_alert(alert_data):
-    priority = alert_data.get('priority', 'LOW').upper()
-    source = alert_data.get('source', '')
-    # Update current sensor state
-    if source == 'video':
-        dashboard_data['current_states']['video'].update({
-            'details': alert_data.get('details'),
-            'last_updated': alert_data.get('timestamp')
-        })
-    elif source == 'audio':
-        dashboard_data['current_states']['audio'].update({
-            'details': alert_data.get('details'),
-            'confidence': alert_data.get('confidence'),
-            'last_detection': alert_data.get('timestamp')
-        })
-    elif source == 'proximity':
-        dashboard_data['current_states']['proximity'].update({
-            'distances': alert_data.get('distances', []),
-            'out_of_bed': alert_data.get('out_of_bed', False),
-            'last_reading': alert_data.get('timestamp')
-        })
-
-    # Add alert to appropriate queue
-    if priority == 'HIGH':
-        dashboard_data['alerts']['high_priority'].appendleft(alert_data)
-    elif priority == 'MEDIUM':
-        dashboard_data['alerts']['medium_priority'].appendleft(alert_data)
-    else:
-        dashboard_data['alerts']['low_priority'].appendleft(alert_data)
-
-# MQTT client setup
-mqtt_client = mqtt.Client()
-
-
-patient_names = ["Alice Tan"]
-room_numbers = ["Room 101"]
+# Latest JPEG frame from the WebSocket camera, as bytes (base64 text from older drivers)
+latest_frame = None
+
+# Seconds a viewer has to ack a frame before it is sent the next one anyway
+FRAME_ACK_TIMEOUT = float(os.environ.get('FRAME_ACK_TIMEOUT', 2.0))
+
+
+def send_frame(sid, frame, ack):
+    socketio.emit('update_frame', frame, to=sid, callback=ack)
+
+
+# One mailbox per viewing browser, so each gets the newest frame at its own pace; served at /frames
+frames = FrameFanout(send_frame, ack_timeout=FRAME_ACK_TIMEOUT)
+
+
+def expire_frame_acks():
+    # Lost acks are otherwise only noticed when the camera sends another frame
+    while True:
+        socketio.sleep(FRAME_ACK_TIMEOUT)
+        frames.expire()
+
+# MQTT client setup; MQTT_TRANSPORT=inprocess runs it against the in-process broker
+mqtt_client = create_client()
+MQTT_BROKER, MQTT_PORT = broker_address("192.168.61.254", 1883)  # MQTT_BROKER / MQTT_PORT env override
+
+# Patient and room for each bed, keyed by "<ward>/<bed>" ("default" for the single-bed topics)
+BEDS_FILE = os.environ.get('BEDS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'beds.json'))
+
+
+def load_bed_directory(path=BEDS_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"No bed directory at {path}; showing bed ids instead of patient names")
+        return {}
+
+
+bed_directory = load_bed_directory()
+
+# Latest state per bed, updated as alerts arrive; served at /beds
+bed_states = {}
+
+# Sensor-to-screen latency of traced alerts, on the hub's clock; served at /latency
+clock = ClockSync('dashboard')
+traces = TraceRecorder()
+
+
+def bed_id_for(ward, bed):
+    return 'default' if ward is None else f"{ward}/{bed}"
+
+
+def bed_info(bed_id):
+    info = bed_directory.get(bed_id, {})
+    return (info.get('patient_name', 'Unknown patient'),
+            info.get('room', f"Bed {bed_id}"))
+
+
+def emit_for_bed(event, data, bed_id):
+    # A browser joins either one bed's room or the ward room, so it never gets an event twice
+    socketio.emit(event, data, to=f"bed:{bed_id}")
+    socketio.emit(event, data, to='ward')
+
+
+def finish_trace(alert, received_at):
+    # Last two hops of the alert's trace: received here, then handed to Socket.IO
+    if alert.trace:
+        traces.record(stamp(stamp(alert.trace, 'dashboard_in', received_at), 'emitted', clock.now()))
+
 
 # MQTT connection callback
 def on_connect(client, userdata, flags, rc):
     print("Connected to MQTT broker with code:", rc)
-    client.subscribe("nurse/dashboard")
+    client.subscribe(router.subscriptions())
+    clock.subscribe(client)
 
 # MQTT message handling
 def on_message(client, userdata, msg):
-    try:
-        raw = json.loads(msg.payload.decode())
-        print(f"MQTT message received on topic '{msg.topic}': {raw}")
+    if not router.dispatch(msg.topic, msg):
+        print(f"No route for MQTT topic '{msg.topic}'")
 
-        # Extract basic alert data
-        timestamp = raw.get("timestamp", "")
-        alert_type = raw.get("alert_type", "Unknown")
-        source = raw.get("source", "Unknown")
-        details = raw.get("details", "No details provided.")
-        priority = raw.get("priority", "MEDIUM")
-        distances = raw.get("distances", [])
+# Dashboard alerts for one bed; ward and bed are None on the single-bed topic
+def handle_dashboard(msg, ward=None, bed=None):
+    received_at = clock.now()
+    try:
+        alert = decode_message(msg.topic, msg.payload)
+        print(f"MQTT message received on topic '{msg.topic}': {alert}")
+        bed_id = bed_id_for(ward, bed)
+        state = bed_states.setdefault(bed_id, {'camera_active': False, 'last_alert': None, 'priority': None})
 
         # Flag handling for camera activation to control dashboard live streaming
-        if source.lower() == 'camera_activation':
-            activate = raw.get("activate", False)
-            socketio.emit('camera_activation', {
-                'activate': activate
-            })
-            print(f"Camera activation set to {activate}")
+        if isinstance(alert, CameraActivation):
+            state['camera_active'] = alert.activate
+            emit_for_bed('camera_activation', {
+                'activate': alert.activate,
+                'bed_id': bed_id
+            }, bed_id)
+            finish_trace(alert, received_at)
+            print(f"Camera activation for {bed_id} set to {alert.activate}")
             return
 
+        # Extract basic alert data
+        timestamp = alert.timestamp
+        alert_type = alert.alert_type
+        source = alert.source
+        details = alert.details or "No details provided."
+        priority = alert.priority
+        distances = alert.distances or []
+
         # Display logic
-        patient_name = patient_names[0]
-        room_no = room_numbers[0]  
-        in_bed = "No" if "out" in alert_type.lower() or "fall" in alert_type.lower() else "Yes"
+        patient_name, room_no = bed_info(bed_id)
+        # An incident's type is generic; what happened is in its details, e.g. "Out of bed + Fall"
+        condition = details if alert_type == 'INCIDENT' else alert_type
+        in_bed = "No" if "out" in condition.lower() or "fall" in condition.lower() else "Yes"
 
         formatted_time = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%S.%f").strftime("%Y-%m-%d %H:%M:%S")
 
@@ -132,58 +150,100 @@ def on_message(client, userdata, msg):
         # Add distance if source is proximity
         if source.lower() == "proximity":
             message += f"📏 Distance            : {distances}\n"
+        elif alert_type == 'INCIDENT':
+            # confidence is optional on the wire; an incident without one still has to reach the nurse
+            confidence = f" ({alert.confidence:.0%} confidence)" if alert.confidence is not None else ""
+            message += f"🔗 Sensors             : {', '.join(alert.sources)}{confidence}\n"
 
         message += f"⏰ Timestamp           : {formatted_time}"
 
+        state['last_alert'] = alert_type
+        state['priority'] = priority
+
         # Emit notification to frontend
-        socketio.emit('new_notification', {
+        emit_for_bed('new_notification', {
             "message": message,
             "priority": priority,
-            "timestamp": formatted_time
-        })
+            "timestamp": formatted_time,
+            "bed_id": bed_id
+        }, bed_id)
+        finish_trace(alert, received_at)
         print("Notification emitted to frontend")
 
     except Exception as e:
         print("MQTT error:", e)
 
+# Topic routes; the ward and bed levels of a per-bed topic are passed to the handler
+router = TopicRouter()
+router.add('ward/{ward}/bed/{bed}/nurse/dashboard', handle_dashboard)
+router.add('nurse/dashboard', handle_dashboard)
+
 # MQTT binding
 mqtt_client.on_connect = on_connect
 mqtt_client.on_message = on_message
 
-# Connect to broker
-try:
-    mqtt_client.connect("192.168.61.254", 1883, 60)
-    mqtt_client.loop_start()
-except Exception as e:
-    print(f"Failed to connect to MQTT broker: {e}")
+# Connect to broker on startup rather than on import
+def connect_mqtt():
+    try:
+        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        mqtt_client.loop_start()
+    except Exception as e:
+        print(f"Failed to connect to MQTT broker: {e}")
 
 # Flask Routes
 @app.route('/')
 def index():
-    return render_template('dashboard.html', 
-                           data=dashboard_data,
-                           room_number=dashboard_data['room_number'])
+    # /?bed=<ward>/<bed> shows one bed; without it the page shows every bed in the ward
+    bed_id = request.args.get('bed', '')
+    title = f"{bed_info(bed_id)[1]} - Patient Monitoring" if bed_id else "Ward Overview - Patient Monitoring"
+    return render_template('dashboard.html',
+                           bed_id=bed_id,
+                           title=title)
+
+@app.route('/latency')
+def latency():
+    # Per-hop and total latency percentiles (ms) for each kind of sensor, and this node's clock offset
+    return jsonify({'clock': clock.stats(), 'traces': traces.report()})
+
+@app.route('/beds')
+def beds():
+    return jsonify({bed_id: {'patient_name': bed_info(bed_id)[0], 'room': bed_info(bed_id)[1], **state}
+                    for bed_id, state in bed_states.items()})
+
+@app.route('/frames')
+def frame_stats():
+    # Frames sent, delivered (acked) and dropped for a newer one, per viewer
+    return jsonify(frames.stats())
 
 # Socket.IO handlers
 @socketio.on('video_frame')
 def handle_video_frame(data):
     global latest_frame
+    # Relayed as it came, so JPEG bytes go out as a binary attachment without being decoded or copied
     latest_frame = data
-    print("Received video_frame and broadcasting update_frame")
-    socketio.emit('update_frame', latest_frame)
+    frames.publish(latest_frame)
 
 @socketio.on('request_latest_frame')
 def handle_frame_request():
-    if latest_frame:
-        emit('update_frame', latest_frame)
-    else:
+    # A dashboard asks for frames once connected; the camera never does, so it gets none back
+    bed_id = request.args.get('bed')
+    frames.watch(request.sid, latest_frame, label=f"{request.remote_addr} ({'bed ' + bed_id if bed_id else 'ward'})")
+    if not latest_frame:
         print("No frame available to send")
 
 @socketio.on('connect')
 def test_connect():
-    print("Client connected")
+    bed_id = request.args.get('bed')
+    join_room(f"bed:{bed_id}" if bed_id else 'ward')
+    print(f"Client connected ({'bed ' + bed_id if bed_id else 'ward overview'})")
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    frames.forget(request.sid)
 
 # Run the app
 if __name__ == "__main__":
+    connect_mqtt()
+    socketio.start_background_task(expire_frame_acks)
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
 
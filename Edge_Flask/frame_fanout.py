@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+class _Mailbox:
+    __slots__ = ('label', 'waiting', 'in_flight', 'sent_at', 'token', 'sent', 'delivered', 'dropped', 'timeouts')
+
+    def __init__(self, label):
+        self.label = label
+        self.waiting = None    # Newest frame not yet sent
+        self.in_flight = False
+        self.sent_at = 0.0
+        self.token = 0         # Which send an ack belongs to
+        self.sent = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.timeouts = 0
+
+
+class FrameFanout:
+    """Live video frames to every dashboard viewer, latest frame wins.
+
+    Each viewer has a mailbox holding one frame in flight and at most one
+    waiting. A new frame replaces the waiting one, which counts as dropped
+    for that viewer, and the waiting frame goes out when the viewer acks the
+    one in flight. Each viewer gets frames as fast as it shows them, and the
+    server never queues frames for a slow tablet, which would hold up
+    everyone else's. A frame not acked within ack_timeout seconds counts as
+    lost, so a viewer whose ack went missing is not stalled for good. That
+    is checked when a new frame is offered and by expire(), which the
+    server calls on a timer so a lost ack is also given up on after the
+    camera stops sending.
+
+    send(viewer, frame, ack) delivers one frame; the viewer calls ack() once
+    the frame is on screen.
+    """
+    def __init__(self, send, ack_timeout=2.0, clock=time.monotonic):
+        self.send = send
+        self.ack_timeout = ack_timeout
+        self.clock = clock
+        self._viewers = {}  # viewer id -> _Mailbox
+        self._lock = threading.Lock()
+
+    def watch(self, viewer, frame=None, label=None):
+        """Start sending frames to viewer, beginning with frame (the latest) if there is one."""
+        with self._lock:
+            self._viewers.setdefault(viewer, _Mailbox(label or viewer))
+        if frame is not None:
+            self._offer(viewer, frame)
+
+    def forget(self, viewer):
+        with self._lock:
+            self._viewers.pop(viewer, None)
+
+    def publish(self, frame):
+        """Offer a new frame to every viewer."""
+        with self._lock:
+            viewers = list(self._viewers)
+        for viewer in viewers:
+            self._offer(viewer, frame)
+
+    def expire(self):
+        """Give up on frames not acked within ack_timeout, sending each such viewer its waiting frame."""
+        sends = []
+        with self._lock:
+            now = self.clock()
+            for viewer, box in self._viewers.items():
+                if not box.in_flight or now - box.sent_at < self.ack_timeout:
+                    continue
+                box.timeouts += 1
+                box.in_flight = False
+                frame, box.waiting = box.waiting, None
+                if frame is not None:
+                    sends.append((viewer, frame, self._start(box)))
+        for viewer, frame, token in sends:
+            self._send(viewer, frame, token)
+
+    def _offer(self, viewer, frame):
+        with self._lock:
+            box = self._viewers.get(viewer)
+            if box is None:
+                return
+            if box.in_flight:
+                if self.clock() - box.sent_at < self.ack_timeout:
+                    if box.waiting is not None:
+                        box.dropped += 1
+                    box.waiting = frame
+                    return
+                box.timeouts += 1
+            if box.waiting is not None:
+                box.dropped += 1  # Superseded by this one
+                box.waiting = None
+            token = self._start(box)
+        self._send(viewer, frame, token)
+
+    def _start(self, box):
+        # Caller holds the lock
+        box.in_flight = True
+        box.sent_at = self.clock()
+        box.token += 1
+        box.sent += 1
+        return box.token
+
+    def _send(self, viewer, frame, token):
+        self.send(viewer, frame, lambda *args: self._acked(viewer, token))
+
+    def _acked(self, viewer, token):
+        with self._lock:
+            box = self._viewers.get(viewer)
+            if box is None:
+                return
+            box.delivered += 1
+            if token != box.token:
+                return  # A late ack for a frame already given up on; its successor is in flight
+            box.in_flight = False
+            frame, box.waiting = box.waiting, None
+            if frame is None:
+                return
+            token = self._start(box)
+        self._send(viewer, frame, token)
+
+    def stats(self):
+        """Per-viewer frames sent, delivered (acked), dropped for a newer one and timed out."""
+        with self._lock:
+            return {viewer: {'label': box.label, 'sent': box.sent, 'delivered': box.delivered,
+                             'dropped': box.dropped, 'timeouts': box.timeouts}
+                    for viewer, box in self._viewers.items()}